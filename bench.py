@@ -0,0 +1,341 @@
+"""
+Benchmark a scenari per gli hot path di update e draw.
+
+Ogni scenario gira un Game vero sotto il driver video dummy di SDL, con
+input scriptati e seed fissa, e misura ms/frame per fase (le fasi di
+Simulation.step e del disegno) più le allocazioni per frame (tracemalloc,
+in un passaggio separato per non sporcare i tempi). L'output è JSON e due
+run si confrontano con --compare.
+
+    python bench.py -o base.json
+    python bench.py -o new.json --scenarios guards_40 pulse_storm
+    python bench.py --compare base.json new.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import numpy as np
+import pygame
+
+import game
+
+REPO = os.path.dirname(os.path.abspath(__file__))
+
+# Fasi misurate: metodi dell'istanza avvolti da un timer (il gioco non ne sa nulla)
+UPDATE_PHASES = ('_update_player', '_update_guards', '_update_particles', '_update_pulses', '_resolve_outcome')
+DRAW_PHASES = ('_draw_vision', '_draw_entities', 'draw_ui')
+PERCENTILES = (50, 95, 99)
+
+
+class BenchGame(game.Game):
+    """Game senza menu bloccante; il livello parte subito."""
+    def menu(self):
+        self.init_level()
+
+
+class PhaseTimer:
+    """Accumula i ms spesi in ogni fase durante il frame corrente."""
+    def __init__(self):
+        self.current = {}
+        self.frames = {}
+
+    def wrap(self, obj, name):
+        method = getattr(obj, name)
+        current = self.current
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                current[name] = current.get(name, 0.0) + (time.perf_counter() - start) * 1000.0
+        setattr(obj, name, timed)
+
+    def end_frame(self):
+        for name, ms in self.current.items():
+            self.frames.setdefault(name, []).append(ms)
+        self.current.clear()
+
+
+# -----------------------------
+# Scenari
+# -----------------------------
+def _immortal(g):
+    # Il player non deve uscire dallo scenario: niente game over né cambio livello
+    g.player.lives = 10 ** 6
+    g.game_over = False
+
+
+def _refill(player):
+    player.rem_eq_transformations = game.MAX_EQ_TRANSFORMATIONS
+    player.rem_nop_transformations = game.MAX_NOP_TRANSFORMATIONS
+    player.rem_combo_transformations = game.MAX_COMBO_TRANSFORMATIONS
+    player.rem_ibp_transformations = game.MAX_IBP_TRANSFORMATIONS
+
+
+def _wander(frame):
+    """Percorso scriptato: quadrato che si ripete ogni 240 frame."""
+    side = (frame // 60) % 4
+    return ((1, 0), (0, 1), (-1, 0), (0, -1))[side]
+
+
+def _with_guards(g, n):
+    g.max_guards = n
+    g.level = max(1, n - 2)  # min(level + 2, max_guards) = n guardie
+    g.init_level()
+
+
+def guards_scenario(n):
+    def setup(g):
+        _with_guards(g, n)
+
+    def frame(g, i):
+        return _wander(i)
+    return setup, frame
+
+
+def pulse_storm_setup(g):
+    # 40 guardie: la broad-phase impulsi/guardie deve avere qualcosa da colpire
+    _with_guards(g, 40)
+
+
+def pulse_storm_frame(g, i):
+    # COMBO ogni 6 tick: 10 impulsi a raggiera, sempre una ventina in volo
+    if i % 6 == 0:
+        _refill(g.player)
+        g.apply_action(game.TransformationType.COMBO)
+    return _wander(i)
+
+
+def teleports_setup(g):
+    g.init_level()
+
+
+def teleports_frame(g, i):
+    # 30 tick di vita: 4 effetti nuovi per tick tengono ~100 effetti vivi
+    for _ in range(4):
+        x = g.rng.randint(40, game.GAME_WIDTH - 40)
+        y = g.rng.randint(40, game.GAME_HEIGHT - 40)
+        g.particle_effects.append(game.ParticleEffect(x, y, 'teleport', g.particle_pool, g.rng))
+    return _wander(i)
+
+
+def ghost_trail_setup(g):
+    g.init_level()
+
+
+def ghost_trail_frame(g, i):
+    if i % 150 == 0:
+        _refill(g.player)
+        g.apply_action(game.TransformationType.NOP_INSERTION)
+    return _wander(i)
+
+
+def scoreboard_setup(g):
+    g.init_level()
+    for n in range(2000):
+        g.scoreboard.add(f"bench{n}", n % 50)
+    g._load_scoreboard()
+
+
+def scoreboard_frame(g, i):
+    if i % 30 == 0:
+        g._append_score(f"bench-live{i}", i % 60)
+    return _wander(i)
+
+
+SCENARIOS = {
+    'guards_5': guards_scenario(5),
+    'guards_15': guards_scenario(15),
+    'guards_40': guards_scenario(40),
+    'pulse_storm': (pulse_storm_setup, pulse_storm_frame),
+    'teleports_100': (teleports_setup, teleports_frame),
+    'ghost_trail': (ghost_trail_setup, ghost_trail_frame),
+    'scoreboard': (scoreboard_setup, scoreboard_frame),
+}
+
+
+# -----------------------------
+# Esecuzione
+# -----------------------------
+def _new_game(name, seed, dirty):
+    g = BenchGame(dirty_rendering=dirty)
+    g.restart(seed)
+    SCENARIOS[name][0](g)
+    _immortal(g)
+    return g
+
+
+def _frame(g, step, i):
+    dx, dy = step(g, i)
+    g.step(dx, dy)
+    _immortal(g)
+    g.draw()
+
+
+def run_scenario(name, frames=600, warmup=60, seed=1, dirty=False, allocations=True):
+    """Un passaggio a tempo e (opzionale) uno sotto tracemalloc; restituisce il dict dei risultati."""
+    step = SCENARIOS[name][1]
+
+    g = _new_game(name, seed, dirty)
+    timer = PhaseTimer()
+    for phase in UPDATE_PHASES + DRAW_PHASES:
+        timer.wrap(g, phase)
+    timer.wrap(g, 'step')
+    timer.wrap(g, 'draw')
+    for i in range(warmup):
+        _frame(g, step, i)
+    timer.current.clear()
+    for i in range(warmup, warmup + frames):
+        start = time.perf_counter()
+        _frame(g, step, i)
+        timer.current['frame'] = (time.perf_counter() - start) * 1000.0
+        timer.end_frame()
+    g.scoreboard.close()
+    g.level_generator.shutdown()
+
+    result = {
+        'frames': frames,
+        'guards': len(g.guards),
+        'phases': {phase: summarize(ms) for phase, ms in sorted(timer.frames.items())},
+    }
+    if allocations:
+        result['alloc'] = measure_allocations(name, min(frames, 200), warmup, seed, dirty)
+    return result
+
+
+def measure_allocations(name, frames, warmup, seed, dirty):
+    """KiB allocati al picco e blocchi netti per frame (tracemalloc attivo solo qui)."""
+    step = SCENARIOS[name][1]
+    g = _new_game(name, seed, dirty)
+    for i in range(warmup):
+        _frame(g, step, i)
+    peak_kib, net_blocks = [], []
+    tracemalloc.start()
+    try:
+        for i in range(warmup, warmup + frames):
+            tracemalloc.reset_peak()
+            before, _ = tracemalloc.get_traced_memory()
+            blocks = sys.getallocatedblocks()
+            _frame(g, step, i)
+            _, peak = tracemalloc.get_traced_memory()
+            peak_kib.append((peak - before) / 1024.0)
+            net_blocks.append(sys.getallocatedblocks() - blocks)
+    finally:
+        tracemalloc.stop()
+    g.scoreboard.close()
+    g.level_generator.shutdown()
+    return {'peak_kib': summarize(peak_kib), 'net_blocks': summarize(net_blocks)}
+
+
+def summarize(values):
+    arr = np.asarray(values, dtype=np.float64)
+    out = {f'p{p}': round(float(np.percentile(arr, p)), 4) for p in PERCENTILES}
+    out['mean'] = round(float(arr.mean()), 4)
+    return out
+
+
+def _commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(names, frames, seed, dirty, allocations):
+    results = {
+        'meta': {
+            'commit': _commit(),
+            'python': platform.python_version(),
+            'pygame': pygame.version.ver,
+            'numpy': np.__version__,
+            'frames': frames,
+            'seed': seed,
+            'dirty_rendering': dirty,
+        },
+        'scenarios': {},
+    }
+    # Classifica e cache asset in una cartella temporanea: il bench non tocca quelle vere
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            for name in names:
+                print(f"{name}...", file=sys.stderr, flush=True)
+                results['scenarios'][name] = run_scenario(name, frames, seed=seed, dirty=dirty,
+                                                          allocations=allocations)
+        finally:
+            os.chdir(cwd)
+            pygame.quit()
+    return results
+
+
+def compare(base_path, new_path, stat='p50', threshold=0.10):
+    """Tabella new/base per scenario e fase; True se qualche fase peggiora oltre threshold."""
+    with open(base_path) as f:
+        base = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    print(f"{base['meta'].get('commit')} -> {new['meta'].get('commit')} ({stat} ms/frame)")
+    regressed = False
+    for name, scenario in new['scenarios'].items():
+        old = base['scenarios'].get(name)
+        if old is None:
+            continue
+        print(f"\n{name}")
+        for phase, stats in scenario['phases'].items():
+            before = old['phases'].get(phase, {}).get(stat)
+            after = stats[stat]
+            if not before:
+                continue
+            ratio = after / before
+            mark = ''
+            if ratio > 1 + threshold:
+                mark = '  <-- peggiorato'
+                regressed = True
+            elif ratio < 1 - threshold:
+                mark = '  migliorato'
+            print(f"  {phase:<20} {before:9.3f} -> {after:9.3f}  x{ratio:5.2f}{mark}")
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark a scenari di update/draw")
+    parser.add_argument("--scenarios", nargs="+", choices=sorted(SCENARIOS), default=list(SCENARIOS),
+                        help="scenari da eseguire (default: tutti)")
+    parser.add_argument("--frames", type=int, default=600, help="frame misurati per scenario")
+    parser.add_argument("--seed", type=int, default=1, help="seed della partita")
+    parser.add_argument("--dirty-rects", action="store_true", help="misura il rendering a dirty-rect")
+    parser.add_argument("--no-alloc", action="store_true", help="salta il passaggio con tracemalloc")
+    parser.add_argument("-o", "--output", help="file JSON dei risultati (default: stdout)")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "NEW"), help="confronta due JSON")
+    parser.add_argument("--stat", default="p50", help="statistica per --compare (p50, p95, p99, mean)")
+    parser.add_argument("--threshold", type=float, default=0.10, help="soglia di regressione per --compare")
+    args = parser.parse_args()
+
+    if args.compare:
+        raise SystemExit(1 if compare(*args.compare, stat=args.stat, threshold=args.threshold) else 0)
+
+    results = run_suite(args.scenarios, args.frames, args.seed, args.dirty_rects, not args.no_alloc)
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,413 @@
+"""
+Ambiente stile Gym sopra Simulation, per allenare e valutare bot.
+
+    env = MazeEnv(seed=0)
+    obs, info = env.reset()
+    obs, reward, terminated, truncated, info = env.step(encode_action(1, 0))
+
+VecMazeEnv fa girare num_envs istanze indipendenti in un pool di processi;
+osservazioni, reward e flag stanno in shared memory, quindi a ogni step fra
+processi viaggia solo un messaggio di sincronizzazione.
+"""
+import math
+import multiprocessing as mp
+import os
+import random
+from multiprocessing import shared_memory
+
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import numpy as np
+
+from game import (GAME_HEIGHT, GAME_WIDTH, GUARD_COLORS, MAX_COMBO_TRANSFORMATIONS,
+                  MAX_EQ_TRANSFORMATIONS, MAX_GUARDS, MAX_IBP_TRANSFORMATIONS,
+                  MAX_NOP_TRANSFORMATIONS, TICK_RATE, TILE_SIZE, Simulation, TransformationType)
+
+# -----------------------------
+# Azioni
+# -----------------------------
+# azione = movimento (9 combinazioni dx/dy) + 9 * trasformazione (0 = nessuna, 1-5 = tasti)
+MOVES = [(dx, dy) for dy in (-1, 0, 1) for dx in (-1, 0, 1)]
+ACTION_COUNT = len(MOVES) * 6
+
+
+def encode_action(dx, dy, transformation=0):
+    """Azione intera da movimento (-1/0/1) e trasformazione (0-5 o TransformationType)."""
+    return MOVES.index((dx, dy)) + len(MOVES) * int(getattr(transformation, 'value', transformation))
+
+
+def decode_action(action):
+    """(dx, dy, TransformationType | None) dall'azione intera."""
+    trans, move = divmod(int(action), len(MOVES))
+    dx, dy = MOVES[move]
+    return dx, dy, TransformationType(trans) if trans else None
+
+
+# -----------------------------
+# Osservazioni
+# -----------------------------
+PLAYER_FEATURES = 12  # posizione, vite, trasformazione, timer, colore, cariche, livello
+GOAL_FEATURES = 2     # posizione relativa
+GUARD_FEATURES = 6    # presente, dx, dy, cos/sin direzione, vede il colore attuale
+OBS_SIZE = PLAYER_FEATURES + GOAL_FEATURES + GUARD_FEATURES * MAX_GUARDS
+
+
+def observe(sim, out):
+    """
+    Scrive l'osservazione di sim in out (float32, OBS_SIZE) senza allocare
+    il vettore: le guardie sono ordinate dalla più vicina, posizioni relative
+    al player e normalizzate sull'area di gioco.
+    """
+    p = sim.player
+    px, py = p.x, p.y
+    color = GUARD_COLORS.index(p.color) + 1 if p.color in GUARD_COLORS else 0
+    out[:PLAYER_FEATURES] = (
+        px / GAME_WIDTH, py / GAME_HEIGHT, p.lives / 5.0,
+        p.transformation.value / 5.0, p.transformation_timer / (3.0 * TICK_RATE),
+        color / len(GUARD_COLORS),
+        p.rem_eq_transformations / MAX_EQ_TRANSFORMATIONS,
+        p.rem_nop_transformations / MAX_NOP_TRANSFORMATIONS,
+        p.rem_combo_transformations / MAX_COMBO_TRANSFORMATIONS,
+        p.rem_ibp_transformations / MAX_IBP_TRANSFORMATIONS,
+        float(p.detected), min(sim.level, 20) / 20.0,
+    )
+    base = PLAYER_FEATURES
+    out[base] = (sim.goal.x - px) / GAME_WIDTH
+    out[base + 1] = (sim.goal.y - py) / GAME_HEIGHT
+
+    guards = out[base + GOAL_FEATURES:].reshape(MAX_GUARDS, GUARD_FEATURES)
+    guards[:] = 0.0
+    engine = sim.guard_engine
+    if engine is not None:
+        gx, gy, facing, codes = engine.x, engine.y, engine.facing_direction, engine.color_code
+    else:
+        gx = np.array([g.x for g in sim.guards], dtype=np.float64)
+        gy = np.array([g.y for g in sim.guards], dtype=np.float64)
+        facing = np.array([g.facing_direction for g in sim.guards], dtype=np.float64)
+        codes = np.array([GUARD_COLORS.index(g.detection_color) if g.detection_color is not None else -1
+                          for g in sim.guards], dtype=np.int64)
+    if len(gx) == 0:
+        return out
+    dx = (gx - px) / GAME_WIDTH
+    dy = (gy - py) / GAME_HEIGHT
+    order = np.argsort(dx * dx + dy * dy)[:MAX_GUARDS]
+    n = len(order)
+    guards[:n, 0] = 1.0
+    guards[:n, 1] = dx[order]
+    guards[:n, 2] = dy[order]
+    guards[:n, 3] = np.cos(facing[order])
+    guards[:n, 4] = np.sin(facing[order])
+    # stesso filtro colore di Guard.detect_player: chi può vederti col colore attuale
+    if p.color == 'blimblau':
+        guards[:n, 5] = 1.0
+    else:
+        guards[:n, 5] = (codes[order] == -1) | (codes[order] == color - 1)
+    return out
+
+
+class GridObserver:
+    """
+    Stato del livello come tensore (canali, righe, colonne) sulla griglia
+    TILE_SIZE, scritto in un buffer preallocato: niente pygame, niente
+    surface. La mappa dei muri si calcola una volta per livello (dall'indice
+    LOS di WallGrid) e poi si copia; il resto sono poche scritture per entità.
+    """
+    WALLS, GUARD, GUARD_COS, GUARD_SIN, GUARD_COLOR, PLAYER, PLAYER_COLOR, GOAL, PULSE = range(9)
+    CHANNELS = 9
+    ROWS = -(-GAME_HEIGHT // TILE_SIZE)
+    COLS = -(-GAME_WIDTH // TILE_SIZE)
+    shape = (CHANNELS, ROWS, COLS)
+
+    def __init__(self):
+        self._wall_grid = None
+        self._walls = np.zeros((self.ROWS, self.COLS), dtype=np.float32)
+
+    def _wall_map(self, wall_grid):
+        """Frazione di mezze celle LOS occupate per ogni tile (0, 0.25 ... 1)."""
+        los = np.frombuffer(wall_grid.occupancy, dtype=np.uint8).reshape(wall_grid.los_rows, wall_grid.los_cols)
+        k = TILE_SIZE // wall_grid.LOS_CELL
+        padded = np.zeros((self.ROWS * k, self.COLS * k), dtype=np.float32)
+        padded[:los.shape[0], :los.shape[1]] = los[:self.ROWS * k, :self.COLS * k]
+        self._walls[:] = padded.reshape(self.ROWS, k, self.COLS, k).mean(axis=(1, 3))
+        self._wall_grid = wall_grid
+
+    def __call__(self, sim, out):
+        if sim.wall_grid is not self._wall_grid:
+            self._wall_map(sim.wall_grid)
+        out[self.WALLS] = self._walls
+        out[1:] = 0.0
+        half = TILE_SIZE // 2
+        rows, cols = self.ROWS - 1, self.COLS - 1
+        colors = len(GUARD_COLORS)
+
+        # poche guardie: un loop Python su liste costa meno delle op NumPy su array minuscoli
+        engine = sim.guard_engine
+        if engine is not None:
+            guards = zip(engine.x.tolist(), engine.y.tolist(),
+                         engine.facing_direction.tolist(), engine.color_code.tolist())
+        else:
+            guards = ((g.x, g.y, g.facing_direction,
+                       GUARD_COLORS.index(g.detection_color) if g.detection_color is not None else -1)
+                      for g in sim.guards)
+        for x, y, facing, code in guards:
+            r = min(max(int((y + half) // TILE_SIZE), 0), rows)
+            c = min(max(int((x + half) // TILE_SIZE), 0), cols)
+            out[self.GUARD, r, c] = 1.0
+            out[self.GUARD_COS, r, c] = math.cos(facing)
+            out[self.GUARD_SIN, r, c] = math.sin(facing)
+            # 0 = vede tutti i colori, altrimenti (indice + 1) / colori
+            out[self.GUARD_COLOR, r, c] = (code + 1) / colors
+
+        p = sim.player
+        r = min(max(int((p.y + half) // TILE_SIZE), 0), rows)
+        c = min(max(int((p.x + half) // TILE_SIZE), 0), cols)
+        out[self.PLAYER, r, c] = 1.0
+        # 0 = camuffato (blimblau), altrimenti (indice + 1) / colori come per le guardie
+        if p.color in GUARD_COLORS:
+            out[self.PLAYER_COLOR, r, c] = (GUARD_COLORS.index(p.color) + 1) / colors
+
+        goal_r, goal_c = int(sim.goal.y // TILE_SIZE), int(sim.goal.x // TILE_SIZE)
+        out[self.GOAL, goal_r:goal_r + 2, goal_c:goal_c + 2] = 1.0  # il goal occupa 2x2 tile
+
+        for pulse in sim.nop_pulses:
+            r = int(pulse.y // TILE_SIZE)
+            c = int(pulse.x // TILE_SIZE)
+            if 0 <= r <= rows and 0 <= c <= cols:
+                out[self.PULSE, r, c] = 1.0
+        return out
+
+
+OBSERVATIONS = {'vector': (OBS_SIZE,), 'grid': GridObserver.shape}
+
+
+# -----------------------------
+# Ambiente singolo
+# -----------------------------
+# Sotto questo cap di guardie il path a oggetti è più veloce del GuardEngine (overhead NumPy per tick)
+ENGINE_MIN_GUARDS = 40
+
+
+class MazeEnv:
+    """
+    reset()/step() con la firma di Gymnasium sopra una Simulation headless.
+    Reward: +1 per ogni goal raggiunto, -1 per ogni rilevamento (vita persa),
+    step_penalty a ogni tick. terminated = game over, truncated = max_steps.
+    observation: 'vector' (observe) o 'grid' (GridObserver sulla griglia TILE_SIZE).
+    use_guard_engine=None sceglie il GuardEngine solo da ENGINE_MIN_GUARDS guardie in su.
+    """
+    action_count = ACTION_COUNT
+
+    def __init__(self, seed=None, max_steps=3600, use_guard_engine=None, procedural=True,
+                 max_guards=MAX_GUARDS, step_penalty=0.001, observation='vector', obs_buffer=None):
+        self.observation_shape = OBSERVATIONS[observation]
+        self.observe = GridObserver() if observation == 'grid' else observe
+        self.seeds = random.Random(seed)
+        self.max_steps = max_steps
+        if use_guard_engine is None:
+            use_guard_engine = max_guards >= ENGINE_MIN_GUARDS
+        self.use_guard_engine = use_guard_engine
+        self.procedural = procedural
+        self.max_guards = max_guards
+        self.step_penalty = step_penalty
+        self.obs = obs_buffer if obs_buffer is not None else np.zeros(self.observation_shape, dtype=np.float32)
+        self.sim = None
+        self.steps = 0
+
+    def reset(self, seed=None):
+        seed = seed if seed is not None else self.seeds.getrandbits(32)
+        if self.sim is None:
+            self.sim = Simulation(seed=seed, use_guard_engine=self.use_guard_engine,
+                                  max_guards=self.max_guards, procedural=self.procedural)
+            self.sim.init_level()
+        else:
+            self.sim.restart(seed)
+        self.steps = 0
+        return self.observe(self.sim, self.obs), self._info()
+
+    def step(self, action):
+        sim = self.sim
+        dx, dy, transformation = decode_action(action)
+        if transformation is not None:
+            sim.apply_action(transformation)
+        level = sim.level
+        sim.step(dx, dy)
+        self.steps += 1
+        reward = (sim.level - level) - float(sim.player.detected) - self.step_penalty
+        terminated = sim.game_over
+        truncated = not terminated and self.steps >= self.max_steps
+        return self.observe(sim, self.obs), reward, terminated, truncated, self._info()
+
+    def _info(self):
+        return {'level': self.sim.level, 'lives': self.sim.player.lives, 'seed': self.sim.seed}
+
+    def close(self):
+        if self.sim is not None:
+            self.sim.level_generator.shutdown()
+            self.sim = None
+
+
+# -----------------------------
+# Ambienti vettoriali (processi + shared memory)
+# -----------------------------
+_SHARED = {
+    'obs': (None, np.float32),  # forma dal tipo di osservazione
+    'action': ((), np.int64),
+    'reward': ((), np.float32),
+    'terminated': ((), np.bool_),
+    'truncated': ((), np.bool_),
+    'level': ((), np.int32),
+    'lives': ((), np.int32),
+}
+
+
+def _shapes(observation):
+    return {key: OBSERVATIONS[observation] if shape is None else shape for key, (shape, _) in _SHARED.items()}
+
+
+def _attach(names, num_envs, observation):
+    """Array numpy sulle shared memory (stessa disposizione in padre e figli)."""
+    blocks, arrays = [], {}
+    shapes = _shapes(observation)
+    for key, (_, dtype) in _SHARED.items():
+        shape = shapes[key]
+        shm = shared_memory.SharedMemory(name=names[key])
+        blocks.append(shm)
+        arrays[key] = np.ndarray((num_envs,) + shape, dtype=dtype, buffer=shm.buf)
+    return blocks, arrays
+
+
+def _worker(conn, names, num_envs, lo, hi, seed, env_kwargs):
+    blocks, shared = _attach(names, num_envs, env_kwargs.get('observation', 'vector'))
+    envs = [MazeEnv(seed=seed + i, obs_buffer=shared['obs'][i], **env_kwargs) for i in range(lo, hi)]
+    try:
+        while True:
+            cmd = conn.recv()
+            if cmd == 'step':
+                actions = shared['action']
+                for i, env in zip(range(lo, hi), envs):
+                    _, reward, terminated, truncated, info = env.step(actions[i])
+                    if terminated or truncated:
+                        _, info = env.reset()  # autoreset: obs è già quella del nuovo episodio
+                    shared['reward'][i] = reward
+                    shared['terminated'][i] = terminated
+                    shared['truncated'][i] = truncated
+                    shared['level'][i] = info['level']
+                    shared['lives'][i] = info['lives']
+            elif cmd == 'reset':
+                for i, env in zip(range(lo, hi), envs):
+                    _, info = env.reset()
+                    shared['level'][i] = info['level']
+                    shared['lives'][i] = info['lives']
+            elif cmd == 'close':
+                break
+            conn.send(True)
+    except (EOFError, KeyboardInterrupt):
+        pass
+    finally:
+        for env in envs:
+            env.close()
+        del shared
+        for shm in blocks:
+            shm.close()
+        conn.close()
+
+
+class VecMazeEnv:
+    """
+    num_envs MazeEnv divisi su workers processi. step(actions) restituisce
+    array (num_envs, ...) come i vector env di Gymnasium; gli episodi finiti
+    ripartono da soli (l'osservazione restituita è già quella nuova).
+    """
+    def __init__(self, num_envs, seed=0, workers=None, **env_kwargs):
+        self.num_envs = num_envs
+        workers = max(1, min(num_envs, workers or os.cpu_count() or 1))
+        self._blocks = []
+        names = {}
+        shapes = _shapes(env_kwargs.get('observation', 'vector'))
+        for key, (_, dtype) in _SHARED.items():
+            size = max(1, int(np.prod((num_envs,) + shapes[key])) * np.dtype(dtype).itemsize)
+            shm = shared_memory.SharedMemory(create=True, size=size)
+            self._blocks.append(shm)
+            names[key] = shm.name
+        self._shared = {key: np.ndarray((num_envs,) + shapes[key], dtype=dtype, buffer=shm.buf)
+                        for (key, (_, dtype)), shm in zip(_SHARED.items(), self._blocks)}
+        ctx = mp.get_context('fork' if 'fork' in mp.get_all_start_methods() else 'spawn')
+        bounds = np.linspace(0, num_envs, workers + 1).astype(int).tolist()
+        self._conns, self._procs = [], []
+        for lo, hi in zip(bounds, bounds[1:]):
+            parent, child = ctx.Pipe()
+            proc = ctx.Process(target=_worker, args=(child, names, num_envs, lo, hi, seed, env_kwargs),
+                               daemon=True)
+            proc.start()
+            child.close()
+            self._conns.append(parent)
+            self._procs.append(proc)
+
+    def _broadcast(self, cmd):
+        for conn in self._conns:
+            conn.send(cmd)
+        for conn in self._conns:
+            conn.recv()
+
+    def _infos(self):
+        return {'level': self._shared['level'].copy(), 'lives': self._shared['lives'].copy()}
+
+    def reset(self):
+        self._broadcast('reset')
+        return self._shared['obs'].copy(), self._infos()
+
+    def step(self, actions):
+        self._shared['action'][:] = actions
+        self._broadcast('step')
+        s = self._shared
+        return (s['obs'].copy(), s['reward'].copy(), s['terminated'].copy(),
+                s['truncated'].copy(), self._infos())
+
+    def close(self):
+        if not self._procs:
+            return
+        for conn in self._conns:
+            try:
+                conn.send('close')
+            except (BrokenPipeError, OSError):
+                pass
+        for proc in self._procs:
+            proc.join(timeout=5)
+            if proc.is_alive():
+                proc.terminate()
+        for conn in self._conns:
+            conn.close()
+        self._shared = {}
+        for shm in self._blocks:
+            shm.close()
+            shm.unlink()
+        self._procs = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+    parser = argparse.ArgumentParser(description="Throughput dell'ambiente vettoriale (azioni casuali)")
+    parser.add_argument("--envs", type=int, default=os.cpu_count() or 1, help="istanze in parallelo")
+    parser.add_argument("--workers", type=int, default=None, help="processi (default: un core ciascuno)")
+    parser.add_argument("--steps", type=int, default=2000, help="step vettoriali da misurare")
+    parser.add_argument("--observation", choices=sorted(OBSERVATIONS), default="vector", help="tipo di osservazione")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    with VecMazeEnv(args.envs, workers=args.workers, observation=args.observation) as venv:
+        venv.reset()
+        start = time.perf_counter()
+        for _ in range(args.steps):
+            # tutte le azioni, trasformazioni comprese (impulsi, teletrasporti, cambi colore)
+            venv.step(rng.integers(0, ACTION_COUNT, size=args.envs))
+        elapsed = time.perf_counter() - start
+    total = args.steps * args.envs
+    print(f"{total} step in {elapsed:.2f}s: {total / elapsed:.0f} step/s "
+          f"({total / elapsed * 3600 / 1e6:.1f} M step/ora)")
@@ -2,8 +2,21 @@ import pygame
 import random
 import math
 import os
+import bisect
+import hashlib
+import heapq
+import json
+import mmap
+import sqlite3
+import struct
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
 
+import numpy as np
+
 # -----------------------------
 # Inizializzazione Pygame
 # -----------------------------
@@ -20,7 +33,13 @@ GAME_WIDTH = SCREEN_WIDTH - SIDEBAR_WIDTH
 GAME_HEIGHT = 768     # <--- SCREEN_HEIGHT - 40px di bottom sidebar
 
 TILE_SIZE = 40
-FPS = 60
+
+# Loop di gioco a passo fisso: velocità e timer delle entità sono per tick
+TICK_RATE = 60
+TICK_DT = 1.0 / TICK_RATE
+MAX_TICKS_PER_FRAME = 5   # oltre, si salta il resto: meglio rallentare che spirale di recupero
+RENDER_FPS = 120          # tetto del render (interpolato fra gli ultimi due tick)
+SNAP_DISTANCE = TILE_SIZE * 2  # salti più lunghi (teletrasporto, reset) non si interpolano
 
 # Colori
 BLACK = (0, 0, 0)
@@ -39,6 +58,13 @@ MAX_NOP_TRANSFORMATIONS = 5
 MAX_COMBO_TRANSFORMATIONS = 2
 MAX_IBP_TRANSFORMATIONS = 2
 
+MAX_GUARDS = 15  # cap guardie per livello (path a oggetti)
+ALERT_TICKS = 5 * 60  # inseguimento dopo un rilevamento (tick)
+
+ASSET_CACHE_DIR = ".asset_cache"  # sprite già scalati, cotti su disco
+
+GUARD_COLORS = ['blue', 'red', 'green', 'yellow', 'purple', 'black', 'white']
+
 class TransformationType(Enum):
     NONE = 0
     SUBSTITUTION = 1  # Cambia aspetto
@@ -50,87 +76,396 @@ class TransformationType(Enum):
 # -----------------------------
 # Sprite Manager con cache/scaling
 # -----------------------------
+class AssetCache:
+    """
+    Cache su disco delle surface finali già scalate, in pixel raw (RGB/RGBA)
+    letti via mmap. La chiave include mtime del sorgente, TILE_SIZE e
+    big_factor; i miss vengono ricostruiti in parallelo su un thread pool.
+    """
+    MAGIC = b'SGA1'
+    HEADER = struct.Struct('<4sHHBh')  # magic, w, h, canali, alpha di surface (-1 = nessuno)
+
+    def __init__(self, directory=ASSET_CACHE_DIR, workers=None):
+        self.directory = directory
+        self.workers = workers or min(8, os.cpu_count() or 2)
+
+    @staticmethod
+    def file_key(path, *extra):
+        """Chiave per un asset su file: cambia se il file viene toccato."""
+        st = os.stat(path)
+        return ('file', path, st.st_mtime_ns, st.st_size, TILE_SIZE) + extra
+
+    def _path(self, name, key):
+        digest = hashlib.sha1(repr(key).encode()).hexdigest()[:16]
+        return os.path.join(self.directory, f"{name}-{key[0]}-{digest}.raw")
+
+    def load(self, name, key):
+        path = self._path(name, key)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                magic, w, h, channels, alpha = self.HEADER.unpack_from(mm)
+                if magic != self.MAGIC:
+                    return None
+                view = memoryview(mm)[self.HEADER.size:]
+                try:
+                    raw = pygame.image.frombuffer(view, (w, h), 'RGBA' if channels == 4 else 'RGB')
+                    surf = raw.copy()
+                    del raw
+                finally:
+                    view.release()
+        except (OSError, ValueError, struct.error) as e:
+            print(f"Cache asset illeggibile {path}: {e}")
+            return None
+        if alpha >= 0:
+            surf.set_alpha(alpha)
+        return surf
+
+    def store(self, name, key, surf):
+        channels = 4 if surf.get_flags() & pygame.SRCALPHA else 3
+        alpha = surf.get_alpha()
+        header = self.HEADER.pack(self.MAGIC, surf.get_width(), surf.get_height(), channels,
+                                  -1 if alpha is None or channels == 3 else alpha)
+        path = self._path(name, key)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, 'wb') as f:
+                f.write(header)
+                f.write(pygame.image.tobytes(surf, 'RGBA' if channels == 4 else 'RGB'))
+            os.replace(tmp, path)
+        except OSError:
+            # niente .tmp a metà lasciati sul disco (es. disco pieno)
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        # via le versioni vecchie dello stesso asset (stessa origine: procedurale o file)
+        prefix = f"{name}-{key[0]}-"
+        for old in os.listdir(self.directory):
+            if old.startswith(prefix) and old.endswith('.raw') and old != os.path.basename(path):
+                try:
+                    os.remove(os.path.join(self.directory, old))
+                except OSError:
+                    pass  # già rimosso da un altro processo o directory in sola lettura: resta lì
+
+    def _build_and_store(self, name, key, build, cached=True):
+        surf = build()
+        if surf is not None and cached:
+            try:
+                self.store(name, key, surf)
+            except OSError as e:
+                # la cache è opzionale: disco pieno o sola lettura non fermano il gioco
+                print(f"Cache asset non scrivibile {name}: {e}")
+        return surf
+
+    def get_many(self, jobs):
+        """jobs: {nome: (chiave, build)} -> {nome: surface}; i miss si costruiscono in parallelo."""
+        results, misses = {}, {}
+        for name, (key, build) in jobs.items():
+            surf = self.load(name, key)
+            if surf is None:
+                misses[name] = (key, build)
+            else:
+                results[name] = surf
+        if misses:
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                cached = True
+            except OSError as e:
+                # niente directory di cache: si costruisce e basta
+                print(f"Cache asset non disponibile {self.directory}: {e}")
+                cached = False
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                futures = {name: pool.submit(self._build_and_store, name, key, build, cached)
+                           for name, (key, build) in misses.items()}
+            for name, future in futures.items():
+                surf = future.result()
+                if surf is not None:
+                    results[name] = surf
+        return results
+
+
+def load_image_32(path):
+    """Carica un'immagine in una surface 32 bit con alpha, senza bisogno del display."""
+    img = pygame.image.load(path)
+    surf = pygame.Surface(img.get_size(), pygame.SRCALPHA)
+    surf.blit(img, (0, 0))
+    return surf
+
+
+def display_ready(surf):
+    """convert_alpha se c'è una finestra (blit più veloci), altrimenti la surface com'è."""
+    return surf.convert_alpha() if pygame.display.get_surface() is not None else surf
+
+
+class SpriteTable(dict):
+    """
+    Dizionario nome -> surface di compatibilità: chi sostituisce uno sprite
+    (es. load_custom_sprites) segna l'atlas da reimpaccare.
+    """
+    def __init__(self, on_change):
+        super().__init__()
+        self._on_change = on_change
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self._on_change()
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._on_change()
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        self._on_change()
+
+
+class CatHandles:
+    """Handle atlas di un colore di gatto: normale, big, big specchiato, ghost per alpha."""
+    __slots__ = ('small', 'big', 'big_flipped', 'ghosts')
+
+    def __init__(self, small, big, big_flipped, ghosts):
+        self.small = small
+        self.big = big
+        self.big_flipped = big_flipped
+        self.ghosts = ghosts
+
+
 class SpriteManager:
-    """Gestisce il caricamento e la creazione degli sprite; pre-scala dove serve."""
-    def __init__(self):
-        self.sprites = {}
+    """
+    Gestisce il caricamento e la creazione degli sprite; pre-scala dove serve.
+    Gli sprite delle entità (varianti big/specchiate/ghost incluse) stanno in un
+    unico atlas: si disegnano con blit di sotto-rettangoli via handle interi.
+    """
+    ROTATION_STEP = 1  # gradi: quantizzazione della cache di rotazione
+    SPRITE_VERSION = 1  # da incrementare se cambia il disegno procedurale (invalida la cache)
+    LAYER_SPRITES = ('floor', 'wall', 'circuit', 'background')  # finiscono nei layer statici, non nell'atlas
+    GHOST_ALPHAS = (50, 70, 90, 110, 130)  # alpha dei ghost steps (50 + i*20, max 5 passi)
+    ATLAS_WIDTH = 512
+
+    def __init__(self, asset_cache=None):
+        self._atlas_dirty = True
+        self.sprites = SpriteTable(self._mark_dirty)
         self.big_factor = 1.5  # scala “grande” usata da player/guard
+        self.rotation_cache = {}
+        self.asset_cache = asset_cache
+        self._handles = {}  # nome (o variante) -> handle intero, stabile fra reimpaccamenti
+        self._regions = []  # handle -> Rect nell'atlas
+        self._atlas = None
+        self._cats = {}
         self.load_sprites()
 
+    def _mark_dirty(self):
+        self._atlas_dirty = True
+
+    # ---------- atlas ----------
+    def handle(self, name):
+        """Handle intero dello sprite name (o variante 'nome:flip', 'nome:alpha50')."""
+        h = self._handles.get(name)
+        if h is None:
+            h = self._handles[name] = len(self._handles)
+            self._atlas_dirty = True
+        return h
+
+    @property
+    def atlas(self):
+        if self._atlas_dirty:
+            self._pack()
+        return self._atlas
+
+    def region(self, handle):
+        if self._atlas_dirty:
+            self._pack()
+        return self._regions[handle]
+
+    def cat_handles(self, color):
+        """Handle del gatto color, fallback risolto una volta sola per colore."""
+        if self._atlas_dirty:
+            self._pack()
+        cat = self._cats.get(color)
+        if cat is None:
+            small = self._cat_key(color, big=False)
+            big = self._cat_key(color, big=True)
+            cat = CatHandles(self.handle(small), self.handle(big), self.handle(f'{big}:flip'),
+                             tuple(self.handle(f'{small}:alpha{a}') for a in self.GHOST_ALPHAS))
+            self._cats[color] = cat
+            if self._atlas_dirty:  # handle nuovi (colore mai visto): reimpacca subito
+                self._pack()
+        return cat
+
+    def _variant(self, name):
+        base, _, variant = name.partition(':')
+        surf = self.sprites.get(base)
+        if surf is None:
+            return pygame.Surface((TILE_SIZE, TILE_SIZE), pygame.SRCALPHA)
+        if variant == 'flip':
+            return pygame.transform.flip(surf, True, False)
+        if variant.startswith('alpha'):
+            ghost = surf.copy()
+            ghost.set_alpha(255)
+            ghost.fill((255, 255, 255, int(variant[5:])), special_flags=pygame.BLEND_RGBA_MULT)
+            return ghost
+        alpha = surf.get_alpha()
+        if alpha is not None and alpha < 255 and surf.get_flags() & pygame.SRCALPHA:
+            # alpha di surface "cotto" nei pixel: l'atlas non ne ha uno per sprite
+            surf = surf.copy()
+            surf.set_alpha(255)
+            surf.fill((255, 255, 255, alpha), special_flags=pygame.BLEND_RGBA_MULT)
+        return surf
+
+    def _pack(self):
+        """Reimpacca l'atlas (shelf packing per altezza); gli handle restano gli stessi."""
+        self._cats = {}
+        # gatti: versione big mancante generata ora invece che al primo draw
+        for key in [k for k in self.sprites if k.startswith('cat_') and not k.endswith('_big')]:
+            if f'{key}_big' not in self.sprites:
+                dict.__setitem__(self.sprites, f'{key}_big', self._big(self.sprites[key]))
+        for key in self.sprites:
+            if key in self.LAYER_SPRITES:
+                continue
+            self.handle(key)
+            if key.startswith('cat_'):
+                if key.endswith('_big'):
+                    self.handle(f'{key}:flip')
+                else:
+                    for a in self.GHOST_ALPHAS:
+                        self.handle(f'{key}:alpha{a}')
+        self._atlas_dirty = False
+        surfaces = [self._variant(name) for name in self._handles]
+        order = sorted(range(len(surfaces)), key=lambda h: -surfaces[h].get_height())
+        width = max([self.ATLAS_WIDTH] + [s.get_width() for s in surfaces])
+        regions = [None] * len(surfaces)
+        x = y = shelf = 0
+        for h in order:
+            w, hh = surfaces[h].get_size()
+            if x + w > width:
+                x, y, shelf = 0, y + shelf, 0
+            regions[h] = pygame.Rect(x, y, w, hh)
+            x += w
+            shelf = max(shelf, hh)
+        atlas = pygame.Surface((width, max(1, y + shelf)), pygame.SRCALPHA)
+        # BLEND_RGBA_ADD su fondo trasparente = copia esatta dei pixel (alpha compreso)
+        atlas.blits([(surfaces[h], regions[h].topleft, None, pygame.BLEND_RGBA_ADD)
+                     for h in range(len(surfaces))], doreturn=False)
+        if pygame.display.get_surface() is not None:
+            atlas = atlas.convert_alpha()
+        self._atlas = atlas
+        self._regions = regions
+
     def load_sprites(self):
-        # Procedurali
-        self.create_cat_sprites()
-        self.create_guard_sprite()
-        self.create_background_tiles()
-        self.create_goal_sprite()
-        self.create_particle_effects()
+        # Procedurali (con asset_cache: cotti su disco, al riavvio solo letti)
+        jobs = {}
+        jobs.update(self.create_cat_sprites())
+        jobs.update(self.create_guard_sprite())
+        jobs.update(self.create_background_tiles())
+        jobs.update(self.create_goal_sprite())
+        jobs.update(self.create_particle_effects())
+        key = ('proc', self.SPRITE_VERSION, TILE_SIZE, self.big_factor)
+        self.sprites.update(self.bake({name: (key, build) for name, build in jobs.items()}))
+        # 8 direzioni della random walk (atan2 su -1/0/1), ruotate una volta sola
+        self.prerotate('guard_big', range(0, 360, 45))
+
+    def bake(self, jobs):
+        """{nome: (chiave, build)} -> {nome: surface}, passando dalla cache su disco se c'è."""
+        if self.asset_cache is None:
+            built = {name: build() for name, (key, build) in jobs.items()}
+            return {name: surf for name, surf in built.items() if surf is not None}
+        return self.asset_cache.get_many(jobs)
 
     def _scale(self, surf, w, h):
         return pygame.transform.smoothscale(surf, (int(w), int(h)))
 
+    def _big(self, surf):
+        return self._scale(surf, TILE_SIZE*self.big_factor, TILE_SIZE*self.big_factor)
+
+    def get_rotated(self, key, angle):
+        """
+        Sprite ruotato di angle gradi e offset dal centro al topleft.
+        Gli angoli quantizzati (le 8 direzioni delle guardie) sono in cache,
+        quelli arbitrari vengono ruotati al volo.
+        """
+        source = self.sprites[key]
+        q = round(angle / self.ROTATION_STEP) * self.ROTATION_STEP
+        if abs(angle - q) > 1e-6:
+            rotated = pygame.transform.rotate(source, angle)
+            return rotated, (-(rotated.get_width() // 2), -(rotated.get_height() // 2))
+        cache_key = (key, q % 360)
+        entry = self.rotation_cache.get(cache_key)
+        # l'entry vale solo finché lo sprite sorgente non viene sostituito (asset custom)
+        if entry is None or entry[0] is not source:
+            rotated = pygame.transform.rotate(source, q)
+            entry = (source, rotated, (-(rotated.get_width() // 2), -(rotated.get_height() // 2)))
+            self.rotation_cache[cache_key] = entry
+        return entry[1], entry[2]
+
+    def prerotate(self, key, angles):
+        for angle in angles:
+            self.get_rotated(key, angle)
+
     def create_cat_sprites(self):
         colors = {
             'blue': BLUE, 'red': RED, 'green': GREEN, 'yellow': YELLOW,
             'purple': PURPLE, 'black': BLACK, 'white': WHITE
         }
+        jobs = {}
         for color_name, color in colors.items():
-            cat_surf = pygame.Surface((TILE_SIZE, TILE_SIZE), pygame.SRCALPHA)
-            # Corpo
-            pygame.draw.ellipse(cat_surf, color, (4, 8, 24, 20))
-            # Testa
-            pygame.draw.circle(cat_surf, color, (16, 12), 8)
-            # Orecchie
-            pygame.draw.polygon(cat_surf, color, [(8, 8), (6, 2), (12, 6)])
-            pygame.draw.polygon(cat_surf, color, [(20, 6), (24, 2), (22, 8)])
-            # Occhi
-            pygame.draw.circle(cat_surf, WHITE, (12, 11), 3)
-            pygame.draw.circle(cat_surf, WHITE, (20, 11), 3)
-            pygame.draw.circle(cat_surf, BLACK, (13, 11), 2)
-            pygame.draw.circle(cat_surf, BLACK, (19, 11), 2)
-            # Naso
-            pygame.draw.polygon(cat_surf, BLACK, [(16, 14), (14, 16), (18, 16)])
-            # Coda
-            pygame.draw.arc(cat_surf, color, (20, 12, 16, 16), 0, math.pi/2, 3)
-
-            self.sprites[f'cat_{color_name}'] = cat_surf
+            jobs[f'cat_{color_name}'] = lambda color=color: self._draw_cat(color)
             # versione big
-            big = self._scale(cat_surf, TILE_SIZE*self.big_factor, TILE_SIZE*self.big_factor)
-            self.sprites[f'cat_{color_name}_big'] = big
-    def get_cat_sprite(self, color, big=False):
-        """Restituisce la surface del gatto richiesta con fallback intelligente."""
+            jobs[f'cat_{color_name}_big'] = lambda color=color: self._big(self._draw_cat(color))
+        return jobs
+
+    def _draw_cat(self, color):
+        cat_surf = pygame.Surface((TILE_SIZE, TILE_SIZE), pygame.SRCALPHA)
+        # Corpo
+        pygame.draw.ellipse(cat_surf, color, (4, 8, 24, 20))
+        # Testa
+        pygame.draw.circle(cat_surf, color, (16, 12), 8)
+        # Orecchie
+        pygame.draw.polygon(cat_surf, color, [(8, 8), (6, 2), (12, 6)])
+        pygame.draw.polygon(cat_surf, color, [(20, 6), (24, 2), (22, 8)])
+        # Occhi
+        pygame.draw.circle(cat_surf, WHITE, (12, 11), 3)
+        pygame.draw.circle(cat_surf, WHITE, (20, 11), 3)
+        pygame.draw.circle(cat_surf, BLACK, (13, 11), 2)
+        pygame.draw.circle(cat_surf, BLACK, (19, 11), 2)
+        # Naso
+        pygame.draw.polygon(cat_surf, BLACK, [(16, 14), (14, 16), (18, 16)])
+        # Coda
+        pygame.draw.arc(cat_surf, color, (20, 12, 16, 16), 0, math.pi/2, 3)
+        return cat_surf
+
+    def _cat_key(self, color, big=False):
+        """Chiave dello sprite gatto con fallback: cat_color -> cat_blue -> qualunque cat_*."""
         key = f'cat_{color}_big' if big else f'cat_{color}'
-
-        # Se esiste direttamente la chiave richiesta, restituiscila
-        if key in self.sprites:
-            return self.sprites[key]
-
-        # Se chiedo la big ma esiste la versione normale, scala al volo e cache-ala
-        if big and f'cat_{color}' in self.sprites:
-            scaled = self._scale(self.sprites[f'cat_{color}'],
-                                 int(TILE_SIZE * self.big_factor),
-                                 int(TILE_SIZE * self.big_factor))
-            # cache per future richieste
-            self.sprites[f'cat_{color}_big'] = scaled
-            return scaled
-
+        if key in self.sprites or (big and f'cat_{color}' in self.sprites):
+            return key
         # Fall back preferito: cat_blue_big -> cat_blue -> qualunque cat_*
         if big and 'cat_blue_big' in self.sprites:
-            return self.sprites['cat_blue_big']
+            return 'cat_blue_big'
         if 'cat_blue' in self.sprites:
-            return self.sprites['cat_blue']
-
+            return 'cat_blue'
         # Ultimo resort: trova la prima cat_* (big se richiesta)
         for k in self.sprites:
             if big and k.startswith('cat_') and k.endswith('_big'):
-                return self.sprites[k]
+                return k
             if not big and k.startswith('cat_') and not k.endswith('_big'):
-                return self.sprites[k]
+                return k
+        return key
 
+    def get_cat_sprite(self, color, big=False):
+        """Restituisce la surface del gatto richiesta con fallback intelligente (compatibilità)."""
+        key = self._cat_key(color, big)
+        # Se chiedo la big ma esiste la versione normale, scala al volo e cache-ala
+        if key not in self.sprites and big and key[:-4] in self.sprites:
+            self.sprites[key] = self._big(self.sprites[key[:-4]])
         # Se proprio nulla, crea una surface vuota minimale
-        surf = pygame.Surface((TILE_SIZE, TILE_SIZE), pygame.SRCALPHA)
-        return surf
+        surf = self.sprites.get(key)
+        return surf if surf is not None else pygame.Surface((TILE_SIZE, TILE_SIZE), pygame.SRCALPHA)
 
     def create_guard_sprite(self):
+        return {'guard': self._draw_guard, 'guard_big': lambda: self._big(self._draw_guard())}
+
+    def _draw_guard(self):
         guard_surf = pygame.Surface((TILE_SIZE, TILE_SIZE), pygame.SRCALPHA)
         pygame.draw.rect(guard_surf, DARK_GRAY, (6, 10, 20, 18))
         pygame.draw.rect(guard_surf, RED, (8, 12, 16, 14))
@@ -141,96 +476,489 @@ class SpriteManager:
         pygame.draw.circle(guard_surf, RED, (16, 3), 3)
         pygame.draw.circle(guard_surf, DARK_GRAY, (10, 28), 3)
         pygame.draw.circle(guard_surf, DARK_GRAY, (22, 28), 3)
-        self.sprites['guard'] = guard_surf
-        self.sprites['guard_big'] = self._scale(guard_surf, TILE_SIZE*self.big_factor, TILE_SIZE*self.big_factor)
+        return guard_surf
 
     def create_background_tiles(self):
+        return {'floor': self._draw_floor, 'wall': self._draw_wall, 'circuit': self._draw_circuit}
+
+    def _draw_floor(self):
         floor_tile = pygame.Surface((TILE_SIZE, TILE_SIZE))
         floor_tile.fill((40, 40, 50))
         for i in range(0, TILE_SIZE, 8):
             pygame.draw.line(floor_tile, (35, 35, 45), (i, 0), (i, TILE_SIZE), 1)
             pygame.draw.line(floor_tile, (35, 35, 45), (0, i), (TILE_SIZE, i), 1)
-        self.sprites['floor'] = floor_tile
+        return floor_tile
 
+    def _draw_wall(self):
         wall_tile = pygame.Surface((TILE_SIZE, TILE_SIZE))
         wall_tile.fill((100, 100, 120))
         for y in range(0, TILE_SIZE, 8):
             for x in range(0, TILE_SIZE, 16):
                 offset = 8 if (y // 8) % 2 else 0
                 pygame.draw.rect(wall_tile, (80, 80, 100), (x + offset - 8, y, 15, 7), 1)
-        self.sprites['wall'] = wall_tile
+        return wall_tile
 
+    def _draw_circuit(self):
         circuit_tile = pygame.Surface((TILE_SIZE, TILE_SIZE))
         circuit_tile.fill((20, 30, 40))
         pygame.draw.line(circuit_tile, (0, 100, 100), (0, 16), (32, 16), 2)
         pygame.draw.line(circuit_tile, (0, 100, 100), (16, 0), (16, 32), 2)
         pygame.draw.circle(circuit_tile, (0, 150, 150), (8, 8), 3)
         pygame.draw.circle(circuit_tile, (0, 150, 150), (24, 24), 3)
-        self.sprites['circuit'] = circuit_tile
+        return circuit_tile
 
     def create_goal_sprite(self):
+        return {'goal': self._draw_goal}
+
+    def _draw_goal(self):
         goal_surf = pygame.Surface((TILE_SIZE * 2, TILE_SIZE * 2), pygame.SRCALPHA)
+        rng = random.Random()  # RNG locale: gira su un worker, non tocca lo stream globale
         pygame.draw.rect(goal_surf, (60, 60, 70), (8, 4, 48, 36))
         pygame.draw.rect(goal_surf, (0, 200, 255), (12, 8, 40, 28))
         for i in range(5):
             y = 12 + i * 5
-            pygame.draw.line(goal_surf, GREEN, (14, y), (14 + random.randint(10, 35), y), 1)
+            pygame.draw.line(goal_surf, GREEN, (14, y), (14 + rng.randint(10, 35), y), 1)
         pygame.draw.rect(goal_surf, (40, 40, 50), (24, 40, 16, 8))
         pygame.draw.rect(goal_surf, (40, 40, 50), (16, 48, 32, 4))
-        self.sprites['goal'] = goal_surf
+        return goal_surf
 
     def create_particle_effects(self):
+        return {'teleport_particle': self._draw_teleport_particle, 'ghost_particle': self._draw_ghost_particle}
+
+    def _draw_teleport_particle(self):
         teleport_particle = pygame.Surface((8, 8), pygame.SRCALPHA)
         pygame.draw.circle(teleport_particle, (100, 200, 255), (4, 4), 4)
         pygame.draw.circle(teleport_particle, WHITE, (4, 4), 2)
-        self.sprites['teleport_particle'] = teleport_particle
+        return teleport_particle
 
+    def _draw_ghost_particle(self):
         ghost_particle = pygame.Surface((16, 16), pygame.SRCALPHA)
         ghost_particle.set_alpha(100)
         pygame.draw.circle(ghost_particle, (150, 150, 255), (8, 8), 8)
-        self.sprites['ghost_particle'] = ghost_particle
+        return ghost_particle
+
+# -----------------------------
+# Indici spaziali (muri, guardie)
+# -----------------------------
+class WallGrid:
+    """
+    Indice statico dei muri su celle TILE_SIZE: ogni cella conosce i muri che
+    la toccano, così una query costa in base all'area interrogata e non al
+    numero di muri del livello. Tiene anche una mappa di occupazione più fine
+    (LOS_CELL) per il raycasting DDA della linea di vista e una griglia
+    compressa sui bordi dei muri per i test di collisione delle guardie.
+    """
+    LOS_CELL = TILE_SIZE // 2
+
+    def __init__(self, walls, cell_size=TILE_SIZE):
+        self.walls = list(walls)
+        self.cell_size = cell_size
+        self.cols = GAME_WIDTH // cell_size + 1
+        self.rows = GAME_HEIGHT // cell_size + 1
+        self.cells = [[] for _ in range(self.cols * self.rows)]
+        for wall in self.walls:
+            c0, r0, c1, r1 = self._cell_span(wall)
+            for r in range(r0, r1 + 1):
+                for c in range(c0, c1 + 1):
+                    self.cells[r * self.cols + c].append(wall)
+
+        # Occupazione per il raycasting: cella piena se un muro la tocca
+        lc = self.LOS_CELL
+        self.los_cols = -(-GAME_WIDTH // lc)
+        self.los_rows = -(-GAME_HEIGHT // lc)
+        self.occupancy = bytearray(self.los_cols * self.los_rows)
+        for wall in self.walls:
+            for r in range(max(wall.top // lc, 0), min((wall.bottom - 1) // lc, self.los_rows - 1) + 1):
+                for c in range(max(wall.left // lc, 0), min((wall.right - 1) // lc, self.los_cols - 1) + 1):
+                    self.occupancy[r * self.los_cols + c] = 1
+        # Collisioni delle guardie: griglia con le righe/colonne sui bordi dei muri (ogni cella è
+        # tutta dentro o tutta fuori da un muro, quindi il test è esatto al pixel) e somme cumulate
+        # (integral image): celle piene in un rettangolo con 4 letture
+        clipped = [wall.clip(0, 0, GAME_WIDTH, GAME_HEIGHT) for wall in self.walls]
+        clipped = [wall for wall in clipped if wall.w and wall.h]
+        self.box_xs = np.unique([0, GAME_WIDTH] + [w.left for w in clipped] + [w.right for w in clipped])
+        self.box_ys = np.unique([0, GAME_HEIGHT] + [w.top for w in clipped] + [w.bottom for w in clipped])
+        grid = np.zeros((len(self.box_ys) - 1, len(self.box_xs) - 1), dtype=np.int32)
+        for wall in clipped:
+            c0, c1 = np.searchsorted(self.box_xs, (wall.left, wall.right))
+            r0, r1 = np.searchsorted(self.box_ys, (wall.top, wall.bottom))
+            grid[r0:r1, c0:c1] = 1
+        self.box_sum = np.zeros((grid.shape[0] + 1, grid.shape[1] + 1), dtype=np.int32)
+        self.box_sum[1:, 1:] = grid.cumsum(axis=0).cumsum(axis=1)
+        # pixel -> cella compressa: prima cella toccata da un bordo sinistro (lo) e limite
+        # esclusivo per un bordo destro (hi); una lettura di tabella invece di una ricerca
+        self.box_col_lo, self.box_col_hi = self._edge_tables(self.box_xs, GAME_WIDTH)
+        self.box_row_lo, self.box_row_hi = self._edge_tables(self.box_ys, GAME_HEIGHT)
+        # copie in liste per box_blocked (indici Python, senza overhead NumPy)
+        self._box_tables = tuple(t.tolist() for t in (self.box_col_lo, self.box_col_hi,
+                                                       self.box_row_lo, self.box_row_hi))
+        self._box_sum = self.box_sum.tolist()
+
+    @staticmethod
+    def _edge_tables(edges, limit):
+        pixels = np.arange(limit + 1)
+        lo = np.clip(np.searchsorted(edges, pixels, side='right') - 1, 0, len(edges) - 2)
+        return lo, np.searchsorted(edges, pixels)
+
+    def raycast(self, x0, y0, x1, y1, include_end=True):
+        """
+        DDA sulla mappa di occupazione da (x0, y0) a (x1, y1): frazione t in
+        [0, 1] della prima cella piena attraversata, None se il segmento è
+        libero. La cella di partenza non conta (guardie dentro un muro vedono
+        comunque fuori); con include_end=False non conta neanche quella d'arrivo.
+        """
+        lc = self.LOS_CELL
+        cols, rows, occ = self.los_cols, self.los_rows, self.occupancy
+        cx, cy = int(x0 // lc), int(y0 // lc)
+        ex, ey = int(x1 // lc), int(y1 // lc)
+        dx, dy = x1 - x0, y1 - y0
+        step_x = 1 if dx > 0 else -1
+        step_y = 1 if dy > 0 else -1
+        t_max_x = ((cx + (dx > 0)) * lc - x0) / dx if dx else math.inf
+        t_max_y = ((cy + (dy > 0)) * lc - y0) / dy if dy else math.inf
+        t_delta_x = lc / abs(dx) if dx else math.inf
+        t_delta_y = lc / abs(dy) if dy else math.inf
+        while cx != ex or cy != ey:
+            if t_max_x < t_max_y:
+                t = t_max_x
+                t_max_x += t_delta_x
+                cx += step_x
+            else:
+                t = t_max_y
+                t_max_y += t_delta_y
+                cy += step_y
+            if t > 1:
+                return None
+            if cx == ex and cy == ey and not include_end:
+                return None
+            if not (0 <= cx < cols and 0 <= cy < rows) or occ[cy * cols + cx]:
+                return t
+        return None
+
+    def __iter__(self):
+        return iter(self.walls)
+
+    def __len__(self):
+        return len(self.walls)
+
+    def _cell_span(self, rect):
+        cs = self.cell_size
+        c0 = min(max(rect.left // cs, 0), self.cols - 1)
+        r0 = min(max(rect.top // cs, 0), self.rows - 1)
+        c1 = min(max((rect.right - 1) // cs, 0), self.cols - 1)
+        r1 = min(max((rect.bottom - 1) // cs, 0), self.rows - 1)
+        return c0, r0, c1, r1
+
+    def collides_rect(self, rect):
+        """True se rect interseca almeno un muro."""
+        c0, r0, c1, r1 = self._cell_span(rect)
+        cells, cols = self.cells, self.cols
+        for r in range(r0, r1 + 1):
+            for c in range(c0, c1 + 1):
+                for wall in cells[r * cols + c]:
+                    if rect.colliderect(wall):
+                        return True
+        return False
+
+    def box_blocked(self, x, y, size):
+        """
+        True se il quadrato size x size in (x, y) interseca un muro (come
+        collides_rect, dentro l'area di gioco) con 4 letture della griglia
+        compressa. Usato dalle guardie: la versione batch è boxes_blocked.
+        """
+        x0, y0 = int(x), int(y)
+        col_lo, col_hi, row_lo, row_hi = self._box_tables
+        c0 = col_lo[min(max(x0, 0), GAME_WIDTH)]
+        c1 = max(col_hi[min(max(x0 + size, 0), GAME_WIDTH)], c0 + 1)
+        r0 = row_lo[min(max(y0, 0), GAME_HEIGHT)]
+        r1 = max(row_hi[min(max(y0 + size, 0), GAME_HEIGHT)], r0 + 1)
+        total = self._box_sum
+        return (total[r1][c1] - total[r0][c1] - total[r1][c0] + total[r0][c0]) > 0
+
+    def boxes_blocked(self, xs, ys, size):
+        """box_blocked per array di posizioni (maschera booleana)."""
+        x0, y0 = xs.astype(np.int64), ys.astype(np.int64)
+        c0 = self.box_col_lo[np.clip(x0, 0, GAME_WIDTH)]
+        c1 = np.maximum(self.box_col_hi[np.clip(x0 + size, 0, GAME_WIDTH)], c0 + 1)
+        r0 = self.box_row_lo[np.clip(y0, 0, GAME_HEIGHT)]
+        r1 = np.maximum(self.box_row_hi[np.clip(y0 + size, 0, GAME_HEIGHT)], r0 + 1)
+        total = self.box_sum
+        return (total[r1, c1] - total[r0, c1] - total[r1, c0] + total[r0, c0]) > 0
+
+    def collides_point(self, x, y):
+        """True se il punto (x, y) cade dentro un muro."""
+        c = min(max(int(x) // self.cell_size, 0), self.cols - 1)
+        r = min(max(int(y) // self.cell_size, 0), self.rows - 1)
+        for wall in self.cells[r * self.cols + c]:
+            if wall.collidepoint(x, y):
+                return True
+        return False
+
+class GuardBroadPhase:
+    """
+    Griglia uniforme dei centri delle guardie, ricostruita a ogni tick: ogni
+    impulso NOP testa solo le guardie nelle celle vicine. Le guardie spinte
+    vengono spostate di cella subito, così gli impulsi successivi le trovano.
+    """
+    def __init__(self, cell_size=TILE_SIZE * 2):
+        self.cell_size = cell_size
+        self.cells = {}
+
+    def build(self, xs, ys):
+        """xs/ys: centri delle guardie, nello stesso ordine di Simulation.guards."""
+        cs = self.cell_size
+        cells = {}
+        for i, (gx, gy) in enumerate(zip(xs, ys)):
+            key = (int(gx // cs), int(gy // cs))
+            bucket = cells.get(key)
+            if bucket is None:
+                cells[key] = [i]
+            else:
+                bucket.append(i)
+        self.cells = cells
+
+    def query(self, x, y, reach):
+        """Indici delle guardie nelle celle entro reach da (x, y), in ordine crescente."""
+        cs = self.cell_size
+        found = []
+        for cy in range(int((y - reach) // cs), int((y + reach) // cs) + 1):
+            for cx in range(int((x - reach) // cs), int((x + reach) // cs) + 1):
+                bucket = self.cells.get((cx, cy))
+                if bucket:
+                    found.extend(bucket)
+        found.sort()
+        return found
+
+    def move(self, index, old_x, old_y, new_x, new_y):
+        """Aggiorna la cella di una guardia spostata (centri prima/dopo)."""
+        cs = self.cell_size
+        old_key = (int(old_x // cs), int(old_y // cs))
+        new_key = (int(new_x // cs), int(new_y // cs))
+        if old_key == new_key:
+            return
+        self.cells[old_key].remove(index)
+        self.cells.setdefault(new_key, []).append(index)
+
+# -----------------------------
+# Coni di visione (geometria + stamp precalcolati)
+# -----------------------------
+class ConeShape:
+    """
+    Cono di visione per (raggio, ampiezza): mezza apertura precalcolata per il
+    test di rilevamento e uno stamp SRCALPHA per ogni direzione quantizzata,
+    così il disegno è un blit invece di 19 cos/sin + polygon per guardia.
+    """
+    COLOR = (255, 50, 50, 40)
+
+    def __init__(self, radius, viewing_angle):
+        self.radius = radius
+        self.viewing_angle = viewing_angle
+        self.half_angle = math.radians(viewing_angle / 2)
+        self.stamps = {}
+
+    def contains(self, dx, dy, facing):
+        """True se l'offset (dx, dy) dal centro cade nel cono orientato verso facing."""
+        distance = math.sqrt(dx**2 + dy**2)
+        if distance >= self.radius:
+            return False
+        angle_diff = abs(math.atan2(dy, dx) - facing)
+        if angle_diff > math.pi:
+            angle_diff = 2 * math.pi - angle_diff
+        return angle_diff < self.half_angle
+
+    def points(self, cx, cy, facing):
+        points = [(cx, cy)]
+        for angle_offset in range(-self.viewing_angle//2, self.viewing_angle//2 + 1, 5):
+            angle = facing + math.radians(angle_offset)
+            points.append((cx + math.cos(angle) * self.radius, cy + math.sin(angle) * self.radius))
+        return points
+
+    def stamp(self, facing):
+        """(surface, offset centro->topleft) per facing quantizzato al grado, altrimenti None."""
+        degrees = math.degrees(facing)
+        q = round(degrees)
+        if abs(degrees - q) > 1e-6:
+            return None
+        entry = self.stamps.get(q % 360)
+        if entry is None:
+            c = self.radius + 1
+            surf = pygame.Surface((c * 2 + 1, c * 2 + 1), pygame.SRCALPHA)
+            pygame.draw.polygon(surf, self.COLOR, self.points(c, c, math.radians(q)))
+            entry = (surf, (-c, -c))
+            self.stamps[q % 360] = entry
+        return entry
+
+
+_CONE_SHAPES = {}
+
+def cone_shape(radius, viewing_angle):
+    """ConeShape condivisa tra tutte le guardie con lo stesso raggio/ampiezza."""
+    shape = _CONE_SHAPES.get((radius, viewing_angle))
+    if shape is None:
+        shape = _CONE_SHAPES[(radius, viewing_angle)] = ConeShape(radius, viewing_angle)
+    return shape
+
+
+def merge_rects(rects):
+    """Fonde i rect sovrapposti finché restano solo rect disgiunti."""
+    merged = []
+    for rect in rects:
+        rect = pygame.Rect(rect)
+        i = rect.collidelist(merged)
+        while i != -1:
+            rect.union_ip(merged.pop(i))
+            i = rect.collidelist(merged)
+        merged.append(rect)
+    return merged
 
 # -----------------------------
 # Effetti/Entità
 # -----------------------------
+class ParticlePool:
+    """
+    Pool unico di particelle su array piatti (posizione, velocità, vita, colore).
+    update è vettoriale, draw usa una cache di sprite circolari pre-renderizzati
+    per (size, bucket di alpha, colore) e un solo Surface.blits per frame.
+    """
+    ALPHA_BUCKET = 16
+
+    def __init__(self, capacity=2048):
+        self.x = np.zeros(capacity, dtype=np.float64)
+        self.y = np.zeros(capacity, dtype=np.float64)
+        self.vx = np.zeros(capacity, dtype=np.float64)
+        self.vy = np.zeros(capacity, dtype=np.float64)
+        self.life = np.zeros(capacity, dtype=np.int64)
+        self.color = np.zeros((capacity, 3), dtype=np.uint8)
+        self.active = np.zeros(capacity, dtype=bool)
+        self.free = list(range(capacity - 1, -1, -1))
+        self.count = 0
+        self.sprite_cache = {}
+
+    def _grow(self):
+        old = len(self.x)
+        for name in ('x', 'y', 'vx', 'vy', 'life', 'color', 'active'):
+            arr = getattr(self, name)
+            grown = np.zeros((old * 2,) + arr.shape[1:], dtype=arr.dtype)
+            grown[:old] = arr
+            setattr(self, name, grown)
+        self.free = list(range(old * 2 - 1, old - 1, -1)) + self.free
+
+    def spawn(self, xs, ys, vxs, vys, lifes, colors):
+        """Alloca len(xs) particelle e restituisce gli slot occupati."""
+        n = len(xs)
+        while len(self.free) < n:
+            self._grow()
+        slots = np.array([self.free.pop() for _ in range(n)], dtype=np.int64)
+        self.x[slots] = xs
+        self.y[slots] = ys
+        self.vx[slots] = vxs
+        self.vy[slots] = vys
+        self.life[slots] = lifes
+        self.color[slots] = colors
+        self.active[slots] = True
+        self.count += n
+        return slots
+
+    def release(self, slots):
+        """Libera gli slot ancora vivi (es. effetti tagliati dal cap)."""
+        slots = slots[self.active[slots]]
+        self.active[slots] = False
+        self.life[slots] = 0
+        self.free.extend(slots.tolist())
+        self.count -= len(slots)
+
+    def clear(self):
+        self.active[:] = False
+        self.life[:] = 0
+        self.free = list(range(len(self.x) - 1, -1, -1))
+        self.count = 0
+
+    def update(self):
+        if self.count == 0:
+            return
+        a = np.flatnonzero(self.active)
+        self.x[a] += self.vx[a]
+        self.y[a] += self.vy[a]
+        self.life[a] -= 1
+        self.vx[a] *= 0.95
+        self.vy[a] *= 0.95
+        dead = a[self.life[a] <= 0]
+        if len(dead):
+            self.active[dead] = False
+            self.free.extend(dead.tolist())
+            self.count -= len(dead)
+
+    def bounds(self, slots):
+        """Rect che contiene le particelle vive degli slot dati (None se nessuna)."""
+        slots = slots[self.active[slots]]
+        if len(slots) == 0:
+            return None
+        x0, x1 = self.x[slots].min(), self.x[slots].max()
+        y0, y1 = self.y[slots].min(), self.y[slots].max()
+        return pygame.Rect(int(x0) - 6, int(y0) - 6, int(x1 - x0) + 13, int(y1 - y0) + 13)
+
+    def _sprite(self, size, alpha, color):
+        key = (size, alpha, color)
+        sprite = self.sprite_cache.get(key)
+        if sprite is None:
+            sprite = pygame.Surface((size * 2, size * 2), pygame.SRCALPHA)
+            pygame.draw.circle(sprite, (*color, alpha), (size, size), size)
+            self.sprite_cache[key] = sprite
+        return sprite
+
+    def draw(self, screen, slots=None):
+        if self.count == 0:
+            return
+        a = np.flatnonzero(self.active) if slots is None else slots[self.active[slots]]
+        life = self.life[a]
+        size = life // 6
+        visible = size > 0
+        a, life, size = a[visible], life[visible], size[visible]
+        alpha = np.minimum(life * 8, 255) // self.ALPHA_BUCKET * self.ALPHA_BUCKET
+        px = (self.x[a] - size).tolist()
+        py = (self.y[a] - size).tolist()
+        colors = [tuple(c) for c in self.color[a].tolist()]
+        sprite = self._sprite
+        screen.blits([(sprite(s, al, c), (x, y))
+                      for s, al, c, x, y in zip(size.tolist(), alpha.tolist(), colors, px, py)],
+                     doreturn=False)
+
+
 class ParticleEffect:
-    """Sistema di particelle per effetti visivi"""
-    def __init__(self, x, y, effect_type):
-        self.particles = []
+    """Sistema di particelle per effetti visivi (le particelle vivono in un ParticlePool)"""
+    def __init__(self, x, y, effect_type, pool, rng=random):
+        self.pool = pool
         self.x = x
         self.y = y
+        self.slots = np.zeros(0, dtype=np.int64)
+        self.remaining = 0
         if effect_type == 'teleport':
+            xs, ys, vxs, vys, colors = [], [], [], [], []
             for _ in range(20):
-                angle = random.uniform(0, math.pi * 2)
-                speed = random.uniform(2, 5)
-                self.particles.append({
-                    'x': x, 'y': y,
-                    'vx': math.cos(angle) * speed,
-                    'vy': math.sin(angle) * speed,
-                    'life': 30,
-                    'color': (100, 200, random.randint(200, 255))
-                })
+                angle = rng.uniform(0, math.pi * 2)
+                speed = rng.uniform(2, 5)
+                xs.append(x)
+                ys.append(y)
+                vxs.append(math.cos(angle) * speed)
+                vys.append(math.sin(angle) * speed)
+                colors.append((100, 200, rng.randint(200, 255)))
+            self.slots = pool.spawn(xs, ys, vxs, vys, [30] * 20, colors)
+            self.remaining = 30
 
     def update(self):
-        for particle in self.particles[:]:
-            particle['x'] += particle['vx']
-            particle['y'] += particle['vy']
-            particle['life'] -= 1
-            particle['vx'] *= 0.95
-            particle['vy'] *= 0.95
-            if particle['life'] <= 0:
-                self.particles.remove(particle)
-        return len(self.particles) > 0
+        """Il movimento lo fa ParticlePool.update; qui si conta solo la vita residua."""
+        self.remaining -= 1
+        return self.remaining > 0
+
+    def release(self):
+        self.pool.release(self.slots)
+        self.remaining = 0
 
     def draw(self, screen):
-        for particle in self.particles:
-            alpha = particle['life'] * 8
-            size = particle['life'] // 6
-            if size > 0:
-                s = pygame.Surface((size * 2, size * 2), pygame.SRCALPHA)
-                pygame.draw.circle(s, (*particle['color'], min(alpha, 255)),
-                                   (size, size), size)
-                screen.blit(s, (particle['x'] - size, particle['y'] - size))
+        self.pool.draw(screen, self.slots)
+
+    def bounds(self):
+        return self.pool.bounds(self.slots)
 
 class NopPulse:
     """Impulso NOP: piccolo proiettile che respinge le guardie"""
@@ -242,7 +970,7 @@ class NopPulse:
         self.life = life
         self.radius = radius
 
-    def update(self, walls):
+    def update(self, wall_grid):
         self.x += self.vx
         self.y += self.vy
         self.life -= 1
@@ -251,10 +979,8 @@ class NopPulse:
         if self.y < 20 or self.y > GAME_HEIGHT - 20:
             self.vy *= -1
         pulse_rect = pygame.Rect(int(self.x - 4), int(self.y - 4), 8, 8)
-        for w in walls:
-            if pulse_rect.colliderect(w):
-                self.life = 0
-                break
+        if wall_grid.collides_rect(pulse_rect):
+            self.life = 0
         return self.life > 0
 
     def draw(self, screen, tiny_font):
@@ -266,10 +992,15 @@ class NopPulse:
         s.blit(text, text_rect)
         screen.blit(s, (self.x - self.radius, self.y - self.radius))
 
+    def bounds(self):
+        return pygame.Rect(int(self.x) - self.radius - 1, int(self.y) - self.radius - 1,
+                           self.radius * 2 + 2, self.radius * 2 + 2)
+
 class Player:
-    def __init__(self, x, y, sprite_manager, lives=3):
+    def __init__(self, x, y, sprite_manager, lives=3, rng=None):
         self.x = x
         self.y = y
+        self.rng = rng if rng is not None else random  # stream della partita (Simulation.rng)
         self.speed = 4
         self.color = 'blimblau'   # colore “fuori palette” = camuffato
         self.original_color = 'blimblau'
@@ -296,7 +1027,7 @@ class Player:
                 self.reset_transformation()
         self.animation_frame = (self.animation_frame + 1) % 60
 
-    def move(self, dx, dy, walls):
+    def move(self, dx, dy, wall_grid):
         if dx > 0:
             self.facing_right = True
         elif dx < 0:
@@ -305,7 +1036,7 @@ class Player:
         new_x = self.x + dx * self.speed
         new_y = self.y + dy * self.speed
         player_rect = pygame.Rect(new_x, new_y, TILE_SIZE-4, TILE_SIZE-4)
-        collision = any(player_rect.colliderect(w) for w in walls)
+        collision = wall_grid.collides_rect(player_rect)
 
         if not collision:
             if self.transformation == TransformationType.NOP_INSERTION:
@@ -320,14 +1051,14 @@ class Player:
 
     def apply_transformation(self, trans_type, game_ref):
         self.transformation = trans_type
-        self.transformation_timer = 180  # 3 secondi a 60 FPS
+        self.transformation_timer = 3 * TICK_RATE  # 3 secondi
 
         colors = ['red', 'green', 'yellow', 'purple', 'black', 'white']
 
         if trans_type == TransformationType.SUBSTITUTION:
             if self.rem_eq_transformations <= 0:
                 return None
-            self.color = random.choice(colors)
+            self.color = self.rng.choice(colors)
             self.rem_eq_transformations -= 1
 
         elif trans_type == TransformationType.PERMUTATION:
@@ -335,7 +1066,7 @@ class Player:
                 return None
             self.teleport_random(game_ref)
             self.rem_ibp_transformations -= 1
-            return ParticleEffect(self.x, self.y, 'teleport')
+            return ParticleEffect(self.x, self.y, 'teleport', game_ref.particle_pool, self.rng)
 
         elif trans_type == TransformationType.NOP_INSERTION:
             if self.rem_nop_transformations <= 0:
@@ -353,7 +1084,7 @@ class Player:
         elif trans_type == TransformationType.COMBO:
             if self.rem_combo_transformations <= 0:
                 return None
-            self.color = random.choice(colors)
+            self.color = self.rng.choice(colors)
             base_angle = math.atan2(self.dir[1], self.dir[0])
             # make a round of NOP pulses in a circle (at least 10)
             num_pulses = 10
@@ -370,23 +1101,19 @@ class Player:
             if self.rem_ibp_transformations <= 0:
                 return None
             self.teleport_random(game_ref)
-            self.color = random.choice(colors)
+            self.color = self.rng.choice(colors)
             self.ghost_steps = []
             self.rem_ibp_transformations -= 1
-            return ParticleEffect(self.x, self.y, 'teleport')
+            return ParticleEffect(self.x, self.y, 'teleport', game_ref.particle_pool, self.rng)
 
     def teleport_random(self, game_ref):
         safe = False
         attempts = 0
         while not safe and attempts < 100:
-            new_x = random.randint(20, GAME_WIDTH - 20 - TILE_SIZE)
-            new_y = random.randint(20, GAME_HEIGHT - 20 - TILE_SIZE)
+            new_x = self.rng.randint(20, GAME_WIDTH - 20 - TILE_SIZE)
+            new_y = self.rng.randint(20, GAME_HEIGHT - 20 - TILE_SIZE)
             player_rect = pygame.Rect(new_x, new_y, TILE_SIZE-4, TILE_SIZE-4)
-            safe = True
-            for wall in game_ref.walls:
-                if player_rect.colliderect(wall):
-                    safe = False
-                    break
+            safe = not game_ref.wall_grid.collides_rect(player_rect)
             if safe:
                 for guard in game_ref.guards:
                     guard_rect = pygame.Rect(guard.x, guard.y, TILE_SIZE, TILE_SIZE)
@@ -404,28 +1131,38 @@ class Player:
         self.ghost_steps = []
 
     def draw(self, screen):
-        # ghost steps
-        if self.transformation == TransformationType.NOP_INSERTION:
-            for i, (gx, gy, frame) in enumerate(self.ghost_steps):
-                alpha = 50 + i * 20
-                ghost_sprite = self.sprite_manager.get_cat_sprite(self.color, big=False).copy()
-                ghost_sprite.set_alpha(alpha)
-                screen.blit(ghost_sprite, (gx, gy))
+        sm = self.sprite_manager
+        cat = sm.cat_handles(self.color)
+        atlas = sm.atlas
+        # ghost steps: varianti con alpha già nell'atlas
+        if self.transformation == TransformationType.NOP_INSERTION and self.ghost_steps:
+            last = len(cat.ghosts) - 1
+            screen.blits([(atlas, (gx, gy), sm.region(cat.ghosts[min(i, last)]))
+                          for i, (gx, gy, frame) in enumerate(self.ghost_steps)], doreturn=False)
 
         if self.detected:
             pygame.draw.circle(screen, RED,
                                (int(self.x + TILE_SIZE//2), int(self.y + TILE_SIZE//2)),
                                TILE_SIZE//2 + 5, 3)
 
-        # usa sprite pre-scalato tramite helper
-        sprite = self.sprite_manager.get_cat_sprite(self.color, big=True)
-        sprite_to_draw = pygame.transform.flip(sprite, True, False) if not self.facing_right else sprite
+        # sprite big (già specchiato nell'atlas se guarda a sinistra)
+        handle = cat.big if self.facing_right else cat.big_flipped
         y_offset = math.sin(self.animation_frame * 0.2) * 2
-        screen.blit(sprite_to_draw, (self.x, self.y + y_offset))
+        screen.blit(atlas, (self.x, self.y + y_offset), sm.region(handle))
+
+    def bounds(self):
+        """Area occupata da sprite big, cerchio di rilevamento e ghost steps."""
+        size = int(TILE_SIZE * 1.5) + 12
+        rect = pygame.Rect(int(self.x) - 6, int(self.y) - 6, size, size)
+        if self.transformation == TransformationType.NOP_INSERTION:
+            for gx, gy, _ in self.ghost_steps:
+                rect.union_ip(pygame.Rect(int(gx) - 1, int(gy) - 1, TILE_SIZE + 2, TILE_SIZE + 2))
+        return rect
 
 
 class Guard:
-    def __init__(self, x, y, patrol_path, sprite_manager, detection_color=None):
+    def __init__(self, x, y, patrol_path, sprite_manager, detection_color=None, wall_grid=None, nav=None,
+                 flow=None):
         self.x = x
         self.y = y
         self.patrol_path = patrol_path
@@ -434,78 +1171,427 @@ class Guard:
         self.detection_radius = 80
         self.detection_color = detection_color
         self.viewing_angle = 90
+        self.cone = cone_shape(self.detection_radius, self.viewing_angle)
         self.facing_direction = 0
         self.sprite_manager = sprite_manager
         self.animation_frame = 0
 
-        self.seconds_to_travel = 0
+        self.seconds_to_travel = 0  # > 0: deriva dopo la spinta di un impulso NOP
         self.choicex = 0
         self.choicey = 0
 
+        # Allerta: dopo un rilevamento insegue il player sul flow field condiviso
+        self.alert = 0
+        self.flow = flow
+
+        # Ronda: percorso sulla NavGrid verso patrol_path[current_target]; senza nav, linea retta
+        self.nav = nav
+        self.route = ()
+        self.route_index = 0
+        self._plan(advance=False)
+
+        # Linea di vista contro i muri (None = vede attraverso, come prima)
+        self.wall_grid = wall_grid
+        self._los_key = None
+        self._los_visible = True
+        self._cone_key = None
+        self._cone_hits = None
+
     def update(self, player):
         self.animation_frame = (self.animation_frame + 1) % 60
-        if self.seconds_to_travel <= 0:
-            self.choicex = random.choice([-1, 0, 1])
-            self.choicey = random.choice([-1, 0, 1])
-            self.seconds_to_travel = 60
-
+        if self.seconds_to_travel > 0:
+            self._drift()
+        elif self.alert > 0 and self.flow is not None:
+            self._chase()
+        else:
+            self._patrol()
+        if self.alert > 0:
+            self.alert -= 1
+            if self.alert == 0:
+                self._plan(advance=False)  # fine allerta: torna alla ronda da dove si trova
+        detected = self.detect_player(player)
+        if detected:
+            self.alert = ALERT_TICKS
+        return detected
+
+    def stand_down(self):
+        """Fine allerta forzata (player preso e rimandato all'ingresso): torna alla ronda."""
+        if self.alert > 0:
+            self.alert = 0
+            self._plan(advance=False)
+
+    def _blocked(self, x, y):
+        return self.wall_grid is not None and self.wall_grid.box_blocked(x, y, TILE_SIZE - 4)
+
+    def _step_towards(self, tx, ty):
+        """Un passo (al massimo speed per asse) verso (tx, ty); True se arrivata."""
+        dx = min(max(tx - self.x, -self.speed), self.speed)
+        dy = min(max(ty - self.y, -self.speed), self.speed)
+        # Un asse alla volta contro i muri, come il player: fuori tile (dopo una spinta) si scivola
+        if dx and self._blocked(self.x + dx, self.y):
+            dx = 0
+        if dy and self._blocked(self.x + dx, self.y + dy):
+            dy = 0
+        self.choicex = (dx > 0) - (dx < 0)
+        self.choicey = (dy > 0) - (dy < 0)
+        self.x += dx
+        self.y += dy
+        if dx or dy:
+            self.facing_direction = math.atan2(self.choicey, self.choicex)
+        return self.x == tx and self.y == ty
+
+    def _chase(self):
+        """Passo letto dal flow field verso il player: O(1), niente pathfinding per guardia."""
+        step = self.flow.step(self.x, self.y)
+        if step is None:
+            self.choicex = self.choicey = 0  # tile non collegata al player: resta dov'è
+            return
+        self._step_towards(*step)
+
+    def _plan(self, advance):
+        """Percorso verso il waypoint corrente (o il successivo); campi e percorsi sono in cache."""
+        if advance:
+            self.current_target = (self.current_target + 1) % len(self.patrol_path)
+        target = self.patrol_path[self.current_target]
+        self.route = self.nav.route((self.x, self.y), target) if self.nav is not None else (target,)
+        self.route_index = 0
+
+    def _patrol(self):
+        if not self.route:
+            self._plan(advance=True)  # waypoint irraggiungibile: prova il prossimo
+            if not self.route:
+                self.choicex = self.choicey = 0
+                return
+        if self._step_towards(*self.route[self.route_index]):
+            self.route_index += 1
+            if self.route_index == len(self.route):
+                self._plan(advance=True)
+
+    def _drift(self):
+        """Spinta NOP: scivola nella direzione dell'urto, poi ripianifica da dove è finita."""
         if self.choicex != 0 or self.choicey != 0:
             if self.x + self.choicex * self.speed < 20 or self.x + self.choicex * self.speed > GAME_WIDTH - 20 - TILE_SIZE:
                 self.choicex = 0
             if self.y + self.choicey * self.speed < 20 or self.y + self.choicey * self.speed > GAME_HEIGHT - 20 - TILE_SIZE:
                 self.choicey = 0
+            if self.choicex and self._blocked(self.x + self.choicex * self.speed, self.y):
+                self.choicex = 0
+            if self.choicey and self._blocked(self.x + self.choicex * self.speed, self.y + self.choicey * self.speed):
+                self.choicey = 0
             self.x += self.choicex * self.speed
             self.y += self.choicey * self.speed
             self.facing_direction = math.atan2(self.choicey, self.choicex)
         self.seconds_to_travel -= 1
-        return self.detect_player(player)
+        if self.seconds_to_travel == 0:
+            self._plan(advance=False)
 
     def detect_player(self, player):
-        dx = player.x - self.x
-        dy = player.y - self.y
-        distance = math.sqrt(dx**2 + dy**2)
-
-        if distance < self.detection_radius:
-            if self.detection_color is not None:
-                if player.color != self.detection_color and player.color != 'blimblau':
-                    return False
-            angle_to_player = math.atan2(dy, dx)
-            angle_diff = abs(angle_to_player - self.facing_direction)
-            if angle_diff > math.pi:
-                angle_diff = 2 * math.pi - angle_diff
-            if angle_diff < math.radians(self.viewing_angle / 2):
-                return True
-        return False
+        if self.detection_color is not None:
+            if player.color != self.detection_color and player.color != 'blimblau':
+                return False
+        if not self.cone.contains(player.x - self.x, player.y - self.y, self.facing_direction):
+            return False
+        return self.has_line_of_sight(player)
+
+    def has_line_of_sight(self, player):
+        """Raycast verso il player; in cache finché guardia e player restano nella stessa tile."""
+        if self.wall_grid is None:
+            return True
+        gx, gy = self.x + TILE_SIZE//2, self.y + TILE_SIZE//2
+        px, py = player.x + TILE_SIZE//2, player.y + TILE_SIZE//2
+        key = (int(gx // TILE_SIZE), int(gy // TILE_SIZE), int(px // TILE_SIZE), int(py // TILE_SIZE))
+        if key != self._los_key:
+            self._los_key = key
+            self._los_visible = self.wall_grid.raycast(gx, gy, px, py, include_end=False) is None
+        return self._los_visible
+
+    def _cone_occlusion(self, cx, cy):
+        """
+        Punti d'impatto dei raggi del cono contro i muri (None = cono libero).
+        In cache (frazione t di ogni raggio) finché la guardia non cambia tile
+        o direzione; i punti si ricostruiscono dal centro corrente, così il
+        cono segue la guardia dentro la tile.
+        """
+        key = (int(cx // TILE_SIZE), int(cy // TILE_SIZE), self.facing_direction)
+        if key == self._cone_key and self._cone_hits is None:
+            return None
+        rays = self.cone.points(cx, cy, self.facing_direction)[1:]
+        if key != self._cone_key:
+            self._cone_key = key
+            ts = [self.wall_grid.raycast(cx, cy, ex, ey) for ex, ey in rays]
+            self._cone_hits = ts if any(t is not None for t in ts) else None
+            if self._cone_hits is None:
+                return None
+        return [None if t is None else (cx + (ex - cx) * t, cy + (ey - cy) * t)
+                for t, (ex, ey) in zip(self._cone_hits, rays)]
 
     def _vision_points(self):
-        points = [(self.x + TILE_SIZE//2, self.y + TILE_SIZE//2)]
-        for angle_offset in range(-self.viewing_angle//2, self.viewing_angle//2 + 1, 5):
-            angle = self.facing_direction + math.radians(angle_offset)
-            end_x = self.x + TILE_SIZE//2 + math.cos(angle) * self.detection_radius
-            end_y = self.y + TILE_SIZE//2 + math.sin(angle) * self.detection_radius
-            points.append((end_x, end_y))
-        return points
+        return self.cone.points(self.x + TILE_SIZE//2, self.y + TILE_SIZE//2, self.facing_direction)
 
     def draw_vision(self, vision_surface):
-        points = self._vision_points()
-        if len(points) > 2:
-            pygame.draw.polygon(vision_surface, (255, 50, 50, 40), points)
+        """Disegna il cono sulla surface dei coni e restituisce il rect toccato."""
+        if self.wall_grid is not None:
+            cx, cy = self.x + TILE_SIZE//2, self.y + TILE_SIZE//2
+            hits = self._cone_occlusion(cx, cy)
+            if hits is not None:
+                # Cono tagliato dai muri: polygon con i raggi accorciati
+                points = self._vision_points()
+                points[1:] = [hit or p for hit, p in zip(hits, points[1:])]
+                return pygame.draw.polygon(vision_surface, ConeShape.COLOR, points)
+        stamp = self.cone.stamp(self.facing_direction)
+        if stamp is not None:
+            surf, (ox, oy) = stamp
+            cx = int(self.x + TILE_SIZE//2 + 0.5)
+            cy = int(self.y + TILE_SIZE//2 + 0.5)
+            # MAX: i coni sovrapposti restano un'unione, come col polygon diretto
+            return vision_surface.blit(surf, (cx + ox, cy + oy), special_flags=pygame.BLEND_RGBA_MAX)
+        return pygame.draw.polygon(vision_surface, ConeShape.COLOR, self._vision_points())
 
     def draw_sprite(self, screen):
-        sprite = self.sprite_manager.sprites['guard_big']
         angle = -math.degrees(self.facing_direction) - 90
-        rotated_sprite = pygame.transform.rotate(sprite, angle)
-        rect = rotated_sprite.get_rect(center=(self.x + TILE_SIZE//2, self.y + TILE_SIZE//2))
-        screen.blit(rotated_sprite, rect)
+        rotated_sprite, (ox, oy) = self.sprite_manager.get_rotated('guard_big', angle)
+        cx = int(self.x + TILE_SIZE//2 + 0.5)
+        cy = int(self.y + TILE_SIZE//2 + 0.5)
+        screen.blit(rotated_sprite, (cx + ox, cy + oy))
         scan_radius = 10 + math.sin(self.animation_frame * 0.1) * 5
         pygame.draw.circle(screen, (255, 0, 0), (int(self.x + TILE_SIZE//2), int(self.y + TILE_SIZE//2)), int(scan_radius), 2)
 
+    def bounds(self):
+        """Area di sprite ruotato e cono di visione, centrata sulla guardia."""
+        half = int(max(self.detection_radius, TILE_SIZE * 1.5 * 0.71)) + 2
+        cx, cy = int(self.x + TILE_SIZE//2), int(self.y + TILE_SIZE//2)
+        return pygame.Rect(cx - half, cy - half, half * 2 + 1, half * 2 + 1)
+
+class GuardEngine:
+    """
+    Motore guardie struct-of-arrays (NumPy): posizioni, direzioni, timer e
+    colori di rilevamento stanno in array e passo verso il punto di ronda,
+    deriva dopo le spinte, test del cono e filtro colore sono un'unica
+    operazione batch per tick. Solo le guardie arrivate a un punto del
+    percorso passano da Python (stesse regole di Guard, stessi risultati).
+    """
+    def __init__(self, guards):
+        n = len(guards)
+        self.x = np.array([g.x for g in guards], dtype=np.float64)
+        self.y = np.array([g.y for g in guards], dtype=np.float64)
+        self.choicex = np.array([g.choicex for g in guards], dtype=np.int64)
+        self.choicey = np.array([g.choicey for g in guards], dtype=np.int64)
+        self.seconds_to_travel = np.array([g.seconds_to_travel for g in guards], dtype=np.int64)
+        self.facing_direction = np.array([g.facing_direction for g in guards], dtype=np.float64)
+        self.animation_frame = np.array([g.animation_frame for g in guards], dtype=np.int64)
+        self.alert = np.array([g.alert for g in guards], dtype=np.int64)
+        self.flow = guards[0].flow if guards else None
+        self.wall_grid = guards[0].wall_grid if guards else None
+        self.speed = np.array([g.speed for g in guards], dtype=np.float64)
+        self.detection_radius = np.array([g.detection_radius for g in guards], dtype=np.float64)
+        self.half_angle = np.array([g.cone.half_angle for g in guards], dtype=np.float64)
+        # -1 = guardia che vede tutti i colori
+        self.color_code = np.array(
+            [GUARD_COLORS.index(g.detection_color) if g.detection_color is not None else -1 for g in guards],
+            dtype=np.int64)
+        # Ronda: percorsi per guardia (tuple condivise dalla cache di NavGrid) e punto corrente
+        self.nav = [g.nav for g in guards]
+        self.patrol_path = [g.patrol_path for g in guards]
+        self.current_target = [g.current_target for g in guards]
+        self.route = [g.route for g in guards]
+        self.route_index = [g.route_index for g in guards]
+        self.route_empty = np.array([not g.route for g in guards], dtype=bool)  # waypoint irraggiungibile
+        self.target_x = np.zeros(n)
+        self.target_y = np.zeros(n)
+        for i in range(n):
+            self._set_target(i)
+        self.views = [GuardView(self, i, g) for i, g in enumerate(guards)]
+        self._n = n
+
+    def _set_target(self, i):
+        route = self.route[i]
+        # senza percorso il bersaglio è la posizione stessa: la guardia resta ferma
+        tx, ty = route[self.route_index[i]] if route else (self.x[i], self.y[i])
+        self.target_x[i] = tx
+        self.target_y[i] = ty
+
+    def _plan(self, i, advance):
+        """Come Guard._plan, per la guardia i."""
+        if advance:
+            self.current_target[i] = (self.current_target[i] + 1) % len(self.patrol_path[i])
+        target = self.patrol_path[i][self.current_target[i]]
+        nav = self.nav[i]
+        self.route[i] = nav.route((float(self.x[i]), float(self.y[i])), target) if nav is not None else (target,)
+        self.route_index[i] = 0
+        self._sync_route(i)
+
+    def _sync_route(self, i):
+        """Riallinea maschera e bersaglio dopo una modifica a route/route_index della guardia i."""
+        self.route_empty[i] = not self.route[i]
+        if self.route_index[i] < len(self.route[i]) or not self.route[i]:
+            self._set_target(i)
+
+    def update(self, player):
+        """Un tick per tutte le guardie; True se almeno una rileva il player."""
+        self.move()
+        return self.spot(player)
+
+    def move(self):
+        """Movimento e timer di un tick, senza rilevamento (multiplayer: poi spot per ogni player)."""
+        if self._n == 0:
+            return
+        self.animation_frame += 1
+        self.animation_frame %= 60
+
+        drifting = self.seconds_to_travel > 0
+        chasing = ~drifting & (self.alert > 0) if self.flow is not None else np.zeros(self._n, dtype=bool)
+        patrol = ~drifting & ~chasing
+        # Senza percorso (waypoint irraggiungibile): si prova il prossimo, come in Guard._patrol
+        for i in np.flatnonzero(patrol & self.route_empty):
+            self._plan(i, advance=True)
+
+        # Ronda: passo verso il punto corrente; allerta: passo letto dal flow field (O(1) a guardia)
+        tx, ty = self.target_x, self.target_y
+        if chasing.any():
+            cx, cy = self.flow.steps(self.x, self.y)
+            tx = np.where(chasing, cx, tx)
+            ty = np.where(chasing, cy, ty)
+        walking = patrol | chasing
+        dx = np.where(walking, np.clip(tx - self.x, -self.speed, self.speed), 0.0)
+        dy = np.where(walking, np.clip(ty - self.y, -self.speed, self.speed), 0.0)
+        if self.wall_grid is not None:
+            # un asse alla volta contro i muri, come Guard._step_towards
+            dx[(dx != 0) & self.wall_grid.boxes_blocked(self.x + dx, self.y, TILE_SIZE - 4)] = 0.0
+            dy[(dy != 0) & self.wall_grid.boxes_blocked(self.x + dx, self.y + dy, TILE_SIZE - 4)] = 0.0
+        self.choicex[walking] = np.sign(dx[walking]).astype(np.int64)
+        self.choicey[walking] = np.sign(dy[walking]).astype(np.int64)
+
+        # Deriva dopo una spinta NOP: direzione fissa con clamp ai bordi
+        moving = drifting & ((self.choicex != 0) | (self.choicey != 0))
+        nx = self.x + self.choicex * self.speed
+        ny = self.y + self.choicey * self.speed
+        self.choicex[moving & ((nx < 20) | (nx > GAME_WIDTH - 20 - TILE_SIZE))] = 0
+        self.choicey[moving & ((ny < 20) | (ny > GAME_HEIGHT - 20 - TILE_SIZE))] = 0
+        if self.wall_grid is not None and moving.any():
+            nx = self.x + self.choicex * self.speed
+            self.choicex[moving & (self.choicex != 0) & self.wall_grid.boxes_blocked(nx, self.y, TILE_SIZE - 4)] = 0
+            nx = self.x + self.choicex * self.speed
+            ny = self.y + self.choicey * self.speed
+            self.choicey[moving & (self.choicey != 0) & self.wall_grid.boxes_blocked(nx, ny, TILE_SIZE - 4)] = 0
+        dx = np.where(moving, self.choicex * self.speed, dx)
+        dy = np.where(moving, self.choicey * self.speed, dy)
+
+        self.x += dx
+        self.y += dy
+        moved = moving | (walking & ((dx != 0) | (dy != 0)))
+        self.facing_direction = np.where(
+            moved, np.arctan2(self.choicey, self.choicex), self.facing_direction)
+
+        # Arrivati a un punto del percorso (pochi per tick): punto successivo o nuova tratta
+        arrived = patrol & ~self.route_empty & (self.x == self.target_x) & (self.y == self.target_y)
+        for i in np.flatnonzero(arrived):
+            self.route_index[i] += 1
+            if self.route_index[i] == len(self.route[i]):
+                self._plan(i, advance=True)
+            else:
+                self._set_target(i)
+        self.seconds_to_travel[drifting] -= 1
+        for i in np.flatnonzero(drifting & (self.seconds_to_travel == 0)):
+            self._plan(i, advance=False)
+        alerted = self.alert > 0
+        self.alert[alerted] -= 1
+        for i in np.flatnonzero(alerted & (self.alert == 0)):
+            self._plan(i, advance=False)
+
+    def stand_down(self):
+        """Come Guard.stand_down, per tutte le guardie in allerta."""
+        for i in np.flatnonzero(self.alert > 0):
+            self._plan(i, advance=False)
+        self.alert[:] = 0
+
+    def spot(self, player):
+        """Rilevamento dopo move: chi vede il player passa in allerta; True se almeno una."""
+        if self._n == 0:
+            return False
+        seen = self.detect(player)
+        self.alert[seen] = ALERT_TICKS
+        return bool(seen.any())
+
+    def detect(self, player):
+        """Maschera booleana delle guardie che vedono il player."""
+        dx = player.x - self.x
+        dy = player.y - self.y
+        distance = np.sqrt(dx**2 + dy**2)
+        seen = distance < self.detection_radius
+        if player.color != 'blimblau':
+            code = GUARD_COLORS.index(player.color) if player.color in GUARD_COLORS else -2
+            seen &= (self.color_code == -1) | (self.color_code == code)
+        if not seen.any():
+            return seen
+        angle_diff = np.abs(np.arctan2(dy, dx) - self.facing_direction)
+        angle_diff = np.where(angle_diff > math.pi, 2 * math.pi - angle_diff, angle_diff)
+        seen &= angle_diff < self.half_angle
+        # Linea di vista solo per i pochi candidati rimasti
+        for i in np.flatnonzero(seen):
+            if not self.views[i].has_line_of_sight(player):
+                seen[i] = False
+        return seen
+
+
+def _engine_field(name):
+    def getter(self):
+        return getattr(self._engine, name)[self._index].item()
+
+    def setter(self, value):
+        getattr(self._engine, name)[self._index] = value
+    return property(getter, setter)
+
+
+def _engine_route_field(name):
+    # come _engine_field, per lo stato di ronda (liste): scrivere riallinea il bersaglio dell'engine
+    def getter(self):
+        return getattr(self._engine, name)[self._index]
+
+    def setter(self, value):
+        getattr(self._engine, name)[self._index] = value
+        self._engine._sync_route(self._index)
+    return property(getter, setter)
+
+
+class GuardView(Guard):
+    """Guard che legge/scrive lo stato negli array di un GuardEngine (stessa API)."""
+    x = _engine_field('x')
+    y = _engine_field('y')
+    choicex = _engine_field('choicex')
+    choicey = _engine_field('choicey')
+    seconds_to_travel = _engine_field('seconds_to_travel')
+    facing_direction = _engine_field('facing_direction')
+    animation_frame = _engine_field('animation_frame')
+    alert = _engine_field('alert')
+    route = _engine_route_field('route')
+    route_index = _engine_route_field('route_index')
+    current_target = _engine_route_field('current_target')
+
+    def __init__(self, engine, index, guard):
+        self._engine = engine
+        self._index = index
+        self.patrol_path = guard.patrol_path
+        self.speed = guard.speed
+        self.detection_radius = guard.detection_radius
+        self.detection_color = guard.detection_color
+        self.viewing_angle = guard.viewing_angle
+        self.cone = guard.cone
+        self.sprite_manager = guard.sprite_manager
+        self.wall_grid = guard.wall_grid
+        self.nav = guard.nav
+        self.flow = guard.flow
+        self._los_key = None
+        self._los_visible = True
+        self._cone_key = None
+        self._cone_hits = None
+
 class Goal:
     def __init__(self, x, y, sprite_manager):
         self.x = x
         self.y = y
         self.pulse = 0
         self.sprite_manager = sprite_manager
+        self.sprite = sprite_manager.handle('goal') if sprite_manager is not None else None
 
     def update(self):
         self.pulse = (self.pulse + 2) % 360
@@ -515,13 +1601,1267 @@ class Goal:
         s = pygame.Surface((glow_size * 2, glow_size * 2), pygame.SRCALPHA)
         pygame.draw.circle(s, (255, 255, 100, 50), (glow_size, glow_size), glow_size)
         screen.blit(s, (self.x - glow_size + TILE_SIZE, self.y - glow_size + TILE_SIZE))
-        screen.blit(self.sprite_manager.sprites['goal'], (self.x, self.y))
+        sm = self.sprite_manager
+        screen.blit(sm.atlas, (self.x, self.y), sm.region(self.sprite))
+
+    def bounds(self):
+        return pygame.Rect(self.x + TILE_SIZE - 51, self.y + TILE_SIZE - 51, 102, 102)
 
 # -----------------------------
-# Gioco
+# Livelli (layout classico + generatore procedurale)
+# -----------------------------
+PLAYER_SPAWN = (100, 100)
+GOAL_POS = (GAME_WIDTH - 150, GAME_HEIGHT - 150)
+
+
+def border_walls():
+    return [
+        pygame.Rect(0, 0, GAME_WIDTH, 20),
+        pygame.Rect(0, GAME_HEIGHT-20, GAME_WIDTH, 20),
+        pygame.Rect(0, 0, 20, GAME_HEIGHT),
+        pygame.Rect(GAME_WIDTH-20, 0, 20, GAME_HEIGHT),
+    ]
+
+
+def classic_walls():
+    """Il labirinto fisso storico (bordi + 17 muri interni)."""
+    return border_walls() + [
+        pygame.Rect(200, 100, 20, 300),
+        pygame.Rect(400, 200, 200, 20),
+        pygame.Rect(600, 100, 20, 300),
+        pygame.Rect(300, 500, 400, 20),
+        pygame.Rect(150, 300, 300, 20),
+        pygame.Rect(500, 400, 20, 200),
+        pygame.Rect(700, 250, 20, 300),
+        pygame.Rect(250, 150, 20, 200),
+        pygame.Rect(350, 350, 200, 20),
+        pygame.Rect(100, 450, 150, 20),
+        pygame.Rect(450, 100, 20, 150),
+        pygame.Rect(600, 500, 150, 20),
+        pygame.Rect(800, 300, 20, 200),
+        pygame.Rect(700, 150, 150, 20),
+        pygame.Rect(900, 100, 20, 300),
+        pygame.Rect(850, 400, 150, 20),
+        pygame.Rect(300, GAME_HEIGHT - 180, 400, 20),
+    ]
+
+
+class LevelLayout:
+    """Muri di un livello più le celle TILE_SIZE libere dove possono nascere le guardie."""
+    def __init__(self, walls, free_cells, guard_cells):
+        self.walls = walls
+        self.free_cells = free_cells      # tile (col, row) libere e raggiungibili
+        self.guard_cells = guard_cells    # sottoinsieme lontano da spawn, goal e percorso
+
+
+def _tile_blocked(walls):
+    cols = GAME_WIDTH // TILE_SIZE + 1
+    rows = GAME_HEIGHT // TILE_SIZE + 1
+    blocked = [[False] * cols for _ in range(rows)]
+    for r in range(rows):
+        for c in range(cols):
+            tile = pygame.Rect(c * TILE_SIZE, r * TILE_SIZE, TILE_SIZE, TILE_SIZE)
+            blocked[r][c] = tile.collidelist(walls) != -1
+    return blocked
+
+
+def _bfs(blocked, start):
+    """Distanze BFS 4-connesse sulle tile libere da start: {(col, row): (dist, prev)}."""
+    rows, cols = len(blocked), len(blocked[0])
+    seen = {start: (0, None)}
+    queue = deque([start])
+    while queue:
+        c, r = queue.popleft()
+        dist = seen[(c, r)][0]
+        for nc, nr in ((c + 1, r), (c - 1, r), (c, r + 1), (c, r - 1)):
+            if 0 <= nc < cols and 0 <= nr < rows and not blocked[nr][nc] and (nc, nr) not in seen:
+                seen[(nc, nr)] = (dist + 1, (c, r))
+                queue.append((nc, nr))
+    return seen
+
+
+class NavGrid:
+    """
+    Griglia di navigazione delle guardie sulle tile TILE_SIZE libere da muri
+    (e dentro i bordi di clamp). Per ogni tile goal un solo Dijkstra
+    8-connesso, senza tagliare gli angoli, dà il passo successivo da tutte le
+    tile: i percorsi di tutte le guardie verso quella tile, da dovunque
+    ripianifichino, sono una camminata sul campo. Campi e percorsi stanno in
+    cache LRU limitate; i campi sono al massimo uno per tile del livello.
+    """
+    MAX_FIELDS = 512
+    MAX_PATHS = 4096
+
+    NEIGHBORS = [(1, 0, 1.0), (-1, 0, 1.0), (0, 1, 1.0), (0, -1, 1.0),
+                 (1, 1, math.sqrt(2)), (1, -1, math.sqrt(2)), (-1, 1, math.sqrt(2)), (-1, -1, math.sqrt(2))]
+
+    def __init__(self, walls):
+        blocked = _tile_blocked(walls)
+        self.rows, self.cols = len(blocked), len(blocked[0])
+        min_cell = -(-20 // TILE_SIZE)
+        max_col = (GAME_WIDTH - 20 - TILE_SIZE) // TILE_SIZE
+        max_row = (GAME_HEIGHT - 20 - TILE_SIZE) // TILE_SIZE
+        self.walkable = [[not blocked[r][c] and min_cell <= c <= max_col and min_cell <= r <= max_row
+                          for c in range(self.cols)] for r in range(self.rows)]
+        self.paths = {}   # (tile start, tile goal) -> tuple di punti (x, y), LRU
+        self.fields = {}  # tile goal -> {tile: tile successiva (None al goal)}, LRU
+        self._snap = {}
+
+    def cell(self, x, y):
+        """Tile percorribile più vicina al punto (x, y) (topleft di una guardia)."""
+        c = min(max(int((x + TILE_SIZE // 2) // TILE_SIZE), 0), self.cols - 1)
+        r = min(max(int((y + TILE_SIZE // 2) // TILE_SIZE), 0), self.rows - 1)
+        if self.walkable[r][c]:
+            return c, r
+        snapped = self._snap.get((c, r))
+        if snapped is None:
+            snapped = self._snap[(c, r)] = self._nearest_walkable(c, r)
+        return snapped
+
+    def _nearest_walkable(self, c, r):
+        seen = {(c, r)}
+        queue = deque([(c, r)])
+        while queue:
+            c, r = queue.popleft()
+            if self.walkable[r][c]:
+                return c, r
+            for nc, nr in ((c + 1, r), (c - 1, r), (c, r + 1), (c, r - 1)):
+                if 0 <= nc < self.cols and 0 <= nr < self.rows and (nc, nr) not in seen:
+                    seen.add((nc, nr))
+                    queue.append((nc, nr))
+        return None
+
+    def route(self, start, goal):
+        """Punti (x, y) da seguire da start a goal (pixel); tupla vuota se irraggiungibile."""
+        key = (self.cell(*start), self.cell(*goal))
+        path = self.paths.pop(key, None)
+        if path is None:
+            path = self._walk(*key)
+            if len(self.paths) >= self.MAX_PATHS:
+                del self.paths[next(iter(self.paths))]
+        self.paths[key] = path  # in fondo: ordine del dict = LRU
+        return path
+
+    def _walk(self, start, goal):
+        if start is None or goal is None:
+            return ()
+        field = self._field(goal)
+        if start not in field:
+            return ()
+        path = []
+        node = start
+        while node is not None:
+            path.append((node[0] * TILE_SIZE, node[1] * TILE_SIZE))
+            node = field[node]
+        return tuple(path)
+
+    def _field(self, goal):
+        """Tile successiva verso goal per ogni tile collegata (Dijkstra, una volta per tile goal)."""
+        field = self.fields.pop(goal, None)
+        if field is None:
+            field = self._dijkstra(goal)
+            if len(self.fields) >= self.MAX_FIELDS:
+                del self.fields[next(iter(self.fields))]
+        self.fields[goal] = field
+        return field
+
+    def _dijkstra(self, goal):
+        # Dal goal all'indietro: il grafo è simmetrico, next[tile] è il passo verso goal
+        walkable = self.walkable
+        cost = {goal: 0.0}
+        nxt = {goal: None}
+        heap = [(0.0, 0, goal)]
+        counter = 1  # tie-break stabile: stessi percorsi a ogni esecuzione
+        while heap:
+            node_cost, _, node = heapq.heappop(heap)
+            if node_cost > cost[node]:
+                continue
+            c, r = node
+            for dc, dr, step in self.NEIGHBORS:
+                nc, nr = c + dc, r + dr
+                if not (0 <= nc < self.cols and 0 <= nr < self.rows) or not walkable[nr][nc]:
+                    continue
+                if dc and dr and not (walkable[r][nc] and walkable[nr][c]):
+                    continue  # niente angoli tagliati: la guardia passerebbe nel muro
+                new_cost = node_cost + step
+                if new_cost < cost.get((nc, nr), math.inf):
+                    cost[(nc, nr)] = new_cost
+                    nxt[(nc, nr)] = node
+                    heapq.heappush(heap, (new_cost, counter, (nc, nr)))
+                    counter += 1
+        return nxt
+
+
+class FlowField:
+    """
+    Campo di direzioni verso il player sulla NavGrid, condiviso da tutte le
+    guardie in allerta. Un solo BFS dalla tile del player, rifatto solo quando
+    il player cambia tile; ogni guardia legge il suo passo in O(1), quindi il
+    costo non cresce col numero di inseguitori. Con più player il BFS parte da
+    tutte le loro tile e ogni guardia insegue il più vicino.
+    """
+    def __init__(self, nav):
+        self.nav = nav
+        self.dc = np.zeros((nav.rows, nav.cols), dtype=np.int64)
+        self.dr = np.zeros((nav.rows, nav.cols), dtype=np.int64)
+        self.reached = np.zeros((nav.rows, nav.cols), dtype=bool)
+        self.goal = ()
+        self._built = None
+        self.rebuilds = 0
+
+    def set_goal(self, x, y):
+        """Tile obiettivo dal punto (x, y); il BFS si rifà pigramente al primo passo letto."""
+        self.set_goals(((x, y),))
+
+    def set_goals(self, points):
+        """Come set_goal, con più obiettivi (un BFS multi-sorgente)."""
+        cells = (self.nav.cell(x, y) for x, y in points)
+        self.goal = tuple(dict.fromkeys(cell for cell in cells if cell is not None))
+
+    def _ensure(self):
+        if self._built == self.goal:
+            return
+        self._built = self.goal
+        self.rebuilds += 1
+        self.dc.fill(0)
+        self.dr.fill(0)
+        self.reached.fill(False)
+        nav, walkable = self.nav, self.nav.walkable
+        for gc, gr in self.goal:
+            self.reached[gr, gc] = True
+        queue = deque(self.goal)
+        while queue:
+            c, r = queue.popleft()
+            for dc, dr, _ in NavGrid.NEIGHBORS:
+                nc, nr = c + dc, r + dr
+                if not (0 <= nc < nav.cols and 0 <= nr < nav.rows) or not walkable[nr][nc]:
+                    continue
+                if self.reached[nr, nc] or (dc and dr and not (walkable[r][nc] and walkable[nr][c])):
+                    continue
+                # dalla tile (nc, nr) il passo verso il player va all'indietro: (-dc, -dr)
+                self.reached[nr, nc] = True
+                self.dc[nr, nc] = -dc
+                self.dr[nr, nc] = -dr
+                queue.append((nc, nr))
+
+    def _tile(self, x, y):
+        c = min(max(int((x + TILE_SIZE // 2) // TILE_SIZE), 0), self.nav.cols - 1)
+        r = min(max(int((y + TILE_SIZE // 2) // TILE_SIZE), 0), self.nav.rows - 1)
+        return c, r
+
+    def step(self, x, y):
+        """Prossimo punto (x, y) verso il player per una guardia in (x, y); None se scollegata."""
+        self._ensure()
+        c, r = self._tile(x, y)
+        if not self.reached[r, c]:
+            return None
+        return (c + int(self.dc[r, c])) * TILE_SIZE, (r + int(self.dr[r, c])) * TILE_SIZE
+
+    def steps(self, xs, ys):
+        """Come step, vettoriale: per le tile scollegate il punto è la posizione stessa."""
+        self._ensure()
+        c = np.clip(((xs + TILE_SIZE // 2) // TILE_SIZE).astype(np.int64), 0, self.nav.cols - 1)
+        r = np.clip(((ys + TILE_SIZE // 2) // TILE_SIZE).astype(np.int64), 0, self.nav.rows - 1)
+        ok = self.reached[r, c]
+        return (np.where(ok, (c + self.dc[r, c]) * TILE_SIZE, xs),
+                np.where(ok, (r + self.dr[r, c]) * TILE_SIZE, ys))
+
+
+def generate_level_layout(seed, level, max_attempts=50):
+    """
+    Layout procedurale per (seed, level): segmenti di muro spessi 20px sulla
+    griglia TILE_SIZE, scartati finché il BFS sulle tile libere non collega lo
+    spawn al goal. Deterministico e thread-safe (usa un Random locale).
+    """
+    rng = random.Random(f"{seed}:{level}")
+    spawn_zone = pygame.Rect(20, 20, PLAYER_SPAWN[0] + TILE_SIZE * 2, PLAYER_SPAWN[1] + TILE_SIZE * 2)
+    goal_zone = pygame.Rect(GOAL_POS[0] - TILE_SIZE, GOAL_POS[1] - TILE_SIZE, TILE_SIZE * 4, TILE_SIZE * 4)
+    max_col = (GAME_WIDTH - 20) // TILE_SIZE - 1
+    max_row = (GAME_HEIGHT - 20) // TILE_SIZE - 1
+    start = (PLAYER_SPAWN[0] // TILE_SIZE, PLAYER_SPAWN[1] // TILE_SIZE)
+    goal_tiles = {(c, r) for c in range(goal_zone.left // TILE_SIZE + 1, goal_zone.right // TILE_SIZE - 1)
+                  for r in range(goal_zone.top // TILE_SIZE + 1, goal_zone.bottom // TILE_SIZE - 1)}
+
+    for _ in range(max_attempts):
+        walls = border_walls()
+        for _ in range(22 + min(level * 2, 24)):
+            length = rng.randint(2, 7)
+            c = rng.randint(1, max_col)
+            r = rng.randint(1, max_row)
+            if rng.random() < 0.5:
+                wall = pygame.Rect(c * TILE_SIZE, r * TILE_SIZE, 20, min(length, max_row + 1 - r) * TILE_SIZE)
+            else:
+                wall = pygame.Rect(c * TILE_SIZE, r * TILE_SIZE, min(length, max_col + 1 - c) * TILE_SIZE, 20)
+            if wall.colliderect(spawn_zone) or wall.colliderect(goal_zone):
+                continue
+            walls.append(wall)
+
+        blocked = _tile_blocked(walls)
+        reach = _bfs(blocked, start)
+        reached = [t for t in goal_tiles if t in reach]
+        if not reached:
+            continue
+        # Percorso spawn -> goal: niente guardie sopra
+        path = set()
+        node = min(reached, key=lambda t: reach[t][0])
+        while node is not None:
+            path.add(node)
+            node = reach[node][1]
+        free_cells = sorted(reach)
+        guard_cells = [(c, r) for c, r in free_cells
+                       if (c, r) not in path
+                       and not spawn_zone.inflate(160, 160).collidepoint(c * TILE_SIZE, r * TILE_SIZE)
+                       and not goal_zone.collidepoint(c * TILE_SIZE, r * TILE_SIZE)]
+        return LevelLayout(walls, free_cells, guard_cells or free_cells)
+
+    # Nessun layout valido: il labirinto classico è sempre risolvibile
+    walls = classic_walls()
+    free_cells = sorted(_bfs(_tile_blocked(walls), start))
+    return LevelLayout(walls, free_cells, free_cells)
+
+
+class LevelGenerator:
+    """
+    Genera i layout per livello; con background=True il livello N+1 viene
+    preparato su un thread worker mentre si gioca il livello N.
+    """
+    def __init__(self, seed, background=False):
+        self.seed = seed
+        self.executor = ThreadPoolExecutor(max_workers=1) if background else None
+        self.pending = {}
+
+    def prefetch(self, level):
+        if self.executor is not None and level not in self.pending:
+            self.pending[level] = self.executor.submit(generate_level_layout, self.seed, level)
+
+    def get(self, level):
+        future = self.pending.pop(level, None)
+        layout = future.result() if future is not None else generate_level_layout(self.seed, level)
+        # i livelli restano riutilizzabili (reset R / game over): nessuna cache da invalidare
+        self.pending = {lvl: f for lvl, f in self.pending.items() if lvl > level}
+        return layout
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+# -----------------------------
+# Simulazione (regole di gioco, senza display)
+# -----------------------------
+class Simulation:
+    """
+    Stato e regole di gioco senza finestra, font o frame cap.
+    Game ci aggiunge sopra display, menu e disegno; da sola gira headless
+    alla velocità massima della CPU (sweep di bilanciamento/regressione).
+    """
+    def __init__(self, sprite_manager=None, level=1, seed=None,
+                 use_guard_engine=False, max_guards=MAX_GUARDS,
+                 procedural=True, background_levels=False):
+        self.level = level
+        self.seed = seed if seed is not None else random.getrandbits(32)
+        # Unica sorgente di casualità del gameplay: stessa seed + stessi input = stessa partita
+        self.rng = random.Random(self.seed)
+        self.procedural = procedural
+        self.background_levels = background_levels
+        self.level_generator = LevelGenerator(self.seed, background=background_levels)
+        self.sprite_manager = sprite_manager
+        self.use_guard_engine = use_guard_engine
+        self.max_guards = max_guards
+        self.guard_engine = None
+        self.guard_grid = GuardBroadPhase()
+        self.particle_pool = ParticlePool()
+        self.player = None
+        self.particle_effects = []
+        self.nop_pulses = []
+        self.game_over = False
+        self.ticks = 0
+        self.input_log = None  # InputLog se si sta registrando
+
+    @classmethod
+    def from_seed(cls, seed, level=1, **kwargs):
+        """Crea una simulazione headless già pronta al livello indicato."""
+        sim = cls(level=level, seed=seed, **kwargs)
+        sim.init_level()
+        return sim
+
+    # ---------- Livello ----------
+    def init_level(self):
+        # Player
+        if self.level == 1 or self.player is None:
+            self.player = Player(*PLAYER_SPAWN, self.sprite_manager, lives=3, rng=self.rng)
+        else:
+            new_lives = self.player.lives + 1 if self.player.lives < 5 else self.player.lives
+            self.player = Player(*PLAYER_SPAWN, self.sprite_manager, lives=new_lives, rng=self.rng)
+
+        self.goal = Goal(GOAL_POS[0], GOAL_POS[1], self.sprite_manager)
+        self.guards = []
+
+        if self.procedural:
+            layout = self.level_generator.get(self.level)
+            self.level_generator.prefetch(self.level + 1)
+            self.walls = list(layout.walls)
+        else:
+            layout = None
+            self.walls = classic_walls()
+        self.wall_grid = WallGrid(self.walls)
+        self.nav = NavGrid(self.walls)
+        self.flow = FlowField(self.nav)
+
+        # Guardie (procedurale: solo in celle libere, lontano da spawn/goal/percorso)
+        for i in range(min(self.level + 2, self.max_guards)):
+            if layout is not None:
+                c, r = self.rng.choice(layout.guard_cells)
+                x, y = c * TILE_SIZE, r * TILE_SIZE
+            else:
+                x = self.rng.randint(200, GAME_WIDTH - 200)
+                y = self.rng.randint(200, GAME_HEIGHT - 200)
+                # fuori dai muri: le guardie non li attraversano
+                c, r = self.nav.cell(x, y)
+                x, y = c * TILE_SIZE, r * TILE_SIZE
+            path = self.generate_random_path(x, y)
+            self.guards.append(Guard(
+                x, y, path, self.sprite_manager,
+                detection_color=self.rng.choice(GUARD_COLORS),
+                wall_grid=self.wall_grid, nav=self.nav, flow=self.flow
+            ))
+        self.guard_engine = None
+        if self.use_guard_engine:
+            self.guard_engine = GuardEngine(self.guards)
+            self.guards = self.guard_engine.views
+
+        # Pulisci effetti/pulses
+        self.particle_pool.clear()
+        self.particle_effects = []
+        self.nop_pulses = []
+        self.game_over = False
+
+    def generate_random_path(self, start_x, start_y):
+        path = [(start_x, start_y)]
+        for _ in range(3):
+            x = self.rng.randint(100, GAME_WIDTH - 100)
+            y = self.rng.randint(100, GAME_HEIGHT - 100)
+            path.append((x, y))
+        return path
+
+    def start_recording(self):
+        """Riparte da stato pulito (rng dalla seed) e registra gli input da qui in poi."""
+        self.rng.seed(self.seed)
+        self.player = None
+        self.ticks = 0
+        self.init_level()
+        self.input_log = InputLog.for_simulation(self)
+
+    def restart(self, seed):
+        """Nuova partita dal livello 1 con una nuova seed (nuovi labirinti, nuovo stream rng)."""
+        if self.input_log is not None:
+            self.input_log.action(INPUT_RESTART, struct.pack('<I', seed))
+        self.level_generator.shutdown()
+        self.seed = seed
+        self.rng.seed(seed)
+        self.level = 1
+        self.player = None
+        self.level_generator = LevelGenerator(seed, background=self.background_levels)
+        self.init_level()
+
+    # ---------- Input ----------
+    def reset_level(self):
+        """Ricomincia il livello corrente (tasto R)."""
+        if self.input_log is not None:
+            self.input_log.action(INPUT_RESET_LEVEL)
+        self.init_level()
+
+    def apply_action(self, trans_type):
+        """Attiva una trasformazione (tasti 1-5) e registra l'eventuale effetto."""
+        if self.input_log is not None:
+            self.input_log.action(trans_type.value)
+        effect = self.player.apply_transformation(trans_type, self)
+        if effect:
+            self.particle_effects.append(effect)
+
+    # ---------- Tick ----------
+    def step(self, dx, dy):
+        """Avanza la simulazione di un tick con il movimento richiesto (-1/0/1)."""
+        self.ticks += 1
+        self._update_player(dx, dy)
+        self._update_guards()
+        self._update_particles()
+        self.goal.update()
+        # NOP pulses + collisioni
+        self._update_pulses()
+        self._resolve_outcome()
+
+        if self.input_log is not None:
+            self.input_log.tick(dx, dy, self.state_checksum())
+
+    # Fasi del tick: metodi separati così bench.py può misurarle una per una
+    def _update_player(self, dx, dy):
+        self.player.move(dx, dy, self.wall_grid)
+        self.player.update()
+
+    def _update_guards(self):
+        # Obiettivo del flow field: costa solo se il player ha cambiato tile e qualcuno insegue
+        self.flow.set_goal(self.player.x, self.player.y)
+        if self.guard_engine is not None:
+            detected = self.guard_engine.update(self.player)
+        else:
+            detected = False
+            for guard in self.guards:
+                if guard.update(self.player):
+                    detected = True
+        self.player.detected = detected
+
+    def _update_particles(self):
+        # Un update vettoriale del pool, poi cap max sugli effetti
+        self.particle_pool.update()
+        self.particle_effects = [e for e in self.particle_effects if e.update()]
+        if len(self.particle_effects) > 100:
+            for effect in self.particle_effects[:-100]:
+                effect.release()
+            self.particle_effects = self.particle_effects[-100:]
+
+    def _resolve_outcome(self):
+        """Vittoria (livello successivo) o rilevamento (vita persa, eventuale game over)."""
+        # Vittoria
+        player_rect = pygame.Rect(self.player.x, self.player.y, TILE_SIZE, TILE_SIZE)
+        goal_rect = pygame.Rect(self.goal.x, self.goal.y, TILE_SIZE * 2, TILE_SIZE * 2)
+        if player_rect.colliderect(goal_rect):
+            self.player.win = True
+            self.level += 1
+            self.player.rem_combo_transformations = MAX_COMBO_TRANSFORMATIONS
+            self.player.rem_eq_transformations = MAX_EQ_TRANSFORMATIONS
+            self.player.rem_nop_transformations = MAX_NOP_TRANSFORMATIONS
+            self.player.rem_ibp_transformations = MAX_IBP_TRANSFORMATIONS
+            self.init_level()
+
+        # Rilevato: perdi una vita e torni all'ingresso; le guardie smettono di inseguire
+        # (altrimenti il flow field le porta dritte all'ingresso a riprenderti)
+        if self.player.detected:
+            self.player.lives -= 1
+            self.player.x, self.player.y = 30, 30
+            self._stand_down_guards()
+            if self.player.lives <= 0:
+                self.player.lives = 0
+                self.game_over = True
+
+    def _stand_down_guards(self):
+        if self.guard_engine is not None:
+            self.guard_engine.stand_down()
+        else:
+            for guard in self.guards:
+                guard.stand_down()
+
+    def state_checksum(self):
+        """CRC32 dello stato che conta per il gameplay (uguale fra path a oggetti ed engine)."""
+        p = self.player
+        crc = zlib.crc32(struct.pack('<iiddiiii', self.ticks, self.level, p.x, p.y, p.lives,
+                                     p.transformation.value, p.transformation_timer, self.game_over))
+        crc = zlib.crc32(p.color.encode(), crc)
+        if self.guard_engine is not None:
+            crc = zlib.crc32(self.guard_engine.x.tobytes(), crc)
+            return zlib.crc32(self.guard_engine.y.tobytes(), crc)
+        crc = zlib.crc32(np.array([g.x for g in self.guards], dtype=np.float64).tobytes(), crc)
+        return zlib.crc32(np.array([g.y for g in self.guards], dtype=np.float64).tobytes(), crc)
+
+    def _update_pulses(self):
+        """Muove gli impulsi NOP e risolve le collisioni con le guardie (broad-phase a griglia)."""
+        if not self.nop_pulses:
+            return
+        half = TILE_SIZE / 2
+        guards = self.guards
+        if self.guard_engine is not None:
+            xs = (self.guard_engine.x + half).tolist()
+            ys = (self.guard_engine.y + half).tolist()
+        else:
+            xs = [g.x + half for g in guards]
+            ys = [g.y + half for g in guards]
+        self.guard_grid.build(xs, ys)
+
+        survivors = []
+        for pulse in self.nop_pulses:
+            alive = pulse.update(self.wall_grid)
+            hit_something = False
+            reach = pulse.radius + TILE_SIZE * 0.5
+            for i in self.guard_grid.query(pulse.x, pulse.y, reach):
+                guard = guards[i]
+                gx = guard.x + half
+                gy = guard.y + half
+                d = math.hypot(gx - pulse.x, gy - pulse.y)
+                if d <= reach:
+                    ux = (gx - pulse.x) / (d + 1e-6)
+                    uy = (gy - pulse.y) / (d + 1e-6)
+                    push_strength = 80
+                    atten = max(0.35, 1.0 - d / reach)
+                    dx = ux * push_strength * atten
+                    dy = uy * push_strength * atten
+                    nx = max(20, min(GAME_WIDTH - 20 - TILE_SIZE, guard.x + dx))
+                    ny = max(20, min(GAME_HEIGHT - 20 - TILE_SIZE, guard.y + dy))
+                    # la spinta non porta dentro un muro: si tiene solo l'asse libero (o nessuno)
+                    if not self.wall_grid.box_blocked(nx, guard.y, TILE_SIZE - 4):
+                        guard.x = nx
+                    if not self.wall_grid.box_blocked(guard.x, ny, TILE_SIZE - 4):
+                        guard.y = ny
+                    guard.choicex = int(math.copysign(1, ux)) if abs(ux) > 0.2 else 0
+                    guard.choicey = int(math.copysign(1, uy)) if abs(uy) > 0.2 else 0
+                    guard.seconds_to_travel = 30
+                    self.guard_grid.move(i, gx, gy, guard.x + half, guard.y + half)
+                    hit_something = True
+            if alive and not hit_something:
+                survivors.append(pulse)
+        # compattazione senza remove O(n) + cap
+        self.nop_pulses = survivors[-20:]
+
+    def run_headless(self, max_ticks, policy=None):
+        """
+        Esegue fino a max_ticks tick senza display né clock.
+        policy(sim) -> (dx, dy, trans_type|None); senza policy il player sta fermo.
+        Si ferma al game over; restituisce il numero di tick eseguiti.
+        """
+        for n in range(max_ticks):
+            if self.game_over:
+                return n
+            dx, dy, action = policy(self) if policy else (0, 0, None)
+            if action is not None:
+                self.apply_action(action)
+            self.step(dx, dy)
+        return max_ticks
+
+
+# -----------------------------
+# Registrazione input e replay
+# -----------------------------
+INPUT_RESET_LEVEL = 6  # codici azione oltre a TransformationType.value (1-5)
+INPUT_RESTART = 7      # seguito dalla nuova seed (uint32)
+_INPUT_PAYLOAD = {INPUT_RESTART: 4}
+
+
+class InputLog:
+    """
+    Log binario compatto degli input per tick, compresso con zlib.
+    Per tick: un byte (dx+1) | (dy+1) << 2 | n_azioni << 4, i byte delle
+    azioni e 16 bit del checksum di stato. Il valore 3 nei bit bassi
+    (dx impossibile) marca un blocco di sole azioni, oltre 15 per tick.
+    """
+    MAGIC = b'SGR1'
+    HEADER = struct.Struct('<4sIHHB')  # magic, seed, livello, max guardie, flag
+    CHUNK = 3
+
+    def __init__(self, seed, level, max_guards, procedural, use_guard_engine, data=b''):
+        self.seed = seed
+        self.level = level
+        self.max_guards = max_guards
+        self.procedural = procedural
+        self.use_guard_engine = use_guard_engine
+        self.data = bytearray(data)
+        self._pending = bytearray()
+        self._n_pending = 0
+
+    @classmethod
+    def for_simulation(cls, sim):
+        return cls(sim.seed, sim.level, sim.max_guards, sim.procedural, sim.use_guard_engine)
+
+    def action(self, code, payload=b''):
+        if self._n_pending == 15:
+            self.data.append(self.CHUNK | 15 << 4)
+            self.data += self._pending
+            self._pending.clear()
+            self._n_pending = 0
+        self._pending.append(code)
+        self._pending += payload
+        self._n_pending += 1
+
+    def tick(self, dx, dy, checksum):
+        self.data.append((dx + 1) | (dy + 1) << 2 | self._n_pending << 4)
+        self.data += self._pending
+        self.data += struct.pack('<H', checksum & 0xFFFF)
+        self._pending.clear()
+        self._n_pending = 0
+
+    def save(self, path):
+        flags = int(self.procedural) | int(self.use_guard_engine) << 1
+        header = self.HEADER.pack(self.MAGIC, self.seed, self.level, self.max_guards, flags)
+        with open(path, 'wb') as f:
+            f.write(zlib.compress(header + bytes(self.data), 9))
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            raw = zlib.decompress(f.read())
+        magic, seed, level, max_guards, flags = cls.HEADER.unpack_from(raw)
+        if magic != cls.MAGIC:
+            raise ValueError(f"{path}: non è un log di input")
+        return cls(seed, level, max_guards, bool(flags & 1), bool(flags & 2), raw[cls.HEADER.size:])
+
+    def ticks(self):
+        """Genera (dx, dy, [(codice, payload)], checksum16) per ogni tick registrato."""
+        data, i, actions = self.data, 0, []
+        while i < len(data):
+            head = data[i]
+            i += 1
+            for _ in range(head >> 4):
+                code = data[i]
+                size = _INPUT_PAYLOAD.get(code, 0)
+                actions.append((code, bytes(data[i + 1:i + 1 + size])))
+                i += 1 + size
+            if head & 3 == self.CHUNK:
+                continue
+            checksum, = struct.unpack_from('<H', data, i)
+            i += 2
+            yield (head & 3) - 1, (head >> 2 & 3) - 1, actions, checksum
+            actions = []
+
+
+def replay(path):
+    """
+    Rigioca un log headless alla massima velocità verificando il checksum di
+    ogni tick. Restituisce (tick eseguiti, primo tick divergente o None).
+    """
+    log = InputLog.load(path)
+    sim = Simulation(level=log.level, seed=log.seed, use_guard_engine=log.use_guard_engine,
+                     max_guards=log.max_guards, procedural=log.procedural)
+    sim.init_level()
+    n = 0
+    for n, (dx, dy, actions, checksum) in enumerate(log.ticks(), 1):
+        for code, payload in actions:
+            if code == INPUT_RESET_LEVEL:
+                sim.reset_level()
+            elif code == INPUT_RESTART:
+                sim.restart(struct.unpack('<I', payload)[0])
+            else:
+                sim.apply_action(TransformationType(code))
+        sim.step(dx, dy)
+        if sim.state_checksum() & 0xFFFF != checksum:
+            sim.level_generator.shutdown()
+            return n, n
+    sim.level_generator.shutdown()
+    return n, None
+
+
+# -----------------------------
+# Classifica (SQLite)
+# -----------------------------
+class Scoreboard:
+    """
+    Classifica su SQLite con indice sul livello: la top 10 si legge con una
+    query indicizzata e, dopo ogni inserimento, si aggiorna in memoria senza
+    rileggere tutto. Importa (una volta, poi solo le righe nuove) il vecchio
+    classifica.txt. WAL + BEGIN IMMEDIATE rendono sicuri più processi insieme.
+    """
+    def __init__(self, db_path="classifica.db", legacy_path="classifica.txt", size=10):
+        self.legacy_path = legacy_path
+        self.size = size
+        self.conn = sqlite3.connect(db_path, timeout=10, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS scores ("
+                          "id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, level INTEGER NOT NULL)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS scores_by_level ON scores (level DESC, id)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER)")
+        self._import_legacy()
+        self.top = []  # [(level, id, name)] ordinata come la query
+        self.refresh()
+
+    def _import_legacy(self):
+        """Importa le righe di classifica.txt non ancora viste (offset in byte salvato in meta)."""
+        if not os.path.exists(self.legacy_path):
+            return
+        if os.path.getsize(self.legacy_path) == self._legacy_offset():
+            return
+        with self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            offset = self._legacy_offset()
+            with open(self.legacy_path, "rb") as f:
+                f.seek(offset)
+                data = f.read()
+            # solo righe complete: una riga a metà la prende il prossimo avvio
+            data = data[:data.rfind(b"\n") + 1]
+            rows = []
+            for line in data.decode("utf-8", errors="replace").splitlines():
+                if ':' not in line:
+                    continue
+                try:
+                    rows.append((line.split('-')[0].strip(), int(line.split(':')[-1].strip())))
+                except ValueError:
+                    continue
+            self.conn.executemany("INSERT INTO scores (name, level) VALUES (?, ?)", rows)
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('legacy_offset', ?)",
+                              (offset + len(data),))
+
+    def _legacy_offset(self):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'legacy_offset'").fetchone()
+        return row[0] if row else 0
+
+    def refresh(self):
+        """Rilegge la top dal DB (query sull'indice; raccoglie anche gli altri processi)."""
+        self.top = [(level, row_id, name) for row_id, name, level in self.conn.execute(
+            "SELECT id, name, level FROM scores ORDER BY level DESC, id LIMIT ?", (self.size,))]
+
+    def add(self, name, level):
+        row_id = self.conn.execute("INSERT INTO scores (name, level) VALUES (?, ?)", (name, level)).lastrowid
+        # Top incrementale: a parità di livello il più vecchio resta davanti
+        keys = [(-lvl, rid) for lvl, rid, _ in self.top]
+        pos = bisect.bisect(keys, (-level, row_id))
+        if pos < self.size:
+            self.top.insert(pos, (level, row_id, name))
+            del self.top[self.size:]
+
+    def lines(self):
+        return [f"{i+1}. {name.split('-')[0].strip()} - {level}" for i, (level, _, name) in enumerate(self.top)]
+
+    def close(self):
+        self.conn.close()
+
+
+# -----------------------------
+# HUD (sidebar + barra in basso)
+# -----------------------------
+class HudText:
+    """Widget testuale legato a un valore: ri-renderizza solo quando il valore cambia."""
+    def __init__(self, target, font, fmt, anchor):
+        self.target = target
+        self.font = font
+        self.fmt = fmt
+        self.anchor = anchor  # anchor(surface testo) -> (x, y) sul target
+        self.value = None
+        self.rect = None
+
+    def refresh(self, value):
+        if value == self.value:
+            return False
+        self.value = value
+        if self.rect:
+            self.target.fill(BLACK, self.rect)
+        text = self.font.render(self.fmt.format(*value), True, WHITE)
+        self.rect = self.target.blit(text, self.anchor(text))
+        return True
+
+
+class Hud:
+    """
+    Sidebar e barra in basso composte in surface persistenti. Ogni widget si
+    ridisegna solo quando cambia il suo valore (livello, vite, rem_*,
+    classifica, trasformazione attiva e secondi rimasti); a regime il costo
+    per frame sono i due blit dei pannelli.
+    """
+    BOTTOM_HEIGHT = 40
+    INSTRUCTIONS = ["WASD/Frecce: Muovi", "1: Camuffamento", "2: Teletrasporto", "3: NOP Raygun", "4: Combo", "R: Reset Livello"]
+
+    def __init__(self, font, small_font):
+        self.font = font
+        self.small_font = small_font
+        self.width = SCREEN_WIDTH - GAME_WIDTH
+        self.center = self.width // 2
+        self.sidebar = pygame.Surface((self.width, GAME_HEIGHT))
+        self.sidebar.fill(BLACK)
+        self.bottom = pygame.Surface((SCREEN_WIDTH, self.BOTTOM_HEIGHT))
+        self.bottom.fill(BLACK)
+
+        # Istruzioni in basso a destra: statiche, composte una volta
+        ui_panel = pygame.Surface((250, 200), pygame.SRCALPHA)
+        ui_panel.fill((0, 0, 0, 180))
+        left = SCREEN_WIDTH - 200 - GAME_WIDTH
+        self.sidebar.blit(ui_panel, (left, GAME_HEIGHT - 205))
+        y = GAME_HEIGHT - 180
+        for instruction in self.INSTRUCTIONS:
+            self.sidebar.blit(small_font.render(instruction, True, WHITE), (left, y))
+            y += 30
+
+        level_height = font.get_height()
+        self.level = HudText(self.sidebar, font, "Livello: {}",
+                             lambda t: (self.center - t.get_width() // 2, 50))
+        self.lives = HudText(self.sidebar, font, "Vite rimaste: {}",
+                             lambda t: (self.center - t.get_width() // 2, 50 + level_height + 10))
+        self.rem = HudText(self.bottom, font,
+                           "Rimanenti - Camuffamenti: {} | Teletrasporti: {} | NOP raygun: {} | Combo: {}",
+                           lambda t: ((GAME_WIDTH - t.get_width()) // 2,
+                                      (self.BOTTOM_HEIGHT - t.get_height()) // 2))
+        self.scoreboard_header = small_font.render("CLASSIFICA TOP 10", True, WHITE)
+        self.scoreboard_value = None
+        self.scoreboard_rect = None
+
+        # Overlay nell'area di gioco: testi cache-ati per valore
+        self.warning = font.render("RILEVATO!", True, RED)
+        self._overlay_cache = {}
+
+        # Rect schermo cambiati dall'ultimo update (per chi ridisegna a pezzi)
+        self.changed_rects = []
+
+    def _refresh_scoreboard(self, top10):
+        if top10 == self.scoreboard_value:
+            return None
+        self.scoreboard_value = top10
+        if self.scoreboard_rect:
+            self.sidebar.fill(BLACK, self.scoreboard_rect)
+        header = self.scoreboard_header
+        classifica_height = (len(top10) * 20) + header.get_height() + 10
+        y = GAME_HEIGHT // 2 - (classifica_height // 2) - 20
+        rect = self.sidebar.blit(header, (self.center - header.get_width() // 2, y))
+        y += header.get_height() + 10
+        for line in top10:
+            text = self.small_font.render(line, True, WHITE)
+            rect.union_ip(self.sidebar.blit(text, (self.center - text.get_width() // 2, y)))
+            y += 20
+        self.scoreboard_rect = rect
+        return rect
+
+    def update(self, game):
+        """Aggiorna i widget il cui valore è cambiato."""
+        player = game.player
+        changed = []
+        for widget, value in ((self.level, (game.level,)), (self.lives, (player.lives,))):
+            old_rect = widget.rect
+            if widget.refresh(value):
+                changed.append(widget.rect.union(old_rect) if old_rect else widget.rect)
+        old_rect = self.scoreboard_rect
+        rect = self._refresh_scoreboard(tuple(game.top10_cache))
+        if rect:
+            changed.append(rect.union(old_rect) if old_rect else rect)
+        changed = [r.move(GAME_WIDTH, 0) for r in changed]
+
+        old_rect = self.rem.rect
+        if self.rem.refresh((player.rem_eq_transformations, player.rem_ibp_transformations,
+                             player.rem_nop_transformations, player.rem_combo_transformations)):
+            rect = self.rem.rect.union(old_rect) if old_rect else self.rem.rect
+            changed.append(rect.move(0, GAME_HEIGHT))
+        self.changed_rects = changed
+
+    def _overlay_text(self, text):
+        surf = self._overlay_cache.get(text)
+        if surf is None:
+            surf = self.small_font.render(text, True, WHITE)
+            self._overlay_cache[text] = surf
+        return surf
+
+    def overlays(self, player):
+        """(surface, pos) degli overlay nell'area di gioco per lo stato corrente."""
+        items = []
+        if player.transformation != TransformationType.NONE:
+            items.append((self._overlay_text(f"Trasformazione: {player.transformation.name}"), (10, 50)))
+            items.append((self._overlay_text(f"Tempo: {player.transformation_timer // TICK_RATE}s"), (10, 80)))
+        return items
+
+    def overlay_rects(self, player):
+        """Rect dell'area di gioco coperti dagli overlay (per il rendering dirty-rect)."""
+        rects = [surf.get_rect(topleft=pos) for surf, pos in self.overlays(player)]
+        if player.detected:
+            rects.append(self._warning_rect())
+        return rects
+
+    def _warning_rect(self):
+        x = GAME_WIDTH//2 - self.warning.get_width()//2
+        return pygame.Rect(x-10, 45, self.warning.get_width()+20, 40)
+
+    def draw_overlays(self, screen, player):
+        for surf, pos in self.overlays(player):
+            screen.blit(surf, pos)
+        # Warning rilevato (la vita è già stata scalata in step)
+        if player.detected:
+            rect = self._warning_rect()
+            pygame.draw.rect(screen, BLACK, rect)
+            screen.blit(self.warning, (rect.x + 10, 50))
+
+    def draw_panels(self, screen, rects=None):
+        """Blit dei pannelli; con rects (coordinate schermo) solo quelle aree."""
+        if rects is None:
+            screen.blit(self.sidebar, (GAME_WIDTH, 0))
+            screen.blit(self.bottom, (0, GAME_HEIGHT))
+            return
+        for rect in rects:
+            if rect.top >= GAME_HEIGHT:
+                screen.blit(self.bottom, rect, rect.move(0, -GAME_HEIGHT))
+            else:
+                screen.blit(self.sidebar, rect, rect.move(-GAME_WIDTH, 0))
+
+    def draw(self, screen, player):
+        self.draw_panels(screen)
+        self.draw_overlays(screen, player)
+
+
 # -----------------------------
-class Game:
+# Cache layer prerender (sfondo/muri)
+# -----------------------------
+class LayerCache:
+    """
+    Riusa bg_surface e walls_surface tra reset di livello. Lo sfondo dipende
+    solo dalle tile; i muri sono in cache per hash del layout, e se cambia
+    solo qualche muro si ri-piastrellano soltanto le aree toccate.
+    """
+    MAX_LAYOUTS = 4
+
     def __init__(self):
+        self.bg_key = None
+        self.bg_surface = None
+        self.walls_layers = {}   # hash layout -> (walls, wall_tile, surface), ordine = LRU
+        self.last_walls = None
+        self.static_layers = {}  # (id bg, id muri) -> sfondo+muri composti
+
+    def background(self, floor, circuit):
+        key = (id(floor), id(circuit))
+        if key != self.bg_key:
+            surf = pygame.Surface((GAME_WIDTH, GAME_HEIGHT))
+            for y in range(0, GAME_HEIGHT, TILE_SIZE):
+                for x in range(0, GAME_WIDTH, TILE_SIZE):
+                    if (x // TILE_SIZE + y // TILE_SIZE) % 3 == 0:
+                        surf.blit(circuit, (x, y))
+                    else:
+                        surf.blit(floor, (x, y))
+            self.bg_key, self.bg_surface = key, surf
+        return self.bg_surface
+
+    @staticmethod
+    def layout_hash(walls):
+        return hash(tuple(tuple(w) for w in walls))
+
+    @staticmethod
+    def _footprint(wall):
+        """Area davvero coperta dalle tile di un muro (le tile sporgono oltre il rect)."""
+        w = -(-wall.width // TILE_SIZE) * TILE_SIZE
+        h = -(-wall.height // TILE_SIZE) * TILE_SIZE
+        return pygame.Rect(wall.x, wall.y, w, h)
+
+    @staticmethod
+    def _tile_walls(surf, walls, wall_tile):
+        for wall in walls:
+            for x in range(wall.x, wall.x + wall.width, TILE_SIZE):
+                for y in range(wall.y, wall.y + wall.height, TILE_SIZE):
+                    if x < GAME_WIDTH and y < GAME_HEIGHT:
+                        surf.blit(wall_tile, (x, y))
+
+    def walls(self, walls, wall_tile):
+        key = (self.layout_hash(walls), id(wall_tile))
+        entry = self.walls_layers.pop(key, None)
+        if entry is None:
+            entry = (list(walls), wall_tile, self._build_walls(walls, wall_tile))
+        self.walls_layers[key] = entry
+        while len(self.walls_layers) > self.MAX_LAYOUTS:
+            del self.walls_layers[next(iter(self.walls_layers))]
+        self.last_walls = entry
+        return entry[2]
+
+    def _build_walls(self, walls, wall_tile):
+        prev = self.last_walls
+        if prev is not None and prev[1] is wall_tile:
+            old = {tuple(w) for w in prev[0]}
+            new = {tuple(w) for w in walls}
+            changed = [pygame.Rect(w) for w in old ^ new]
+            if len(changed) <= len(walls) // 2:
+                # Solo qualche muro diverso: copia e ri-piastrella le aree toccate
+                surf = prev[2].copy()
+                for area in merge_rects([self._footprint(w) for w in changed]):
+                    surf.set_clip(area)
+                    surf.fill((0, 0, 0, 0), area)
+                    self._tile_walls(surf, [w for w in walls if self._footprint(w).colliderect(area)], wall_tile)
+                surf.set_clip(None)
+                return surf
+        surf = pygame.Surface((GAME_WIDTH, GAME_HEIGHT), pygame.SRCALPHA)
+        self._tile_walls(surf, walls, wall_tile)
+        return surf
+
+    def static(self, bg_surface, walls_surface):
+        """Sfondo + muri in un'unica surface opaca (restore del rendering dirty-rect)."""
+        key = (id(bg_surface), id(walls_surface))
+        surf = self.static_layers.get(key)
+        if surf is None:
+            surf = bg_surface.copy()
+            surf.blit(walls_surface, (0, 0))
+            live = {(id(bg_surface), id(e[2])) for e in self.walls_layers.values()}
+            self.static_layers = {k: v for k, v in self.static_layers.items() if k in live}
+            self.static_layers[key] = surf
+        return surf
+
+
+# -----------------------------
+# Schermate statiche (menu, istruzioni, classifica)
+# -----------------------------
+class ScreenLayout:
+    """
+    Schermata ritenuta: sfondo già composto e surface di testo renderizzate
+    una volta, ridisegnata solo quando cambia qualcosa (tasto o scroll).
+    """
+    def __init__(self, background):
+        self.background = background
+        self.items = []      # (surface, (x, y)) fissi
+        self.scrolling = []  # (surface, (x, y)) spostati dall'offset di scroll
+
+    def add(self, surface, pos, scrolling=False):
+        (self.scrolling if scrolling else self.items).append((surface, pos))
+
+    def draw(self, screen, offset=0):
+        screen.blit(self.background, (0, 0))
+        if self.scrolling:
+            screen.blits([(surf, (x, y + offset)) for surf, (x, y) in self.scrolling], doreturn=False)
+        screen.blits(self.items, doreturn=False)
+
+
+# -----------------------------
+# Profiler di frame (F3 overlay, F4 trace)
+# -----------------------------
+class FrameProfiler:
+    """
+    Tempi per fase in ring buffer a dimensione fissa. Gli hook sono wrapper
+    messi sull'istanza del gioco solo quando il profiler è attivo: da spento
+    restano i metodi di classe e il costo è un if per frame.
+    """
+    PHASES = (
+        ('handle_events', 'input'),
+        ('_update_player', 'player'),
+        ('_update_guards', 'guards'),
+        ('_update_pulses', 'pulses'),
+        ('_update_particles', 'particles'),
+        ('_draw_vision', 'vision'),
+        ('_draw_entities', 'sprites'),
+        ('draw_ui', 'draw_ui'),
+        ('_present', 'flip'),
+    )
+    GRAPH_FRAMES = 112  # 2 px per frame nel pannello
+
+    def __init__(self, target, frames=600, events=16384):
+        self.target = target
+        self.rect = pygame.Rect(GAME_WIDTH - 250, 10, 240, 100 + 16 * len(self.PHASES))
+        self.enabled = False
+        self.overlay = False
+        self.frame_ms = np.zeros(frames)
+        self.phase_ms = np.zeros((frames, len(self.PHASES)))
+        self.frames = 0  # frame registrati in totale (indice ring = frames % len)
+        # eventi singoli per il trace: (fase, inizio, durata), anch'essi ad anello
+        self.ev_phase = np.zeros(events, dtype=np.int16)
+        self.ev_start = np.zeros(events)
+        self.ev_dur = np.zeros(events)
+        self.events = 0
+        self.origin = time.perf_counter()
+        self._frame_start = None
+        self._panel = None
+        self._saved = {}
+        self._overlay_hooks = False  # hook messi da F3 (e quindi da togliere con F3)
+
+    def enable(self):
+        if self.enabled:
+            return
+        # eventuali override già presenti sull'istanza si rimettono al disable
+        self._saved = {name: self.target.__dict__.get(name) for name, _ in self.PHASES}
+        for index, (name, _) in enumerate(self.PHASES):
+            setattr(self.target, name, self._hook(index, getattr(self.target, name)))
+        self.enabled = True
+        self._frame_start = None
+
+    def disable(self):
+        if not self.enabled:
+            return
+        for name, saved in self._saved.items():
+            if saved is None:
+                self.target.__dict__.pop(name, None)
+            else:
+                setattr(self.target, name, saved)
+        self.enabled = False
+        self.overlay = False
+
+    def toggle_overlay(self):
+        """F3: mostra/nasconde il pannello; gli hook si tolgono solo se li aveva messi F3 (non --profile)."""
+        if self.overlay:
+            self.overlay = False
+            if self._overlay_hooks:
+                self._overlay_hooks = False
+                self.disable()
+        else:
+            if not self.enabled:
+                self.enable()
+                self._overlay_hooks = True
+            self.overlay = True
+
+    def _hook(self, index, method):
+        clock = time.perf_counter
+        ring = self.phase_ms
+
+        def timed(*args, **kwargs):
+            start = clock()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                end = clock()
+                ring[self.frames % len(ring), index] += (end - start) * 1000.0
+                slot = self.events % len(self.ev_start)
+                self.ev_phase[slot] = index
+                self.ev_start[slot] = start
+                self.ev_dur[slot] = end - start
+                self.events += 1
+        return timed
+
+    def begin_frame(self):
+        if not self.enabled:
+            return
+        self._frame_start = time.perf_counter()
+        self.phase_ms[self.frames % len(self.frame_ms)] = 0.0
+
+    def end_frame(self):
+        if not self.enabled or self._frame_start is None:
+            return
+        slot = self.frames % len(self.frame_ms)
+        self.frame_ms[slot] = (time.perf_counter() - self._frame_start) * 1000.0
+        self.frames += 1
+        if self.overlay and self.frames % 15 == 0:
+            self._panel = None  # il pannello si rifà ogni 15 frame, non a ogni frame
+
+    def _recent(self, count):
+        """Indici ring degli ultimi count frame completi, dal più vecchio."""
+        count = min(count, self.frames, len(self.frame_ms))
+        return np.arange(self.frames - count, self.frames) % len(self.frame_ms)
+
+    def draw(self, screen, font):
+        if self._panel is None:
+            self._panel = self._render_panel(font)
+        screen.blit(self._panel, self.rect)
+
+    def _render_panel(self, font):
+        panel = pygame.Surface(self.rect.size, pygame.SRCALPHA)
+        panel.fill((0, 0, 0, 190))
+        idx = self._recent(self.GRAPH_FRAMES)
+        # grafico frame time: 33 ms = altezza piena, riga a 16.7 ms
+        graph_h = 60
+        scale = graph_h / 33.3
+        base = 8 + graph_h
+        for i, ms in enumerate(self.frame_ms[idx].tolist()):
+            h = min(graph_h, int(ms * scale))
+            color = GREEN if ms <= 1000.0 / TICK_RATE else (YELLOW if ms <= 33.3 else RED)
+            pygame.draw.line(panel, color, (8 + i * 2, base), (8 + i * 2, base - h))
+        y16 = base - int(1000.0 / TICK_RATE * scale)
+        pygame.draw.line(panel, GRAY, (8, y16), (8 + self.GRAPH_FRAMES * 2, y16))
+        avg = self.frame_ms[idx].mean() if len(idx) else 0.0
+        worst = self.frame_ms[idx].max() if len(idx) else 0.0
+        text = font.render(f"frame {avg:5.2f} ms  max {worst:5.2f}", True, WHITE)
+        panel.blit(text, (8, base + 6))
+        phase_avg = self.phase_ms[idx].mean(axis=0) if len(idx) else np.zeros(len(self.PHASES))
+        for row, ((_, label), ms) in enumerate(zip(self.PHASES, phase_avg.tolist())):
+            text = font.render(f"{label:<10} {ms:6.2f} ms", True, WHITE)
+            panel.blit(text, (8, base + 24 + row * 16))
+        return panel
+
+    def dump_chrome_trace(self, path):
+        """Scrive gli eventi del ring buffer nel formato JSON di chrome://tracing / Perfetto."""
+        count = min(self.events, len(self.ev_start))
+        order = np.arange(self.events - count, self.events) % len(self.ev_start)
+        events = [{'name': self.PHASES[p][1], 'cat': 'game', 'ph': 'X', 'pid': 1, 'tid': 1,
+                   'ts': round((start - self.origin) * 1e6, 1), 'dur': round(dur * 1e6, 1)}
+                  for p, start, dur in zip(self.ev_phase[order].tolist(), self.ev_start[order].tolist(),
+                                           self.ev_dur[order].tolist())]
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+        return len(events)
+
+
+# -----------------------------
+# Gioco
+# -----------------------------
+class Game(Simulation):
+    def __init__(self, dirty_rendering=False, record_path=None, profile=False):
+        super().__init__(SpriteManager(AssetCache()), background_levels=True)
+        self.profiler = FrameProfiler(self)
+        if profile:
+            self.profiler.enable()
+        self.record_path = record_path  # log degli input della partita (--record)
+        # Rendering a dirty-rect: ridisegna e presenta solo le aree in movimento
+        self.dirty_rendering = dirty_rendering
+        self.static_surface = None       # sfondo + muri composti (restore dirty-rect)
+        self._prev_rects = []
+        self._full_redraw = True
         self.screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
         pygame.display.set_caption("Metamorphic Maze - Sharper Night")
         self.clock = pygame.time.Clock()
@@ -530,25 +2870,28 @@ class Game:
         self.font = pygame.font.Font(None, 36)
         self.small_font = pygame.font.Font(None, 24)
         self.tiny_font = pygame.font.Font(None, 20)
+        self.hud = Hud(self.font, self.small_font)
 
         self.running = True
-        self.level = 1
-        self.sprite_manager = SpriteManager()
-        self.particle_effects = []
-        self.nop_pulses = []
+        self._prev_positions = []
         self.player_name = "Sonic Feet"
 
         # Surface condivise per performance
         self.vision_surface = pygame.Surface((GAME_WIDTH, GAME_HEIGHT), pygame.SRCALPHA)
+        self._vision_rects = [self.vision_surface.get_rect()]  # aree con coni dal frame prima
         self.bg_surface = None           # sfondo prerender
         self.walls_surface = None        # muri prerender
+        self.layers = LayerCache()
 
         # Cache classifica
+        self.scoreboard = Scoreboard()
         self.top10_cache = []
         self._load_scoreboard()
 
-        # Background del menu (precaricato)
+        # Background del menu (precaricato) e layout delle schermate, costruiti al primo uso
         self.menu_bg = None
+        self._menu_backdrop = None
+        self._layouts = {}
         self._load_menu_background()
 
         self.menu()
@@ -557,243 +2900,248 @@ class Game:
     def _load_menu_background(self):
         path = "assets/CyberGarflieldpng.png"
         if os.path.exists(path):
-            img = pygame.image.load(path)
-            img = pygame.transform.smoothscale(img, (SCREEN_WIDTH, SCREEN_HEIGHT))
-            img.set_alpha(100)
-            self.menu_bg = img
+            key = AssetCache.file_key(path, SCREEN_WIDTH, SCREEN_HEIGHT)
+            build = lambda: pygame.transform.smoothscale(load_image_32(path), (SCREEN_WIDTH, SCREEN_HEIGHT))
+            img = self.sprite_manager.bake({'menu_bg': (key, build)}).get('menu_bg')
+            if img is not None:
+                img = display_ready(img)
+                img.set_alpha(100)
+                self.menu_bg = img
 
     def _load_scoreboard(self):
-        self.top10_cache = []
-        if os.path.exists("classifica.txt"):
-            with open("classifica.txt", "r") as f:
-                lines = f.readlines()
-            lines = sorted(lines, key=lambda x: int(x.split(':')[-1].strip()) if ':' in x else 0, reverse=True)
-            for i, line in enumerate(lines[:10]):
-                try:
-                    nome = line.split('-')[0].strip()
-                    livello = line.split(':')[-1].strip()
-                    self.top10_cache.append(f"{i+1}. {nome} - {livello}")
-                except Exception:
-                    continue
+        self.scoreboard.refresh()
+        self.top10_cache = self.scoreboard.lines()
 
     def _append_score(self, name, level):
-        with open("classifica.txt", "a") as f:
-            f.write(f"{name} - Livello raggiunto: {level}\n")
-        self._load_scoreboard()
+        self.scoreboard.add(name, level)
+        self.top10_cache = self.scoreboard.lines()
 
     # ---------- Menu ----------
+    MENU_OPTIONS = (
+        ("- Inizia partita", "start_game"),
+        ("- Istruzioni", "instructions"),
+        ("- Significato scientifico", "scientifico"),
+        ("- Classifica", "classifica"),
+    )
+    BACK_HINT = "Premi R, ESC o INVIO per tornare al menu"
+
+    def _wait_key(self):
+        """
+        Blocca su pygame.event.wait fino al prossimo tasto: le schermate ferme
+        non consumano CPU. None se la finestra viene chiusa; gli expose
+        ripresentano l'ultimo frame senza ridisegnarlo.
+        """
+        while True:
+            event = pygame.event.wait()
+            if event.type == pygame.QUIT:
+                self.running = False
+                return None
+            if event.type == pygame.KEYDOWN:
+                return event
+            if event.type in (pygame.WINDOWEXPOSED, pygame.VIDEOEXPOSE):
+                pygame.display.flip()
+
+    def _backdrop(self):
+        """Nero + sfondo del menu, composto una volta sola."""
+        if self._menu_backdrop is None:
+            self._menu_backdrop = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT))
+            self._menu_backdrop.fill(BLACK)
+            if self.menu_bg:
+                self._menu_backdrop.blit(self.menu_bg, (0, 0))
+        return self._menu_backdrop
+
+    def _back_hint(self, layout):
+        # Box semitrasparente + testo in basso: "torna al menu"
+        text_info = self.small_font.render(self.BACK_HINT, True, ORANGE)
+        padding_x, padding_y = 28, 10
+        box_width = text_info.get_width() + 2 * padding_x
+        box_height = text_info.get_height() + 2 * padding_y
+        box_x = SCREEN_WIDTH//2 - box_width//2
+        box_y = SCREEN_HEIGHT - 60 - padding_y
+        box = pygame.Surface((box_width, box_height), pygame.SRCALPHA)
+        box.fill((0, 0, 0, 179))
+        layout.add(box, (box_x, box_y))
+        layout.add(text_info, (SCREEN_WIDTH//2 - text_info.get_width()//2, box_y + padding_y))
+
+    def _menu_layout(self):
+        """Intro, box e voci del menu (bianca e arancione) renderizzate una volta."""
+        if 'menu' in self._layouts:
+            return self._layouts['menu']
+        layout = ScreenLayout(self._backdrop())
+        title = self.font.render("Metamorphic Maze - Sharper Night", True, ORANGE)
+        small_description1 = self.small_font.render("Sei Garfield, un virus informatico che deve infiltrarsi in un sistema sorvegliato da antivirus.", True, WHITE)
+        small_description2 = self.small_font.render("Usa le trasformazioni metamorfiche per evitare di essere rilevato e raggiungere il server.", True, WHITE)
+
+        top_margin = 30
+        sd1_x = 50
+        sd1_y = top_margin + title.get_height() + 8
+        title_x = sd1_x + (small_description1.get_width() // 2) - (title.get_width() // 2)
+        title_y = top_margin
+        sd2_x = sd1_x + (small_description1.get_width() // 2) - (small_description2.get_width() // 2)
+        sd2_y = sd1_y + small_description1.get_height() + 4
+
+        min_x = min(title_x, sd1_x, sd2_x)
+        max_x = max(title_x + title.get_width(),
+                    sd1_x + small_description1.get_width(),
+                    sd2_x + small_description2.get_width())
+        box_width = max_x - min_x + 33
+        box_left = min_x - 16
+        min_y = min(title_y, sd1_y, sd2_y)
+        max_y = max(title_y + title.get_height(),
+                    sd1_y + small_description1.get_height(),
+                    sd2_y + small_description2.get_height())
+        box_height = max_y - min_y + 33
+        texts_center_y = (min_y + max_y) // 2
+        box_top = texts_center_y - (box_height // 2)
+        box_surface = pygame.Surface((box_width, box_height), pygame.SRCALPHA)
+        box_surface.fill((0, 0, 0, 102))
+        layout.add(box_surface, (box_left, box_top))
+        layout.add(title, (title_x, title_y))
+        layout.add(small_description1, (sd1_x, sd1_y))
+        layout.add(small_description2, (sd2_x, sd2_y))
+
+        # Box opzioni
+        menu_width = max(self.small_font.size(text)[0] for text, _ in self.MENU_OPTIONS)
+        menu_height = sum(self.small_font.size(text)[1] for text, _ in self.MENU_OPTIONS)
+        padding_x, padding_y, spacing = 20, 12, 8
+        box_width = menu_width + 2 * padding_x
+        box_height = menu_height + (len(self.MENU_OPTIONS)-1)*spacing + 2 * padding_y
+        box_x = SCREEN_WIDTH - box_width - 30
+        box_y = SCREEN_HEIGHT - box_height - 30
+        menu_box = pygame.Surface((box_width, box_height), pygame.SRCALPHA)
+        menu_box.fill((0, 0, 0, 102))
+        layout.add(menu_box, (box_x, box_y))
+        options = []  # (normale, selezionata, posizione)
+        current_y = box_y + padding_y
+        for text, _ in self.MENU_OPTIONS:
+            normal = self.small_font.render(text, True, WHITE)
+            options.append((normal, self.small_font.render(text, True, ORANGE), (box_x + padding_x, current_y)))
+            current_y += normal.get_height() + spacing
+        self._layouts['menu'] = layout, options
+        return layout, options
+
     def menu(self):
-        waiting = True
+        layout, options = self._menu_layout()
         selected = 0
-        menu_options = [
-            {"text": "- Inizia partita", "action": "start_game"},
-            {"text": "- Istruzioni", "action": "instructions"},
-            {"text": "- Significato scientifico", "action": "scientifico"},
-            {"text": "- Classifica", "action": "classifica"},
-        ]
-
-        while waiting:
-            # Background
-            self.screen.fill(BLACK)
-            if self.menu_bg:
-                self.screen.blit(self.menu_bg, (0, 0))
-
-            # Testi intro
-            title = self.font.render("Metamorphic Maze - Sharper Night", True, ORANGE)
-            small_description1 = self.small_font.render("Sei Garfield, un virus informatico che deve infiltrarsi in un sistema sorvegliato da antivirus.", True, WHITE)
-            small_description2 = self.small_font.render("Usa le trasformazioni metamorfiche per evitare di essere rilevato e raggiungere il server.", True, WHITE)
-
-            top_margin = 30
-            sd1_x = 50
-            sd1_y = top_margin + title.get_height() + 8
-            title_x = sd1_x + (small_description1.get_width() // 2) - (title.get_width() // 2)
-            title_y = top_margin
-            sd2_x = sd1_x + (small_description1.get_width() // 2) - (small_description2.get_width() // 2)
-            sd2_y = sd1_y + small_description1.get_height() + 4
-
-            min_x = min(title_x, sd1_x, sd2_x)
-            max_x = max(title_x + title.get_width(),
-                        sd1_x + small_description1.get_width(),
-                        sd2_x + small_description2.get_width())
-            box_width = max_x - min_x + 33
-            box_left = min_x - 16
-            min_y = min(title_y, sd1_y, sd2_y)
-            max_y = max(title_y + title.get_height(),
-                        sd1_y + small_description1.get_height(),
-                        sd2_y + small_description2.get_height())
-            box_height = max_y - min_y + 33
-            texts_center_y = (min_y + max_y) // 2
-            box_top = texts_center_y - (box_height // 2)
-            box_surface = pygame.Surface((box_width, box_height), pygame.SRCALPHA)
-            box_surface.fill((0, 0, 0, 102))
-            self.screen.blit(box_surface, (box_left, box_top))
-            self.screen.blit(title, (title_x, title_y))
-            self.screen.blit(small_description1, (sd1_x, sd1_y))
-            self.screen.blit(small_description2, (sd2_x, sd2_y))
-
-            # Box opzioni
-            menu_width = max(self.small_font.size(opt["text"])[0] for opt in menu_options)
-            menu_height = sum(self.small_font.size(opt["text"])[1] for opt in menu_options)
-            padding_x, padding_y, spacing = 20, 12, 8
-            box_width = menu_width + 2 * padding_x
-            box_height = menu_height + (len(menu_options)-1)*spacing + 2 * padding_y
-            box_x = SCREEN_WIDTH - box_width - 30
-            box_y = SCREEN_HEIGHT - box_height - 30
-            menu_box = pygame.Surface((box_width, box_height), pygame.SRCALPHA)
-            menu_box.fill((0, 0, 0, 102))
-            self.screen.blit(menu_box, (box_x, box_y))
-            current_y = box_y + padding_y
-            for idx, option in enumerate(menu_options):
-                color = ORANGE if idx == selected else WHITE
-                text = self.small_font.render(option["text"], True, color)
-                self.screen.blit(text, (box_x + padding_x, current_y))
-                current_y += text.get_height() + spacing
+        redraw = True
+        while True:
+            if redraw:
+                layout.draw(self.screen)
+                self.screen.blits([(selected_text if idx == selected else normal, pos)
+                                   for idx, (normal, selected_text, pos) in enumerate(options)], doreturn=False)
+                pygame.display.flip()
 
+            # Eventi: senza input la schermata resta quella (niente ridisegno a vuoto)
+            event = self._wait_key()
+            if event is None:
+                return
+            redraw = True
+            if event.key == pygame.K_UP:
+                selected = (selected - 1) % len(options)
+            elif event.key == pygame.K_DOWN:
+                selected = (selected + 1) % len(options)
+            elif event.key in (pygame.K_RETURN, pygame.K_KP_ENTER):
+                action = self.MENU_OPTIONS[selected][1]
+                if action == "start_game":
+                    self._ask_player_name()
+                    self.init_level()
+                    return
+                elif action == "scientifico":
+                    self._screen_scrolling_text(self._scientifico_text())
+                elif action == "classifica":
+                    self._screen_classifica()
+                elif action == "instructions":
+                    self._screen_instructions()
+                if not self.running:
+                    return
+            else:
+                redraw = False
+
+    def _ask_player_name(self):
+        """Prompt nome giocatore: ridisegna solo quando il testo cambia."""
+        self.player_name = ""
+        backdrop = self._backdrop()
+        while True:
+            self.screen.blit(backdrop, (0, 0))
+            prompt = self.small_font.render("Inserisci il tuo nome (max 15 caratteri): " + self.player_name, True, WHITE)
+            self.screen.blit(prompt, (SCREEN_WIDTH//2 - prompt.get_width()//2, SCREEN_HEIGHT//2))
             pygame.display.flip()
-            self.clock.tick(FPS)  # LIMITA FPS NEL MENU
-
-            # Eventi
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    waiting = False
-                    self.running = False
-                elif event.type == pygame.KEYDOWN:
-                    if event.key == pygame.K_UP:
-                        selected = (selected - 1) % len(menu_options)
-                    elif event.key == pygame.K_DOWN:
-                        selected = (selected + 1) % len(menu_options)
-                    elif event.key in (pygame.K_RETURN, pygame.K_KP_ENTER):
-                        action = menu_options[selected]["action"]
-                        if action == "start_game":
-                            # prompt nome giocatore
-                            self.player_name = ""
-                            asking_name = True
-                            while asking_name:
-                                self.screen.fill(BLACK)
-                                if self.menu_bg:
-                                    self.screen.blit(self.menu_bg, (0, 0))
-                                prompt = self.small_font.render("Inserisci il tuo nome (max 15 caratteri): " + self.player_name, True, WHITE)
-                                self.screen.blit(prompt, (SCREEN_WIDTH//2 - prompt.get_width()//2, SCREEN_HEIGHT//2))
-                                pygame.display.flip()
-                                self.clock.tick(FPS)  # LIMITA FPS
-                                for ev in pygame.event.get():
-                                    if ev.type == pygame.QUIT:
-                                        asking_name = False
-                                        waiting = False
-                                        self.running = False
-                                    elif ev.type == pygame.KEYDOWN:
-                                        if ev.key == pygame.K_RETURN:
-                                            if len(self.player_name) > 0:
-                                                asking_name = False
-                                        elif ev.key == pygame.K_BACKSPACE:
-                                            self.player_name = self.player_name[:-1]
-                                        else:
-                                            if len(self.player_name) < 15 and ev.unicode.isprintable():
-                                                self.player_name += ev.unicode
-                            waiting = False
-                            self.init_level()
-                            return
-
-                        elif action == "scientifico":
-                            self._screen_scrolling_text(self._scientifico_text())
-                        elif action == "classifica":
-                            self._screen_classifica()
-                        elif action == "instructions":
-                            self._screen_instructions()
-
-    def _screen_scrolling_text(self, string):
-        lines_raw = string.split('\n')
-        lines = []
-        indent = 0
-        for line in lines_raw:
-            if line.strip().startswith(('1)', '2)', '3)', '4)', '5)')):
-                indent = 0
-                lines.append((line.strip(), indent))
-                indent = 18.5
-            elif line.strip() == '':
-                indent = 0
-                lines.append(('', 0))
+            event = self._wait_key()
+            if event is None:
+                return
+            if event.key == pygame.K_RETURN:
+                if len(self.player_name) > 0:
+                    return
+            elif event.key == pygame.K_BACKSPACE:
+                self.player_name = self.player_name[:-1]
             else:
-                lines.append((line.strip(), indent))
+                if len(self.player_name) < 15 and event.unicode.isprintable():
+                    self.player_name += event.unicode
+
+    def _show_layout(self, layout, scroll_step=0):
+        """Mostra layout finché non si torna al menu; con scroll_step le frecce scorrono il testo."""
         offset = 0
-        waiting = True
-        while waiting and self.running:
-            self.screen.fill(BLACK)
-            if self.menu_bg:
-                self.screen.blit(self.menu_bg, (0, 0))
-            y = SCREEN_HEIGHT//2 - len(lines)*10 + offset
+        redraw = True
+        while self.running:
+            if redraw:
+                layout.draw(self.screen, offset)
+                pygame.display.flip()
+            event = self._wait_key()
+            if event is None:
+                return
+            redraw = True
+            if event.key in (pygame.K_r, pygame.K_ESCAPE, pygame.K_RETURN):
+                return
+            elif scroll_step and event.key == pygame.K_UP:
+                offset += scroll_step
+            elif scroll_step and event.key == pygame.K_DOWN:
+                offset -= scroll_step
+            else:
+                redraw = False
+
+    def _screen_scrolling_text(self, string):
+        layout = self._layouts.get(('text', string))
+        if layout is None:
+            lines_raw = string.split('\n')
+            lines = []
+            indent = 0
+            for line in lines_raw:
+                if line.strip().startswith(('1)', '2)', '3)', '4)', '5)')):
+                    indent = 0
+                    lines.append((line.strip(), indent))
+                    indent = 18.5
+                elif line.strip() == '':
+                    indent = 0
+                    lines.append(('', 0))
+                else:
+                    lines.append((line.strip(), indent))
+            layout = ScreenLayout(self._backdrop())
+            y = SCREEN_HEIGHT//2 - len(lines)*10
             for line, ind in lines:
-                text = self.small_font.render(line, True, WHITE)
-                self.screen.blit(text, (50 + ind, y))
+                layout.add(self.small_font.render(line, True, WHITE), (50 + ind, y), scrolling=True)
                 y += 20
-            info = "Premi R, ESC o INVIO per tornare al menu"
-            text_info = self.small_font.render(info, True, ORANGE)
-            padding_x, padding_y = 28, 10
-            box_width = text_info.get_width() + 2 * padding_x
-            box_height = text_info.get_height() + 2 * padding_y
-            box_x = SCREEN_WIDTH//2 - box_width//2
-            box_y = SCREEN_HEIGHT - 60 - padding_y
-            menu_box = pygame.Surface((box_width, box_height), pygame.SRCALPHA)
-            menu_box.fill((0, 0, 0, 179))
-            self.screen.blit(menu_box, (box_x, box_y))
-            self.screen.blit(text_info, (SCREEN_WIDTH//2 - text_info.get_width()//2, box_y + padding_y))
-            pygame.display.flip()
-            self.clock.tick(FPS)  # LIMITA FPS
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    waiting = False
-                    self.running = False
-                elif event.type == pygame.KEYDOWN:
-                    if event.key in (pygame.K_r, pygame.K_ESCAPE, pygame.K_RETURN):
-                        waiting = False
-                    elif event.key == pygame.K_UP:
-                        offset += 20
-                    elif event.key == pygame.K_DOWN:
-                        offset -= 20
+            self._back_hint(layout)
+            self._layouts[('text', string)] = layout
+        self._show_layout(layout, scroll_step=20)
 
     def _screen_classifica(self):
-        # carica da file una sola volta all’apertura della schermata
+        # carica la classifica una sola volta all’apertura della schermata
         self._load_scoreboard()
-        waiting = True
         show_first_n = 10
-        while waiting and self.running:
-            self.screen.fill(BLACK)
-            if self.menu_bg:
-                self.screen.blit(self.menu_bg, (0, 0))
-            title = self.font.render("Classifica TOP 10", True, WHITE)
-            self.screen.blit(title, (SCREEN_WIDTH//2 - title.get_width()//2, 50))
-            y = 100
-            for line in self.top10_cache[:show_first_n]:
-                text = self.small_font.render(line, True, WHITE)
-                self.screen.blit(text, (SCREEN_WIDTH//2 - text.get_width()//2, y))
-                y += 30
-            info = "Premi R, ESC o INVIO per tornare al menu"
-            text_info = self.small_font.render(info, True, ORANGE)
-            padding_x, padding_y = 28, 10
-            box_width = text_info.get_width() + 2 * padding_x
-            box_height = text_info.get_height() + 2 * padding_y
-            box_x = SCREEN_WIDTH//2 - box_width//2
-            box_y = SCREEN_HEIGHT - 60 - padding_y
-            menu_box = pygame.Surface((box_width, box_height), pygame.SRCALPHA)
-            menu_box.fill((0, 0, 0, 179))
-            self.screen.blit(menu_box, (box_x, box_y))
-            self.screen.blit(text_info, (SCREEN_WIDTH//2 - text_info.get_width()//2, box_y + padding_y))
-            pygame.display.flip()
-            self.clock.tick(FPS)  # LIMITA FPS
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    waiting = False
-                    self.running = False
-                elif event.type == pygame.KEYDOWN:
-                    if event.key in (pygame.K_r, pygame.K_ESCAPE, pygame.K_RETURN):
-                        waiting = False
+        layout = ScreenLayout(self._backdrop())
+        title = self.font.render("Classifica TOP 10", True, WHITE)
+        layout.add(title, (SCREEN_WIDTH//2 - title.get_width()//2, 50))
+        y = 100
+        for line in self.top10_cache[:show_first_n]:
+            text = self.small_font.render(line, True, WHITE)
+            layout.add(text, (SCREEN_WIDTH//2 - text.get_width()//2, y))
+            y += 30
+        self._back_hint(layout)
+        self._show_layout(layout)
 
     def _screen_instructions(self):
-        waiting = True
-        while waiting and self.running:
-            self.screen.fill(BLACK)
-            if self.menu_bg:
-                self.screen.blit(self.menu_bg, (0, 0))
+        layout = self._layouts.get('instructions')
+        if layout is None:
             lines = [
                 "ISTRUZIONI:",
                 "WASD/Frecce: Muovi il giocatore",
@@ -803,37 +3151,19 @@ class Game:
                 "4: Combo (Combo)",
                 "R: Reset Livello"
             ]
+            layout = ScreenLayout(self._backdrop())
             big_font = pygame.font.Font(None, self.small_font.get_height() + 20)
             text_title = big_font.render(lines[0], True, WHITE)
             title_x = SCREEN_WIDTH//2 - text_title.get_width()//2
             title_y = SCREEN_HEIGHT//2 - len(lines)*20
-            self.screen.blit(text_title, (title_x, title_y))
+            layout.add(text_title, (title_x, title_y))
             y = title_y + text_title.get_height() + 20
             for line in lines[1:]:
-                text = self.small_font.render(line, True, WHITE)
-                self.screen.blit(text, (180, y))
+                layout.add(self.small_font.render(line, True, WHITE), (180, y))
                 y += 30
-
-            info = "Premi R, ESC o INVIO per tornare al menu"
-            text_info = self.small_font.render(info, True, ORANGE)
-            padding_x, padding_y = 28, 10
-            box_width = text_info.get_width() + 2 * padding_x
-            box_height = text_info.get_height() + 2 * padding_y
-            box_x = SCREEN_WIDTH//2 - box_width//2
-            box_y = SCREEN_HEIGHT - 60 - padding_y
-            menu_box = pygame.Surface((box_width, box_height), pygame.SRCALPHA)
-            menu_box.fill((0, 0, 0, 179))
-            self.screen.blit(menu_box, (box_x, box_y))
-            self.screen.blit(text_info, (SCREEN_WIDTH//2 - text_info.get_width()//2, box_y + padding_y))
-            pygame.display.flip()
-            self.clock.tick(FPS)  # LIMITA FPS
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    waiting = False
-                    self.running = False
-                elif event.type == pygame.KEYDOWN:
-                    if event.key in (pygame.K_r, pygame.K_ESCAPE, pygame.K_RETURN):
-                        waiting = False
+            self._back_hint(layout)
+            self._layouts['instructions'] = layout
+        self._show_layout(layout)
 
     def _scientifico_text(self):
         return '''
@@ -874,86 +3204,20 @@ Ecco quali sono e cosa fanno, in breve:
 
     # ---------- Gioco ----------
     def init_level(self):
-        # Player
-        if self.level == 1:
-            self.player = Player(100, 100, self.sprite_manager, lives=3)
-        else:
-            new_lives = self.player.lives + 1 if self.player.lives < 5 else self.player.lives
-            self.player = Player(100, 100, self.sprite_manager, lives=new_lives)
-
-        self.goal = Goal(GAME_WIDTH - 150, GAME_HEIGHT - 150, self.sprite_manager)
-        self.guards = []
-        self.walls = []
-
-        # Bordi
-        self.walls.append(pygame.Rect(0, 0, GAME_WIDTH, 20))
-        self.walls.append(pygame.Rect(0, GAME_HEIGHT-20, GAME_WIDTH, 20))
-        self.walls.append(pygame.Rect(0, 0, 20, GAME_HEIGHT))
-        self.walls.append(pygame.Rect(GAME_WIDTH-20, 0, 20, GAME_HEIGHT))
-        # Muri interni (come prima)
-        self.walls += [
-            pygame.Rect(200, 100, 20, 300),
-            pygame.Rect(400, 200, 200, 20),
-            pygame.Rect(600, 100, 20, 300),
-            pygame.Rect(300, 500, 400, 20),
-            pygame.Rect(150, 300, 300, 20),
-            pygame.Rect(500, 400, 20, 200),
-            pygame.Rect(700, 250, 20, 300),
-            pygame.Rect(250, 150, 20, 200),
-            pygame.Rect(350, 350, 200, 20),
-            pygame.Rect(100, 450, 150, 20),
-            pygame.Rect(450, 100, 20, 150),
-            pygame.Rect(600, 500, 150, 20),
-            pygame.Rect(800, 300, 20, 200),
-            pygame.Rect(700, 150, 150, 20),
-            pygame.Rect(900, 100, 20, 300),
-            pygame.Rect(850, 400, 150, 20),
-            pygame.Rect(300, GAME_HEIGHT - 180, 400, 20),
-        ]
-
-        # Guardie
-        for i in range(min(self.level + 2, 15)):
-            x = random.randint(200, GAME_WIDTH - 200)
-            y = random.randint(200, GAME_HEIGHT - 200)
-            path = self.generate_random_path(x, y)
-            self.guards.append(Guard(
-                x, y, path, self.sprite_manager,
-                detection_color=random.choice(['blue','red','green','yellow','purple','black','white'])
-            ))
-
-        # Prerender sfondo e muri (performance)
+        super().init_level()
+        # Prerender sfondo e muri (performance), riusati se il layout non cambia
         self._prerender_background()
         self._prerender_walls()
-
-        # Pulisci effetti/pulses
-        self.particle_effects = []
-        self.nop_pulses = []
+        if self.dirty_rendering:
+            self.static_surface = self.layers.static(self.bg_surface, self.walls_surface)
+        self._full_redraw = True
 
     def _prerender_background(self):
-        self.bg_surface = pygame.Surface((GAME_WIDTH, GAME_HEIGHT))
-        for y in range(0, GAME_HEIGHT, TILE_SIZE):
-            for x in range(0, GAME_WIDTH, TILE_SIZE):
-                if (x // TILE_SIZE + y // TILE_SIZE) % 3 == 0:
-                    self.bg_surface.blit(self.sprite_manager.sprites['circuit'], (x, y))
-                else:
-                    self.bg_surface.blit(self.sprite_manager.sprites['floor'], (x, y))
+        sprites = self.sprite_manager.sprites
+        self.bg_surface = self.layers.background(sprites['floor'], sprites['circuit'])
 
     def _prerender_walls(self):
-        self.walls_surface = pygame.Surface((GAME_WIDTH, GAME_HEIGHT), pygame.SRCALPHA)
-        wall_tile = self.sprite_manager.sprites['wall']
-        for wall in self.walls:
-            for x in range(wall.x, wall.x + wall.width, TILE_SIZE):
-                for y in range(wall.y, wall.y + wall.height, TILE_SIZE):
-                    if x < GAME_WIDTH and y < GAME_HEIGHT:
-                        self.walls_surface.blit(wall_tile, (x, y))
-
-    def generate_random_path(self, start_x, start_y):
-        path = [(start_x, start_y)]
-        for _ in range(3):
-            x = random.randint(100, GAME_WIDTH - 100)
-            y = random.randint(100, GAME_HEIGHT - 100)
-            path.append((x, y))
-        return path
+        self.walls_surface = self.layers.walls(self.walls, self.sprite_manager.sprites['wall'])
 
     def handle_events(self):
         for event in pygame.event.get():
@@ -961,194 +3225,118 @@ Ecco quali sono e cosa fanno, in breve:
                 self.running = False
             elif event.type == pygame.KEYDOWN:
                 if event.key == pygame.K_1:
-                    effect = self.player.apply_transformation(TransformationType.SUBSTITUTION, self)
-                    if effect: self.particle_effects.append(effect)
+                    self.apply_action(TransformationType.SUBSTITUTION)
                 elif event.key == pygame.K_2:
-                    effect = self.player.apply_transformation(TransformationType.PERMUTATION, self)
-                    if effect: self.particle_effects.append(effect)
+                    self.apply_action(TransformationType.PERMUTATION)
                 elif event.key == pygame.K_3:
-                    effect = self.player.apply_transformation(TransformationType.NOP_INSERTION, self)
-                    if effect: self.particle_effects.append(effect)
+                    self.apply_action(TransformationType.NOP_INSERTION)
                 elif event.key == pygame.K_4:
-                    effect = self.player.apply_transformation(TransformationType.COMBO, self)
-                    if effect: self.particle_effects.append(effect)
+                    self.apply_action(TransformationType.COMBO)
                 elif event.key == pygame.K_5:
-                    effect = self.player.apply_transformation(TransformationType.POSITION_INDEPENDENT, self)
-                    if effect: self.particle_effects.append(effect)
+                    self.apply_action(TransformationType.POSITION_INDEPENDENT)
                 elif event.key == pygame.K_r:
-                    self.init_level()  # Reset livello
+                    self.reset_level()
+                elif event.key == pygame.K_F3:
+                    self.profiler.toggle_overlay()
+                elif event.key == pygame.K_F4:
+                    path = time.strftime("profile-%Y%m%d-%H%M%S.json")
+                    count = self.profiler.dump_chrome_trace(path)
+                    print(f"Trace del profiler: {path} ({count} eventi)")
+
+    def _snapshot(self):
+        """Posizioni prima del tick: il render interpola fra queste e quelle correnti."""
+        self._prev_positions = [(e, e.x, e.y) for e in [self.player, *self.guards]]
+
+    def _interpolate(self, alpha):
+        """Porta player e guardie alla posizione interpolata; restituisce cosa ripristinare."""
+        current = {id(self.player)} | {id(g) for g in self.guards}
+        restore = []
+        for entity, px, py in self._prev_positions:
+            if id(entity) not in current:
+                continue  # livello ricaricato: oggetto non più in scena
+            x, y = entity.x, entity.y
+            if (x == px and y == py) or abs(x - px) > SNAP_DISTANCE or abs(y - py) > SNAP_DISTANCE:
+                continue
+            restore.append((entity, x, y))
+            entity.x = px + (x - px) * alpha
+            entity.y = py + (y - py) * alpha
+        return restore
 
     def update(self):
         keys = pygame.key.get_pressed()
         dx = (keys[pygame.K_RIGHT] or keys[pygame.K_d]) - (keys[pygame.K_LEFT] or keys[pygame.K_a])
         dy = (keys[pygame.K_DOWN] or keys[pygame.K_s]) - (keys[pygame.K_UP] or keys[pygame.K_w])
-        self.player.move(dx, dy, self.walls)
-        self.player.update()
-
-        detected = False
-        for guard in self.guards:
-            if guard.update(self.player):
-                detected = True
-        self.player.detected = detected
-
-        # Particelle (cap max per non esplodere)
-        for effect in self.particle_effects[:]:
-            if not effect.update():
-                self.particle_effects.remove(effect)
-        if len(self.particle_effects) > 100:
-            self.particle_effects = self.particle_effects[-100:]
-
-        self.goal.update()
-
-        # NOP pulses + collisioni
-        for pulse in self.nop_pulses[:]:
-            alive = pulse.update(self.walls)
-            hit_something = False
-            for guard in self.guards:
-                gx = guard.x + TILE_SIZE / 2
-                gy = guard.y + TILE_SIZE / 2
-                d = math.hypot(gx - pulse.x, gy - pulse.y)
-                if d <= pulse.radius + TILE_SIZE * 0.5:
-                    ux = (gx - pulse.x) / (d + 1e-6)
-                    uy = (gy - pulse.y) / (d + 1e-6)
-                    push_strength = 80
-                    atten = max(0.35, 1.0 - d / (pulse.radius + TILE_SIZE * 0.5))
-                    dx = ux * push_strength * atten
-                    dy = uy * push_strength * atten
-                    guard.x = max(20, min(GAME_WIDTH - 20 - TILE_SIZE, guard.x + dx))
-                    guard.y = max(20, min(GAME_HEIGHT - 20 - TILE_SIZE, guard.y + dy))
-                    guard.choicex = int(math.copysign(1, ux)) if abs(ux) > 0.2 else 0
-                    guard.choicey = int(math.copysign(1, uy)) if abs(uy) > 0.2 else 0
-                    guard.seconds_to_travel = 30
-                    hit_something = True
-            if not alive or hit_something:
-                self.nop_pulses.remove(pulse)
-        if len(self.nop_pulses) > 20:
-            self.nop_pulses = self.nop_pulses[-20:]
-
-        # Vittoria
-        player_rect = pygame.Rect(self.player.x, self.player.y, TILE_SIZE, TILE_SIZE)
-        goal_rect = pygame.Rect(self.goal.x, self.goal.y, TILE_SIZE * 2, TILE_SIZE * 2)
-        if player_rect.colliderect(goal_rect):
-            self.player.win = True
-            self.level += 1
-            self.player.rem_combo_transformations = MAX_COMBO_TRANSFORMATIONS
-            self.player.rem_eq_transformations = MAX_EQ_TRANSFORMATIONS
-            self.player.rem_nop_transformations = MAX_NOP_TRANSFORMATIONS
-            self.player.rem_ibp_transformations = MAX_IBP_TRANSFORMATIONS
-            self.init_level()
+        self.step(dx, dy)
 
     def draw_ui(self):
-        # Sidebar destra (nera)
-        sidebar_x = GAME_WIDTH
-        sidebar_y = 0
-        sidebar_width = SCREEN_WIDTH - GAME_WIDTH
-        sidebar_height = GAME_HEIGHT
-        sidebar_panel = pygame.Surface((sidebar_width, sidebar_height))
-        sidebar_panel.fill(BLACK)
-        self.screen.blit(sidebar_panel, (sidebar_x, sidebar_y))
-        center_sidebar = sidebar_x + sidebar_width // 2
-
-        level_text = self.font.render(f"Livello: {self.level}", True, WHITE)
+        # HUD a widget: ridisegna solo ciò che è cambiato, poi due blit
+        self.hud.update(self)
+        self.hud.draw(self.screen, self.player)
+
+    def _screen_game_over(self):
+        self._full_redraw = True
+        warning = self.font.render("RILEVATO!", True, RED)
+        x = GAME_WIDTH//2 - warning.get_width()//2
         lives_text = self.font.render(f"Vite rimaste: {self.player.lives}", True, WHITE)
-        self.screen.blit(level_text, (center_sidebar - level_text.get_width() // 2, 50))
-        self.screen.blit(lives_text, (center_sidebar - lives_text.get_width() // 2, 50 + level_text.get_height() + 10))
-
-        # Classifica (da cache)
-        scoreboard = self.small_font.render("CLASSIFICA TOP 10", True, WHITE)
-        classifica_height = (len(self.top10_cache) * 20) + scoreboard.get_height() + 10
-        sidebar_center_y = sidebar_y + sidebar_height // 2
-        scoreboard_y = sidebar_center_y - (classifica_height // 2) - 20
-        scoreboard_x = center_sidebar - scoreboard.get_width() // 2
-        self.screen.blit(scoreboard, (scoreboard_x, scoreboard_y))
-        base_y = scoreboard_y + scoreboard.get_height() + 10
-        for line in self.top10_cache:
-            text = self.small_font.render(line, True, WHITE)
-            tx = center_sidebar - text.get_width() // 2
-            self.screen.blit(text, (tx, base_y))
-            base_y += 20
-
-        # Bottom bar (nera)
-        bottom_sidebar_height = 40
-        bottom_sidebar_y = GAME_HEIGHT
-        bottom_sidebar_panel = pygame.Surface((SCREEN_WIDTH, bottom_sidebar_height))
-        bottom_sidebar_panel.fill(BLACK)
-        self.screen.blit(bottom_sidebar_panel, (0, bottom_sidebar_y))
-
-        rem_transformations = self.font.render(
-            f"Rimanenti - Camuffamenti: {self.player.rem_eq_transformations} | Teletrasporti: {self.player.rem_ibp_transformations} | NOP raygun: {self.player.rem_nop_transformations} | Combo: {self.player.rem_combo_transformations}",
-            True, WHITE)
-        rem_x = (GAME_WIDTH - rem_transformations.get_width()) // 2
-        rem_y = bottom_sidebar_y + (bottom_sidebar_height - rem_transformations.get_height()) // 2
-        self.screen.blit(rem_transformations, (rem_x, rem_y))
-
-        # Istruzioni in basso a destra
-        ui_panel = pygame.Surface((250, 200), pygame.SRCALPHA)
-        ui_panel.fill((0, 0, 0, 180))
-        self.screen.blit(ui_panel, (SCREEN_WIDTH - 200, GAME_HEIGHT - 205))
-        instructions = ["WASD/Frecce: Muovi", "1: Camuffamento", "2: Teletrasporto", "3: NOP Raygun", "4: Combo", "R: Reset Livello"]
-        y = GAME_HEIGHT - 180
-        for instruction in instructions:
-            text = self.small_font.render(instruction, True, WHITE)
-            self.screen.blit(text, (SCREEN_WIDTH - 200, y))
-            y += 30
-
-        # Info trasformazione attiva
-        if self.player.transformation != TransformationType.NONE:
-            trans_text = f"Trasformazione: {self.player.transformation.name}"
-            timer_text = f"Tempo: {self.player.transformation_timer // 60}s"
-            text1 = self.small_font.render(trans_text, True, WHITE)
-            text2 = self.small_font.render(timer_text, True, WHITE)
-            self.screen.blit(text1, (10, 50))
-            self.screen.blit(text2, (10, 80))
-
-        # Warning rilevato + gestione vite/game over
-        if self.player.detected:
-            warning = self.font.render("RILEVATO!", True, RED)
-            x = GAME_WIDTH//2 - warning.get_width()//2
-            pygame.draw.rect(self.screen, BLACK, (x-10, 45, warning.get_width()+20, 40))
-            self.screen.blit(warning, (x, 50))
-            self.player.lives -= 1
-            self.player.x, self.player.y = 30, 30
-
-            if self.player.lives <= 0:
-                self.player.lives = 0
-                lives_text = self.font.render(f"Vite rimaste: {self.player.lives}", True, WHITE)
-                self.screen.blit(lives_text, (x, 90))
-                pygame.display.flip()
-                self._append_score(self.player_name, self.level)
-                game_over = self.font.render("GAME OVER! Premi R per riprovare o chiudi per uscire.", True, RED)
-                x_go = GAME_WIDTH//2 - game_over.get_width()//2
-                pygame.draw.rect(self.screen, BLACK, (x_go-10, SCREEN_HEIGHT//2 - 30, game_over.get_width()+20, 40))
-                self.screen.blit(game_over, (x_go, SCREEN_HEIGHT//2 - 20))
-                pygame.display.flip()
-                # loop attesa game-over limitato
-                waiting = True
-                while waiting and self.running:
-                    self.clock.tick(FPS)  # LIMITA FPS
-                    for event in pygame.event.get():
-                        if event.type == pygame.QUIT:
-                            waiting = False
-                            self.running = False
-                        elif event.type == pygame.KEYDOWN:
-                            if event.key == pygame.K_r:
-                                waiting = False
-                                self.level = 1
-                                self.init_level()
-
-    def draw(self):
+        self.screen.blit(lives_text, (x, 90))
+        pygame.display.flip()
+        self._append_score(self.player_name, self.level)
+        game_over = self.font.render("GAME OVER! Premi R per riprovare o chiudi per uscire.", True, RED)
+        x_go = GAME_WIDTH//2 - game_over.get_width()//2
+        pygame.draw.rect(self.screen, BLACK, (x_go-10, SCREEN_HEIGHT//2 - 30, game_over.get_width()+20, 40))
+        self.screen.blit(game_over, (x_go, SCREEN_HEIGHT//2 - 20))
+        pygame.display.flip()
+        # attesa bloccante: nessun frame finché non arriva un tasto
+        while self.running:
+            event = self._wait_key()
+            if event is not None and event.key == pygame.K_r:
+                # nuova partita, nuovi labirinti
+                self.restart(random.getrandbits(32))
+                return
+
+    def draw(self, alpha=1.0):
+        """Frame a alpha fra il tick precedente (0) e quello corrente (1)."""
+        restore = self._interpolate(alpha) if alpha < 1.0 else ()
+        try:
+            self._draw_frame()
+        finally:
+            for entity, x, y in restore:
+                entity.x, entity.y = x, y
+
+    def _draw_frame(self):
+        if self.dirty_rendering and not self._full_redraw:
+            self._draw_dirty()
+            return
         # Sfondo prerender
         self.screen.blit(self.bg_surface, (0, 0))
         # Muri prerender
         self.screen.blit(self.walls_surface, (0, 0))
 
-        # Coni di visione: pulisci surface e disegna tutti i coni, poi blit una volta
-        self.vision_surface.fill((0, 0, 0, 0))
-        for guard in self.guards:
-            guard.draw_vision(self.vision_surface)
-        # Blit unico dei coni di visione
-        self.screen.blit(self.vision_surface, (0, 0))
+        # Coni di visione: stamp precalcolati, composti solo dove ci sono coni
+        self._draw_vision()
+        for rect in self._vision_rects:
+            self.screen.blit(self.vision_surface, rect, rect)
 
+        self._draw_entities()
+
+        # UI
+        self.draw_ui()
+
+        if self.profiler.overlay:
+            self.profiler.draw(self.screen, self.tiny_font)
+        self._present()
+        if self.dirty_rendering:
+            self._prev_rects = self._moving_rects()
+            self._full_redraw = False
+
+    def _draw_vision(self):
+        """Pulisce solo le aree dei coni del frame prima e ci stampa quelli nuovi."""
+        for rect in self._vision_rects:
+            self.vision_surface.fill((0, 0, 0, 0), rect)
+        rects = [guard.draw_vision(self.vision_surface) for guard in self.guards]
+        self._vision_rects = merge_rects(rects)
+
+    def _draw_entities(self):
         # Goal
         self.goal.draw(self.screen)
 
@@ -1163,21 +3351,94 @@ Ecco quali sono e cosa fanno, in breve:
         for pulse in self.nop_pulses:
             pulse.draw(self.screen, self.tiny_font)
 
-        # Effetti particellari
-        for effect in self.particle_effects:
-            effect.draw(self.screen)
-
-        # UI
-        self.draw_ui()
+        # Effetti particellari (un solo blits dal pool)
+        self.particle_pool.draw(self.screen)
 
-        pygame.display.flip()
+    def _moving_rects(self):
+        """Rect (area di gioco) di tutto ciò che si muove o anima in questo frame."""
+        rects = [self.goal.bounds(), self.player.bounds()]
+        rects += [guard.bounds() for guard in self.guards]
+        rects += [pulse.bounds() for pulse in self.nop_pulses]
+        for effect in self.particle_effects:
+            rect = effect.bounds()
+            if rect:
+                rects.append(rect)
+        rects += self.hud.overlay_rects(self.player)
+        if self.profiler.overlay:
+            rects.append(self.profiler.rect)
+        game_area = self.screen.get_rect().clip(0, 0, GAME_WIDTH, GAME_HEIGHT)
+        return [r.clip(game_area) for r in rects if r.colliderect(game_area)]
+
+    def _draw_dirty(self):
+        """Ripristina solo le aree vecchie/nuove degli oggetti mobili e le presenta."""
+        current = self._moving_rects()
+        dirty = self._prev_rects + current
+
+        # Restore sfondo+muri e coni nelle aree sporche (prima tutti i restore, poi gli sprite)
+        self._draw_vision()
+        for rect in dirty:
+            self.screen.blit(self.static_surface, rect, rect)
+            self.screen.blit(self.vision_surface, rect, rect)
+
+        self.screen.set_clip(0, 0, GAME_WIDTH, GAME_HEIGHT)
+        self._draw_entities()
+        self.hud.draw_overlays(self.screen, self.player)
+        if self.profiler.overlay:
+            self.profiler.draw(self.screen, self.tiny_font)
+        self.screen.set_clip(None)
+
+        # HUD: solo i widget cambiati
+        self.hud.update(self)
+        self.hud.draw_panels(self.screen, self.hud.changed_rects)
+
+        self._present(dirty + self.hud.changed_rects)
+        self._prev_rects = current
+
+    def _present(self, rects=None):
+        """Flip a schermo intero o update delle sole aree sporche."""
+        if rects is None:
+            pygame.display.flip()
+        else:
+            pygame.display.update(rects)
 
     def run(self):
+        """
+        Passo fisso: l'accumulatore fa avanzare la simulazione di TICK_DT alla volta
+        indipendentemente dal frame rate; se la macchina resta indietro si saltano
+        i draw (fino a MAX_TICKS_PER_FRAME tick per frame), non si rallenta il gioco.
+        """
+        if self.record_path:
+            self.start_recording()
+        accumulator = 0.0
+        previous = time.perf_counter()
         while self.running:
+            self.profiler.begin_frame()
+            now = time.perf_counter()
+            accumulator += now - previous
+            previous = now
             self.handle_events()
-            self.update()
-            self.draw()
-            self.clock.tick(FPS)  # limita il frame rate anche in-game
+            ticks = 0
+            while accumulator >= TICK_DT and ticks < MAX_TICKS_PER_FRAME and not self.game_over:
+                self._snapshot()
+                self.update()
+                accumulator -= TICK_DT
+                ticks += 1
+            if ticks == MAX_TICKS_PER_FRAME:
+                accumulator = min(accumulator, TICK_DT)
+            # anche nei frame senza tick: _prev_positions dell'ultimo _snapshot restano valide
+            self.draw(min(max(accumulator / TICK_DT, 0.0), 1.0))
+            if self.game_over:
+                self._screen_game_over()
+                # la schermata di game over è bloccante: non recuperare il tempo passato lì
+                accumulator = 0.0
+                previous = time.perf_counter()
+            self.profiler.end_frame()
+            self.clock.tick(RENDER_FPS)
+        if self.input_log is not None:
+            self.input_log.save(self.record_path)
+            print(f"Input registrati in {self.record_path} ({self.ticks} tick)")
+        self.scoreboard.close()
+        self.level_generator.shutdown()
         pygame.quit()
 
 # -----------------------------
@@ -1212,50 +3473,96 @@ def load_custom_sprites(sprite_manager):
 
     def safe_load(path):
         try:
-            return pygame.image.load(path).convert_alpha()
+            return load_image_32(path)
         except Exception as e:
             print(f"Errore caricamento {path}: {e}")
             return None
 
+    def scaled(path, size, big=False):
+        # Adatta dimensioni (la big si scala dalla versione già adattata, come prima)
+        img = safe_load(path)
+        if img is None:
+            return None
+        img = pygame.transform.smoothscale(img, size)
+        if big:
+            img = pygame.transform.smoothscale(img, (int(TILE_SIZE * sprite_manager.big_factor),
+                                                     int(TILE_SIZE * sprite_manager.big_factor)))
+        return img
+
+    jobs = {}
     for key, filename in sprites_to_load.items():
         path = os.path.join(asset_path, filename)
         if not os.path.exists(path):
             continue
         print(f"Caricando asset personalizzato: {path}")
-        img = safe_load(path)
-        if img is None:
-            continue
-
-        # Adatta dimensioni
         if key == 'goal':
-            img = pygame.transform.smoothscale(img, (TILE_SIZE * 2, TILE_SIZE * 2))
+            size = (TILE_SIZE * 2, TILE_SIZE * 2)
         elif key == 'background':
-            img = pygame.transform.smoothscale(img, (GAME_WIDTH, GAME_HEIGHT))
+            size = (GAME_WIDTH, GAME_HEIGHT)
         else:
-            img = pygame.transform.smoothscale(img, (TILE_SIZE, TILE_SIZE))
+            size = (TILE_SIZE, TILE_SIZE)
+        file_key = AssetCache.file_key(path, size, sprite_manager.big_factor)
+        jobs[key] = (file_key, lambda path=path, size=size: scaled(path, size))
+        # Per i gatti (e la guardia): anche la versione big
+        if key.startswith('cat_') or key == 'guard':
+            jobs[f'{key}_big'] = (file_key, lambda path=path, size=size: scaled(path, size, big=True))
 
-        sprite_manager.sprites[key] = img
-
-        # Per i gatti: crea anche la versione big per il player
-        # Per i gatti: crea anche la versione big per TUTTI i cat_*
-        if key.startswith('cat_'):
-            big = pygame.transform.smoothscale(img, (int(TILE_SIZE * sprite_manager.big_factor),
-                                                     int(TILE_SIZE * sprite_manager.big_factor)))
-            sprite_manager.sprites[f'{key}_big'] = big
-
-
-    # Guard big
-    if 'guard' in sprite_manager.sprites:
-        sprite_manager.sprites['guard_big'] = pygame.transform.smoothscale(
-            sprite_manager.sprites['guard'],
-            (int(TILE_SIZE * sprite_manager.big_factor), int(TILE_SIZE * sprite_manager.big_factor))
-        )
+    # Tutto in un colpo: cache su disco + miss scalati in parallelo
+    for key, img in sprite_manager.bake(jobs).items():
+        sprite_manager.sprites[key] = display_ready(img)
 
 # -----------------------------
 # Main
 # -----------------------------
+def run_headless_sweep(seeds, level=1, max_ticks=3600, **kwargs):
+    """Sweep headless: una simulazione per seed, restituisce (seed, livello, vite, tick)."""
+    results = []
+    for seed in seeds:
+        sim = Simulation.from_seed(seed, level=level, **kwargs)
+        ticks = sim.run_headless(max_ticks)
+        results.append((seed, sim.level, sim.player.lives, ticks))
+    return results
+
 if __name__ == "__main__":
-    game = Game()
+    import argparse
+    parser = argparse.ArgumentParser(description="Metamorphic Maze - Sharper Night")
+    parser.add_argument("--headless", action="store_true", help="simula senza finestra né frame cap")
+    parser.add_argument("--seeds", type=int, default=100, help="numero di livelli/seed da simulare")
+    parser.add_argument("--level", type=int, default=1, help="livello di partenza")
+    parser.add_argument("--ticks", type=int, default=3600, help="tick massimi per seed")
+    parser.add_argument("--guard-engine", action="store_true", help="guardie nel motore NumPy batch")
+    parser.add_argument("--max-guards", type=int, default=MAX_GUARDS, help="cap guardie per livello")
+    parser.add_argument("--classic", action="store_true", help="labirinto fisso storico invece di quello procedurale")
+    parser.add_argument("--dirty-rects", action="store_true", help="rendering a dirty-rect (macchine lente)")
+    parser.add_argument("--profile", action="store_true", help="profiler di frame attivo da subito (F3 overlay, F4 trace)")
+    parser.add_argument("--record", metavar="FILE", help="registra gli input della partita in FILE")
+    parser.add_argument("--replay", metavar="FILE", help="rigioca FILE headless verificando i checksum")
+    args = parser.parse_args()
+
+    if args.replay:
+        start = time.perf_counter()
+        ticks, desync = replay(args.replay)
+        elapsed = time.perf_counter() - start
+        if desync is not None:
+            print(f"Replay divergente al tick {desync}")
+            raise SystemExit(1)
+        print(f"Replay ok: {ticks} tick in {elapsed:.2f}s ({ticks / max(elapsed, 1e-9):.0f} tick/s)")
+        raise SystemExit(0)
+
+    if args.headless:
+        start = time.perf_counter()
+        results = run_headless_sweep(range(args.seeds), level=args.level, max_ticks=args.ticks,
+                                     use_guard_engine=args.guard_engine, max_guards=args.max_guards,
+                                     procedural=not args.classic)
+        elapsed = time.perf_counter() - start
+        total_ticks = sum(r[3] for r in results)
+        for seed, level, lives, ticks in results:
+            print(f"seed={seed} livello={level} vite={lives} tick={ticks}")
+        print(f"{len(results)} seed, {total_ticks} tick in {elapsed:.2f}s "
+              f"({total_ticks / max(elapsed, 1e-9):.0f} tick/s)")
+        raise SystemExit(0)
+
+    game = Game(dirty_rendering=args.dirty_rects, record_path=args.record, profile=args.profile)
     load_custom_sprites(game.sprite_manager)
     print("\n=== METAMORPHIC MAZE ===")
     print("Un gioco educativo sulla sicurezza informatica")
@@ -0,0 +1,842 @@
+"""
+Multiplayer locale: server autoritativo UDP e client che interpolano.
+
+Il server fa girare una MultiplayerSimulation a TICK_RATE fisso: ogni player
+ha il suo Player (vite e cariche delle trasformazioni), guardie e impulsi NOP
+sono condivisi. Ogni SNAPSHOT_INTERVAL tick manda a ogni client uno snapshot
+binario: array colonna per colonna, in XOR con l'ultimo snapshot confermato
+dal client (delta) e compresso con zlib. Il client rigenera i muri da
+(seed, livello), decodifica i delta e disegna con INTERP_TICKS di ritardo
+interpolando fra due snapshot.
+
+    python multiplayer.py server --port 47474
+    python multiplayer.py client --host 127.0.0.1 --port 47474
+    python multiplayer.py --self-test
+"""
+import argparse
+import math
+import os
+import random
+import socket
+import struct
+import sys
+import threading
+import time
+import zlib
+from collections import deque
+
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import numpy as np
+import pygame
+
+import game
+from game import (GAME_HEIGHT, GAME_WIDTH, GOAL_POS, GUARD_COLORS, MAX_GUARDS, PLAYER_SPAWN, SNAP_DISTANCE,
+                  TICK_DT, TICK_RATE, TILE_SIZE, Player, Simulation, TransformationType)
+
+DEFAULT_PORT = 47474
+MAX_PLAYERS = 8
+SNAPSHOT_INTERVAL = 2   # tick fra due snapshot (30 Hz)
+INTERP_TICKS = 2 * SNAPSHOT_INTERVAL  # ritardo di render del client: due snapshot
+HISTORY = 64            # snapshot tenuti come base dei delta (server e client)
+CLIENT_TIMEOUT = 5.0    # secondi senza pacchetti prima di liberare lo slot
+RESTART_TICKS = 3 * TICK_RATE  # pausa fra game over e nuova partita
+POS_SCALE = 4           # posizioni in 1/4 di pixel (int16)
+MAX_DATAGRAM = 65507
+
+# -----------------------------
+# Simulazione a più player
+# -----------------------------
+PLAYER_COLORS = ['blimblau', 'red', 'green', 'yellow', 'purple', 'black', 'white']
+
+
+class MultiplayerSimulation(Simulation):
+    """
+    Simulation con un Player per slot contro guardie e impulsi condivisi.
+    Le guardie girano nel GuardEngine: un move per tick, poi uno spot per
+    player; il flow field dell'allerta parte da tutti i player ancora in gioco.
+    step/apply_action mantengono il contratto di Simulation e pilotano il
+    primo slot (self.player); il server usa step_players e apply_player_action.
+    """
+    def __init__(self, seed=None, level=1, max_guards=MAX_GUARDS, procedural=True, background_levels=True):
+        # livelli generati in anticipo in un thread: il cambio livello non ferma il tick del server
+        super().__init__(level=level, seed=seed, use_guard_engine=True, max_guards=max_guards,
+                         procedural=procedural, background_levels=background_levels)
+        self.players = {}  # id slot -> Player
+
+    def add_player(self):
+        """Occupa il primo slot libero; None se la partita è piena."""
+        for pid in range(MAX_PLAYERS):
+            if pid not in self.players:
+                self.players[pid] = self._spawn(None)
+                self._sync_primary()
+                return pid
+        return None
+
+    def remove_player(self, pid):
+        self.players.pop(pid, None)
+        self._sync_primary()
+
+    def _sync_primary(self):
+        # self.player = primo slot occupato (senza player resta quello di servizio della classe base)
+        if self.players:
+            self.player = self.players[min(self.players)]
+
+    def _spawn(self, old):
+        # stesse regole del single player: +1 vita a livello (max 5), chi è a 0 resta fuori
+        if old is None or self.level == 1:
+            lives = 3
+        else:
+            lives = old.lives + 1 if 0 < old.lives < 5 else old.lives
+        return Player(*PLAYER_SPAWN, self.sprite_manager, lives=lives, rng=self.rng)
+
+    def _active(self):
+        return [p for p in self.players.values() if p.lives > 0]
+
+    def init_level(self):
+        super().init_level()
+        # Player nuovi (cariche piene) per tutti gli slot
+        self.players = {pid: self._spawn(old) for pid, old in getattr(self, 'players', {}).items()}
+        self._sync_primary()
+
+    def apply_action(self, trans_type):
+        """Come Simulation.apply_action: trasformazione del primo slot."""
+        if self.players:
+            self.apply_player_action(min(self.players), trans_type)
+
+    def step(self, dx, dy):
+        """Come Simulation.step: input al primo slot, gli altri fermi."""
+        self.step_players({min(self.players): (dx, dy)} if self.players else {})
+
+    def apply_player_action(self, pid, trans_type):
+        """Trasformazione del player pid, con le sue cariche."""
+        player = self.players.get(pid)
+        if player is None or player.lives <= 0:
+            return
+        effect = player.apply_transformation(trans_type, self)
+        if effect:
+            self.particle_effects.append(effect)
+
+    def step_players(self, inputs):
+        """Un tick; inputs: id slot -> (dx, dy) (-1/0/1), chi manca sta fermo."""
+        self.ticks += 1
+        for pid, player in self.players.items():
+            if player.lives > 0:
+                dx, dy = inputs.get(pid, (0, 0))
+                player.move(dx, dy, self.wall_grid)
+                player.update()
+        self._update_guards()
+        self._update_particles()
+        self.goal.update()
+        self._update_pulses()
+        self._resolve_outcome()
+
+    def _update_guards(self):
+        active = self._active()
+        self.flow.set_goals([(p.x, p.y) for p in active])
+        self.guard_engine.move()
+        for player in active:
+            player.detected = self.guard_engine.spot(player)
+
+    def _resolve_outcome(self):
+        goal_rect = pygame.Rect(self.goal.x, self.goal.y, TILE_SIZE * 2, TILE_SIZE * 2)
+        for player in self._active():
+            if pygame.Rect(player.x, player.y, TILE_SIZE, TILE_SIZE).colliderect(goal_rect):
+                # basta un player al goal: livello successivo per tutti
+                self.level += 1
+                self.init_level()
+                return
+        caught = False
+        for player in self._active():
+            if player.detected:
+                player.lives -= 1
+                player.x, player.y = 30, 30
+                caught = True
+        if caught:
+            self._stand_down_guards()  # come Simulation: niente inseguimento fino all'ingresso
+        self.game_over = bool(self.players) and not self._active()
+
+
+# -----------------------------
+# Snapshot (binario, colonnare)
+# -----------------------------
+HEADER = struct.Struct('<IHBBHB')  # seed, livello, game over, player, guardie, impulsi
+PLAYER_DTYPE = np.dtype([('id', 'u1'), ('x', '<i2'), ('y', '<i2'), ('lives', 'u1'), ('color', 'u1'),
+                         ('transformation', 'u1'), ('flags', 'u1'), ('eq', 'u1'), ('nop', 'u1'),
+                         ('combo', 'u1'), ('ibp', 'u1')])
+GUARD_DTYPE = np.dtype([('x', '<i2'), ('y', '<i2'), ('facing', 'u1'), ('color', 'u1'), ('flags', 'u1')])
+PULSE_DTYPE = np.dtype([('x', '<i2'), ('y', '<i2'), ('radius', 'u1')])
+
+PLAYER_FACING_RIGHT = 1
+PLAYER_DETECTED = 2
+GUARD_ALERT = 1
+
+
+class WorldState:
+    """Uno snapshot decodificato: header più un array strutturato per tipo di entità."""
+    def __init__(self, tick, seed, level, game_over, players, guards, pulses):
+        self.tick = tick
+        self.seed = seed
+        self.level = level
+        self.game_over = game_over
+        self.players = players
+        self.guards = guards
+        self.pulses = pulses
+
+
+def _columns(records):
+    # colonna per colonna: in XOR con lo snapshot prima i byte che non cambiano si comprimono a zero
+    return b''.join(records[name].tobytes() for name in records.dtype.names)
+
+
+def _read_columns(dtype, data, offset, count):
+    records = np.zeros(count, dtype=dtype)
+    for name in dtype.names:
+        field = dtype[name]
+        records[name] = np.frombuffer(data, dtype=field, count=count, offset=offset)
+        offset += field.itemsize * count
+    return records, offset
+
+
+def _quantize(values):
+    return np.round(np.asarray(values, dtype=np.float64) * POS_SCALE).astype(np.int16)
+
+
+def encode_world(sim):
+    """Corpo (non compresso) dello snapshot corrente di sim."""
+    players = np.zeros(len(sim.players), dtype=PLAYER_DTYPE)
+    for i, (pid, p) in enumerate(sorted(sim.players.items())):
+        flags = (PLAYER_FACING_RIGHT if p.facing_right else 0) | (PLAYER_DETECTED if p.detected else 0)
+        players[i] = (pid, round(p.x * POS_SCALE), round(p.y * POS_SCALE), p.lives,
+                      PLAYER_COLORS.index(p.color), p.transformation.value, flags,
+                      min(p.rem_eq_transformations, 255), min(p.rem_nop_transformations, 255),
+                      min(p.rem_combo_transformations, 255), min(p.rem_ibp_transformations, 255))
+
+    engine = sim.guard_engine
+    guards = np.zeros(len(sim.guards), dtype=GUARD_DTYPE)
+    if len(guards):
+        guards['x'] = _quantize(engine.x)
+        guards['y'] = _quantize(engine.y)
+        guards['facing'] = np.round(engine.facing_direction * (128 / math.pi)).astype(np.int64) & 255
+        guards['color'] = engine.color_code + 1  # 0 = vede tutti i colori
+        guards['flags'] = np.where(engine.alert > 0, GUARD_ALERT, 0)
+
+    pulses = np.zeros(len(sim.nop_pulses), dtype=PULSE_DTYPE)
+    if len(pulses):
+        pulses['x'] = _quantize([p.x for p in sim.nop_pulses])
+        pulses['y'] = _quantize([p.y for p in sim.nop_pulses])
+        pulses['radius'] = [p.radius for p in sim.nop_pulses]
+
+    header = HEADER.pack(sim.seed, sim.level, sim.game_over, len(players), len(guards), len(pulses))
+    return header + _columns(players) + _columns(guards) + _columns(pulses)
+
+
+def decode_world(tick, body):
+    seed, level, game_over, n_players, n_guards, n_pulses = HEADER.unpack_from(body)
+    offset = HEADER.size
+    players, offset = _read_columns(PLAYER_DTYPE, body, offset, n_players)
+    guards, offset = _read_columns(GUARD_DTYPE, body, offset, n_guards)
+    pulses, offset = _read_columns(PULSE_DTYPE, body, offset, n_pulses)
+    return WorldState(tick, seed, level, bool(game_over), players, guards, pulses)
+
+
+def xor_delta(body, base):
+    """body XOR base sul prefisso comune; il resto resta com'è (simmetrica: codifica e decodifica)."""
+    if base is None:
+        return body
+    out = np.frombuffer(body, dtype=np.uint8).copy()
+    common = min(len(body), len(base))
+    out[:common] ^= np.frombuffer(base, dtype=np.uint8, count=common)
+    return out.tobytes()
+
+
+def lerp_world(a, b, alpha):
+    """Stato a alpha fra a (0) e b (1); a livello cambiato o salti lunghi vale b."""
+    if a.seed != b.seed or a.level != b.level or len(a.guards) != len(b.guards):
+        return b
+    snap = SNAP_DISTANCE * POS_SCALE
+
+    def mix(old, new):
+        old = old.astype(np.float64)
+        new = new.astype(np.float64)
+        return np.where(np.abs(new - old) > snap, new, np.round(old + (new - old) * alpha)).astype(np.int16)
+
+    guards = b.guards.copy()
+    guards['x'] = mix(a.guards['x'], b.guards['x'])
+    guards['y'] = mix(a.guards['y'], b.guards['y'])
+    turn = ((b.guards['facing'].astype(np.int64) - a.guards['facing'] + 128) % 256) - 128
+    guards['facing'] = np.round(a.guards['facing'] + turn * alpha).astype(np.int64) & 255
+
+    players = b.players.copy()
+    previous = {int(p['id']): p for p in a.players}
+    for row in players:
+        old = previous.get(int(row['id']))
+        if old is not None:
+            row['x'] = mix(np.array([old['x']]), np.array([row['x']]))[0]
+            row['y'] = mix(np.array([old['y']]), np.array([row['y']]))[0]
+    tick = a.tick + (b.tick - a.tick) * alpha
+    return WorldState(tick, b.seed, b.level, b.game_over, players, guards, b.pulses)
+
+
+# -----------------------------
+# Protocollo
+# -----------------------------
+JOIN = b'J'
+LEAVE = b'L'
+WELCOME = struct.Struct('<cBII')     # 'W', id slot (255 = pieno), seed, tick rate
+INPUT = struct.Struct('<cIIbbBB')    # 'I', ultimo tick ricevuto, ms client, dx, dy, seq azione, azione
+SNAPSHOT = struct.Struct('<cIII')    # 'S', tick, tick base (0 = completo), eco ms client
+FULL = 255
+
+
+def _ms():
+    return int(time.perf_counter() * 1000) & 0xFFFFFFFF
+
+
+def _percentiles(values):
+    if not values:
+        return {'p50': None, 'p95': None, 'max': None}
+    arr = np.asarray(values, dtype=np.float64)
+    return {'p50': round(float(np.percentile(arr, 50)), 3), 'p95': round(float(np.percentile(arr, 95)), 3),
+            'max': round(float(arr.max()), 3)}
+
+
+class ClientSlot:
+    """Stato del server per un client: ultimo input, ultimo snapshot confermato, contatori."""
+    def __init__(self, pid, now):
+        self.pid = pid
+        self.last_seen = now
+        self.ack = 0
+        self.echo = 0
+        self.move = (0, 0)
+        self.action_seq = 0
+        self.bytes_out = 0
+        self.bytes_in = 0
+
+
+class MazeServer:
+    """
+    Server autoritativo: legge gli input, fa un tick della simulazione a passo
+    fisso e ogni SNAPSHOT_INTERVAL tick manda a ogni client il delta rispetto
+    all'ultimo snapshot che ha confermato (completo se quello non è più in
+    storia). Tempi di tick e byte inviati restano in stats().
+    """
+    def __init__(self, host='127.0.0.1', port=DEFAULT_PORT, seed=None, level=1, max_guards=MAX_GUARDS):
+        self.sim = MultiplayerSimulation(seed=seed, level=level, max_guards=max_guards)
+        self.sim.init_level()
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((host, port))
+        self.sock.setblocking(False)
+        self.address = self.sock.getsockname()
+        self.clients = {}   # indirizzo -> ClientSlot
+        self.history = {}   # tick -> corpo snapshot (base dei delta)
+        self.running = False
+        self._game_over_ticks = 0
+        self.tick_ms = deque(maxlen=600)
+        self.snapshots_full = 0
+        self.snapshots_delta = 0
+        self.bytes_full = 0
+        self.bytes_delta = 0
+        self.bytes_raw = 0
+
+    # ---------- Rete ----------
+    def poll(self):
+        now = time.perf_counter()
+        while True:
+            try:
+                data, addr = self.sock.recvfrom(MAX_DATAGRAM)
+            except (BlockingIOError, InterruptedError):
+                break
+            except ConnectionResetError:
+                continue  # ICMP di una porta chiusa (Windows): il client sparirà per timeout
+            self._handle(data, addr, now)
+        for addr, slot in list(self.clients.items()):
+            if now - slot.last_seen > CLIENT_TIMEOUT:
+                self._drop(addr)
+
+    def _handle(self, data, addr, now):
+        kind = data[:1]
+        slot = self.clients.get(addr)
+        if kind == JOIN:
+            if slot is None:
+                pid = self.sim.add_player()
+                if pid is None:
+                    self.sock.sendto(WELCOME.pack(b'W', FULL, 0, TICK_RATE), addr)
+                    return
+                slot = self.clients[addr] = ClientSlot(pid, now)
+            slot.last_seen = now
+            self.sock.sendto(WELCOME.pack(b'W', slot.pid, self.sim.seed, TICK_RATE), addr)
+        elif kind == LEAVE:
+            if slot is not None:
+                self._drop(addr)
+        elif kind == b'I' and len(data) == INPUT.size and slot is not None:
+            _, ack, echo, dx, dy, action_seq, action = INPUT.unpack(data)
+            slot.last_seen = now
+            slot.bytes_in += len(data)
+            slot.ack = max(slot.ack, ack)
+            slot.echo = echo
+            slot.move = (max(-1, min(1, dx)), max(-1, min(1, dy)))
+            # L'azione viaggia in ogni input finché non cambia seq: una sola applicazione anche con perdite
+            if action_seq != slot.action_seq:
+                slot.action_seq = action_seq
+                if 1 <= action <= 5:
+                    self.sim.apply_player_action(slot.pid, TransformationType(action))
+
+    def _drop(self, addr):
+        slot = self.clients.pop(addr)
+        self.sim.remove_player(slot.pid)
+
+    def _send_snapshot(self):
+        tick = self.sim.ticks
+        body = encode_world(self.sim)
+        self.history[tick] = body
+        while len(self.history) > HISTORY:
+            del self.history[next(iter(self.history))]
+        for addr, slot in self.clients.items():
+            base = self.history.get(slot.ack) if slot.ack else None
+            packet = SNAPSHOT.pack(b'S', tick, slot.ack if base is not None else 0, slot.echo)
+            packet += zlib.compress(xor_delta(body, base))
+            self.sock.sendto(packet, addr)
+            slot.bytes_out += len(packet)
+            self.bytes_raw += len(body)
+            if base is None:
+                self.snapshots_full += 1
+                self.bytes_full += len(packet)
+            else:
+                self.snapshots_delta += 1
+                self.bytes_delta += len(packet)
+
+    # ---------- Tick ----------
+    def tick(self):
+        """Input ricevuti, un passo della simulazione e (a intervalli) gli snapshot."""
+        start = time.perf_counter()
+        self.poll()
+        sim = self.sim
+        if sim.game_over:
+            self._game_over_ticks += 1
+            if self._game_over_ticks >= RESTART_TICKS:
+                self._game_over_ticks = 0
+                sim.restart(sim.rng.getrandbits(32))
+        sim.step_players({slot.pid: slot.move for slot in self.clients.values()})
+        if sim.ticks % SNAPSHOT_INTERVAL == 0:
+            self._send_snapshot()
+        self.tick_ms.append((time.perf_counter() - start) * 1000.0)
+
+    def serve(self, duration=None):
+        """Passo fisso a TICK_RATE fino a stop() (o per duration secondi)."""
+        self.running = True
+        start = next_tick = time.perf_counter()
+        while self.running:
+            now = time.perf_counter()
+            if duration is not None and now - start >= duration:
+                break
+            if now < next_tick:
+                time.sleep(next_tick - now)
+                continue
+            self.tick()
+            next_tick += TICK_DT
+            if now - next_tick > TICK_DT * game.MAX_TICKS_PER_FRAME:
+                next_tick = now  # troppo indietro: si riparte da ora invece di recuperare a raffica
+        self.running = False
+
+    def stop(self):
+        self.running = False
+
+    def close(self):
+        self.sock.close()
+        self.sim.level_generator.shutdown()
+
+    def stats(self):
+        sent = self.snapshots_full + self.snapshots_delta
+        return {
+            'ticks': self.sim.ticks,
+            'clients': len(self.clients),
+            'tick_ms': _percentiles(list(self.tick_ms)),
+            'snapshots': sent,
+            'delta_ratio': round(self.snapshots_delta / sent, 3) if sent else None,
+            'raw_bytes_per_snapshot': round(self.bytes_raw / sent, 1) if sent else None,
+            'full_bytes_per_snapshot': round(self.bytes_full / self.snapshots_full, 1) if self.snapshots_full else None,
+            'delta_bytes_per_snapshot': (round(self.bytes_delta / self.snapshots_delta, 1)
+                                         if self.snapshots_delta else None),
+        }
+
+
+# -----------------------------
+# Client
+# -----------------------------
+class MazeClient:
+    """
+    Client UDP: join, input a ogni frame (con l'ultimo snapshot ricevuto come
+    ack), snapshot decodificati contro la base che il server indica e stato
+    interpolato INTERP_TICKS dietro l'ultimo tick stimato del server.
+    drop > 0 scarta quella frazione di snapshot in arrivo (test delle perdite).
+    """
+    def __init__(self, host='127.0.0.1', port=DEFAULT_PORT, drop=0.0, seed=None):
+        self.server = (host, port)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setblocking(False)
+        self.pid = None
+        self.seed = None
+        self.bodies = {}     # tick -> corpo decodificato (basi per i prossimi delta)
+        self.buffer = deque(maxlen=32)  # WorldState in ordine di tick
+        self.latest = 0
+        self.action_seq = 0
+        self.action = 0
+        self.drop = drop
+        self._rng = random.Random(seed)
+        self._offset = None  # tick server stimato = ora * TICK_RATE + offset
+        self.rtt_ms = deque(maxlen=600)
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.received = 0
+        self.dropped = 0
+        self.undecodable = 0
+        self._started = time.perf_counter()
+
+    def join(self, timeout=2.0):
+        """Chiede uno slot finché non arriva il benvenuto; restituisce l'id o solleva ConnectionError."""
+        deadline = time.perf_counter() + timeout
+        while time.perf_counter() < deadline:
+            self.sock.sendto(JOIN, self.server)
+            retry = time.perf_counter() + 0.2
+            while time.perf_counter() < retry:
+                self.poll()
+                if self.pid is not None:
+                    return self.pid
+                time.sleep(0.005)
+        raise ConnectionError(f"nessuna risposta da {self.server[0]}:{self.server[1]}")
+
+    def leave(self):
+        self.sock.sendto(LEAVE, self.server)
+        self.sock.close()
+
+    def send_input(self, dx, dy, action=None):
+        """Movimento (-1/0/1) e, se c'è, una trasformazione (TransformationType o 1-5)."""
+        if action is not None:
+            self.action_seq = self.action_seq % 255 + 1
+            self.action = int(getattr(action, 'value', action))
+        packet = INPUT.pack(b'I', self.latest, _ms(), dx, dy, self.action_seq, self.action)
+        self.sock.sendto(packet, self.server)
+        self.bytes_out += len(packet)
+
+    def poll(self):
+        while True:
+            try:
+                data, _ = self.sock.recvfrom(MAX_DATAGRAM)
+            except (BlockingIOError, InterruptedError, ConnectionResetError):
+                break
+            kind = data[:1]
+            if kind == b'W' and len(data) == WELCOME.size:
+                _, pid, seed, _ = WELCOME.unpack(data)
+                if pid == FULL:
+                    raise ConnectionError("partita piena")
+                self.pid, self.seed = pid, seed
+            elif kind == b'S':
+                self.bytes_in += len(data)
+                if self.drop and self._rng.random() < self.drop:
+                    self.dropped += 1
+                    continue
+                self._receive(data)
+
+    def _receive(self, data):
+        _, tick, base_tick, echo = SNAPSHOT.unpack_from(data)
+        if tick <= self.latest:
+            return  # arrivato fuori ordine: c'è già di meglio
+        base = None
+        if base_tick:
+            base = self.bodies.get(base_tick)
+            if base is None:
+                self.undecodable += 1
+                return
+        body = xor_delta(zlib.decompress(data[SNAPSHOT.size:]), base)
+        self.bodies[tick] = body
+        while len(self.bodies) > HISTORY:
+            del self.bodies[next(iter(self.bodies))]
+        self.latest = tick
+        self.received += 1
+        self.buffer.append(decode_world(tick, body))
+        now = time.perf_counter()
+        if echo:  # 0 = il server non ha ancora ricevuto input
+            self.rtt_ms.append((_ms() - echo) & 0xFFFFFFFF)
+        # Il campione meno in ritardo è il più vicino al vero tick del server; si recupera piano la deriva
+        sample = tick - now * TICK_RATE
+        if self._offset is None or sample > self._offset:
+            self._offset = sample
+        else:
+            self._offset += (sample - self._offset) * 0.01
+
+    def state(self, now=None):
+        """WorldState interpolato al tick di render (None finché non arriva nulla)."""
+        if not self.buffer:
+            return None
+        now = time.perf_counter() if now is None else now
+        render_tick = now * TICK_RATE + self._offset - INTERP_TICKS
+        older = None
+        for state in self.buffer:
+            if state.tick > render_tick:
+                if older is None:
+                    return state
+                alpha = (render_tick - older.tick) / (state.tick - older.tick)
+                return lerp_world(older, state, alpha)
+            older = state
+        return older  # nessuno snapshot oltre il tick di render: si resta sull'ultimo
+
+    def stats(self):
+        elapsed = max(time.perf_counter() - self._started, 1e-9)
+        return {
+            'pid': self.pid,
+            'snapshots': self.received,
+            'latest_tick': self.latest,
+            'down_kbps': round(self.bytes_in * 8 / 1000 / elapsed, 2),
+            'up_kbps': round(self.bytes_out * 8 / 1000 / elapsed, 2),
+            'rtt_ms': _percentiles(list(self.rtt_ms)),
+            'dropped': self.dropped,
+            'undecodable': self.undecodable,
+        }
+
+
+class ClientView:
+    """Disegna un WorldState con gli stessi sprite e layer del gioco single player."""
+    def __init__(self, screen):
+        self.screen = screen
+        self.sprite_manager = game.SpriteManager(game.AssetCache())
+        self.layers = game.LayerCache()
+        self.font = pygame.font.Font(None, 24)
+        self.tiny_font = pygame.font.Font(None, 20)
+        self.vision_surface = pygame.Surface((GAME_WIDTH, GAME_HEIGHT), pygame.SRCALPHA)
+        self.goal = game.Goal(*GOAL_POS, self.sprite_manager)
+        self.level = None
+        self.static = None
+        self.wall_grid = None
+        self.guards = []
+        self.players = {}
+        self.frame = 0
+
+    def _load_level(self, state):
+        walls = game.generate_level_layout(state.seed, state.level).walls
+        sprites = self.sprite_manager.sprites
+        background = self.layers.background(sprites['floor'], sprites['circuit'])
+        self.static = self.layers.static(background, self.layers.walls(walls, sprites['wall']))
+        self.wall_grid = game.WallGrid(walls)
+        self.guards = []
+        self.level = (state.seed, state.level)
+
+    def _sync(self, state):
+        if len(self.guards) != len(state.guards):
+            self.guards = [game.Guard(0, 0, [(0, 0)], self.sprite_manager, wall_grid=self.wall_grid)
+                           for _ in state.guards]
+        for guard, row in zip(self.guards, state.guards):
+            guard.x = row['x'] / POS_SCALE
+            guard.y = row['y'] / POS_SCALE
+            guard.facing_direction = row['facing'] * (math.pi / 128)
+            guard.detection_color = GUARD_COLORS[row['color'] - 1] if row['color'] else None
+            guard.animation_frame = self.frame % 60
+        seen = set()
+        for row in state.players:
+            pid = int(row['id'])
+            seen.add(pid)
+            player = self.players.get(pid)
+            if player is None:
+                player = self.players[pid] = Player(0, 0, self.sprite_manager)
+            player.x = row['x'] / POS_SCALE
+            player.y = row['y'] / POS_SCALE
+            player.lives = int(row['lives'])
+            player.color = PLAYER_COLORS[row['color']]
+            player.transformation = TransformationType(int(row['transformation']))
+            player.facing_right = bool(row['flags'] & PLAYER_FACING_RIGHT)
+            player.detected = bool(row['flags'] & PLAYER_DETECTED)
+        for pid in set(self.players) - seen:
+            del self.players[pid]
+
+    def draw(self, state, own_pid=None, lines=()):
+        if self.level != (state.seed, state.level):
+            self._load_level(state)
+        self.frame += 1
+        self.goal.update()
+        self._sync(state)
+
+        screen = self.screen
+        screen.fill((0, 0, 0))
+        screen.blit(self.static, (0, 0))
+        self.vision_surface.fill((0, 0, 0, 0))
+        for guard in self.guards:
+            guard.draw_vision(self.vision_surface)
+        screen.blit(self.vision_surface, (0, 0))
+        self.goal.draw(screen)
+        for guard in self.guards:
+            guard.draw_sprite(screen)
+        for pid, player in sorted(self.players.items()):
+            if player.lives > 0:
+                player.draw(screen)
+        for row in state.pulses:
+            pulse = game.NopPulse(row['x'] / POS_SCALE, row['y'] / POS_SCALE, 0, radius=int(row['radius']))
+            pulse.draw(screen, self.tiny_font)
+
+        # Sidebar: livello, un riga per player, righe extra (rete)
+        y = 20
+        texts = [f"Livello {state.level}"]
+        for row in state.players:
+            mark = '>' if int(row['id']) == own_pid else ' '
+            texts.append(f"{mark}P{int(row['id']) + 1} vite {row['lives']}  "
+                         f"{row['eq']}/{row['nop']}/{row['combo']}/{row['ibp']}")
+        if state.game_over:
+            texts.append("GAME OVER")
+        for text in [*texts, *lines]:
+            screen.blit(self.font.render(text, True, (255, 255, 255)), (GAME_WIDTH + 10, y))
+            y += 26
+        pygame.display.flip()
+
+
+def run_client(host, port):
+    """Client con finestra: frecce/WASD per muoversi, 1-5 per le trasformazioni."""
+    pygame.init()
+    client = None
+    try:
+        # anche un join fallito (timeout, partita piena) chiude socket e finestra
+        screen = pygame.display.set_mode((game.SCREEN_WIDTH, game.SCREEN_HEIGHT))
+        pygame.display.set_caption("Metamorphic Maze - multiplayer")
+        view = ClientView(screen)
+        client = MazeClient(host, port)
+        client.join()
+        clock = pygame.time.Clock()
+        keys_to_action = {pygame.K_1: 1, pygame.K_2: 2, pygame.K_3: 3, pygame.K_4: 4, pygame.K_5: 5}
+        running = True
+        while running:
+            action = None
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT or (event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE):
+                    running = False
+                elif event.type == pygame.KEYDOWN and event.key in keys_to_action:
+                    action = keys_to_action[event.key]
+            keys = pygame.key.get_pressed()
+            dx = (keys[pygame.K_RIGHT] or keys[pygame.K_d]) - (keys[pygame.K_LEFT] or keys[pygame.K_a])
+            dy = (keys[pygame.K_DOWN] or keys[pygame.K_s]) - (keys[pygame.K_UP] or keys[pygame.K_w])
+            client.send_input(dx, dy, action)
+            client.poll()
+            state = client.state()
+            if state is not None:
+                stats = client.stats()
+                view.draw(state, client.pid, [f"rtt {stats['rtt_ms']['p50']} ms",
+                                              f"giù {stats['down_kbps']} kbit/s"])
+            clock.tick(TICK_RATE)
+    finally:
+        if client is not None:
+            client.leave()
+        pygame.quit()
+
+
+# -----------------------------
+# Self-test su localhost
+# -----------------------------
+def self_test(clients=2, seconds=3.0, drop=0.1, seed=1):
+    """
+    Server in un thread su 127.0.0.1 (porta libera) e clients client scriptati
+    nel thread principale. Controlla che ogni client riceva snapshot, che i
+    delta decodificati coincidano byte per byte con quelli del server, che i
+    movimenti arrivino e che le cariche restino per player; stampa banda,
+    latenza e tempi di tick. Restituisce True se tutto torna.
+    """
+    server = MazeServer('127.0.0.1', 0, seed=seed, max_guards=8)
+    thread = threading.Thread(target=server.serve, daemon=True)
+    thread.start()
+    host, port = server.address
+    players = [MazeClient(host, port, drop=drop if i else 0.0, seed=i) for i in range(clients)]
+    failures = []
+    try:
+        for client in players:
+            client.join()
+        # Il client 0 usa una sostituzione (una carica EQ): gli altri devono restare pieni
+        end = time.perf_counter() + seconds
+        frame = 0
+        while time.perf_counter() < end:
+            for i, client in enumerate(players):
+                side = (frame // 45 + i) % 4
+                dx, dy = ((1, 0), (0, 1), (-1, 0), (0, -1))[side]
+                action = TransformationType.SUBSTITUTION if (i == 0 and frame == 30) else None
+                client.send_input(dx, dy, action)
+                client.poll()
+                client.state()
+            frame += 1
+            time.sleep(TICK_DT)
+        for client in players:
+            client.poll()
+    finally:
+        server.stop()
+        thread.join()
+
+    pids = [client.pid for client in players]
+    if len(set(pids)) != clients:
+        failures.append(f"id non distinti: {pids}")
+    for client in players:
+        if not client.bodies:
+            failures.append(f"P{client.pid}: nessuno snapshot")
+            continue
+        shared = [tick for tick in client.bodies if tick in server.history]
+        if not shared:
+            failures.append(f"P{client.pid}: nessun tick in comune col server")
+        bad = [tick for tick in shared if client.bodies[tick] != server.history[tick]]
+        if bad:
+            failures.append(f"P{client.pid}: delta decodificati diversi ai tick {bad[:5]}")
+        last = decode_world(client.latest, client.bodies[client.latest])
+        own = [row for row in last.players if row['id'] == client.pid]
+        if not own:
+            failures.append(f"P{client.pid}: assente dallo snapshot")
+            continue
+        row = own[0]
+        if (row['x'], row['y']) == (PLAYER_SPAWN[0] * POS_SCALE, PLAYER_SPAWN[1] * POS_SCALE):
+            failures.append(f"P{client.pid}: mai mosso dallo spawn")
+        expected = game.MAX_EQ_TRANSFORMATIONS - (1 if client is players[0] else 0)
+        if last.level == 1 and row['eq'] != expected:
+            failures.append(f"P{client.pid}: cariche EQ {row['eq']}, attese {expected}")
+    stats = server.stats()
+    if not stats['snapshots'] or not stats['delta_ratio']:
+        failures.append("nessuno snapshot delta inviato")
+
+    print(f"server: {stats}")
+    for client in players:
+        print(f"client: {client.stats()}")
+        client.leave()
+    server.close()
+    for failure in failures:
+        print(f"FALLITO: {failure}")
+    print("self-test ok" if not failures else "self-test fallito")
+    return not failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Metamorphic Maze - multiplayer locale")
+    parser.add_argument("mode", nargs="?", choices=("server", "client"), help="ruolo di questo processo")
+    parser.add_argument("--host", default="127.0.0.1", help="indirizzo del server")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="porta UDP del server")
+    parser.add_argument("--seed", type=int, help="seed della partita (server)")
+    parser.add_argument("--max-guards", type=int, default=MAX_GUARDS, help="cap guardie per livello (server)")
+    parser.add_argument("--self-test", action="store_true", help="server e client scriptati su localhost")
+    parser.add_argument("--clients", type=int, default=2, help="client del self-test")
+    parser.add_argument("--seconds", type=float, default=3.0, help="durata del self-test")
+    parser.add_argument("--drop", type=float, default=0.1, help="snapshot scartati dai client del self-test")
+    args = parser.parse_args()
+
+    if args.self_test:
+        raise SystemExit(0 if self_test(args.clients, args.seconds, args.drop) else 1)
+    if args.mode == "server":
+        server = MazeServer(args.host, args.port, seed=args.seed, max_guards=args.max_guards)
+        print(f"Server su {server.address[0]}:{server.address[1]} (seed {server.sim.seed})")
+        try:
+            server.serve()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            print(server.stats())
+            server.close()
+    elif args.mode == "client":
+        try:
+            run_client(args.host, args.port)
+        except ConnectionError as exc:
+            print(f"Connessione fallita: {exc}", file=sys.stderr)
+            raise SystemExit(1)
+    else:
+        parser.print_help(sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,32 @@
+import os
+import random
+
+import pytest
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+from game import Simulation  # noqa: E402
+
+RESPAWN_GRACE = 60  # tick
+
+
+def _caught(sim, rng, ticks=3000):
+    """Muove il player a caso finché una guardia non lo prende; False se non succede."""
+    for _ in range(ticks):
+        lives = sim.player.lives
+        sim.step(rng.choice([-1, 0, 1]), rng.choice([-1, 0, 1]))
+        if sim.player.lives < lives:
+            return True
+    return False
+
+
+@pytest.mark.parametrize("use_guard_engine", [False, True])
+@pytest.mark.parametrize("seed", [1, 2, 3])
+def test_no_recapture_after_respawn(seed, use_guard_engine):
+    sim = Simulation.from_seed(seed, level=8, use_guard_engine=use_guard_engine)
+    assert _caught(sim, random.Random(seed + 99))
+    assert all(guard.alert == 0 for guard in sim.guards)
+    lives = sim.player.lives
+    for _ in range(RESPAWN_GRACE):
+        sim.step(0, 0)
+    assert sim.player.lives == lives